@@ -14,9 +14,13 @@ import sys
 import tempfile
 from pathlib import Path
 import json
-from typing import Iterable, List, Optional
+import hashlib
+import struct
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
 import subprocess
 import shutil
+import threading
 try:
     import colorama  # type: ignore
     _HAS_COLORAMA = True
@@ -107,6 +111,26 @@ DISABLE_QUICK_EDIT: bool = True  # disabilita QuickEdit per evitare pause su cli
 ALWAYS_ON_TOP: bool = False  # finestra console sempre in primo piano
 WIMLIB_PROGRESS_MODE: str = "line"  # 'line' (singola riga) | 'off' (nascosto)
 INFO_SPINNER: bool = True  # spinner singola riga per comandi informativi (Get-Features/Get-WimInfo)
+EXPORT_CACHE: bool = False  # riusa export identici (GUID sorgente + hash metadati + indici + compressione)
+EXPORT_CACHE_DIR: Optional[Path] = None  # cartella cache export (None => TEMP\\PyDism_ExportCache)
+EXPORT_CACHE_MAX_GB: int = 20  # dimensione massima della cache export (eviction LRU)
+OUTPUT_FORMAT: str = "text"  # 'text' | 'json' | 'jsonl' per i comandi informativi
+OUTPUT_FILE: Optional[Path] = None  # destinazione JSON/JSONL (None => stdout)
+_CLI_OUTPUT_FORMAT: Optional[str] = None  # --output: solo per la sessione, mai salvato
+_CLI_OUTPUT_FILE: Optional[Path] = None  # --output-file: solo per la sessione, mai salvato
+PARALLEL_WORKERS: int = 2  # processi DISM concorrenti nelle operazioni multi-indice
+DRIVER_PREFILTER: bool = True  # passa a /Add-Driver solo gli INF applicabili e non ancora installati
+PLACEMENT_AUTO: bool = False  # sceglie mount base, /ScratchDir ed export temporaneo in base ai benchmark dei volumi
+PLACEMENT_CANDIDATES: List[str] = []  # cartelle candidate (vuoto => dischi fissi/RAM disk locali + TEMP)
+SOURCE_STAGING: bool = False  # copia in locale le sorgenti remote/lente prima di export e mount RO
+STAGING_DIR: Optional[Path] = None  # cache di staging (None => TEMP\PyDism_Staging)
+STAGING_MAX_GB: int = 50  # dimensione massima della cache di staging (eviction LRU)
+CHILD_CPU_PRIORITY: str = "normal"  # classe CPU dei figli DISM/wimlib: idle|below_normal|normal|above_normal|high
+CHILD_IO_PRIORITY: str = "normal"  # priorità I/O dei figli: very_low|low|normal
+CHILD_AFFINITY: List[int] = []  # CPU consentite ai figli (vuoto => tutte)
+CHILD_IO_MBPS: int = 0  # limite banda I/O dei figli in MB/s (0 => nessuno; Windows 10+)
+SPECULATIVE_MOUNT: bool = True  # mount RW in background mentre si risponde ai prompt successivi
+MANIFEST_AUTO: bool = True  # manifest SHA-256 accanto agli artefatti di export/convert/split/join
 
 # Tracciamento cartelle di mount create da questa istanza per cleanup affidabile
 _CREATED_MOUNT_DIRS: List[Path] = []
@@ -190,6 +214,83 @@ def load_config() -> None:
         if isinstance(isp, bool):
             global INFO_SPINNER
             INFO_SPINNER = isp
+        # EXPORT_CACHE / EXPORT_CACHE_DIR / EXPORT_CACHE_MAX_GB
+        ec = data.get("export_cache")
+        if isinstance(ec, bool):
+            global EXPORT_CACHE
+            EXPORT_CACHE = ec
+        ecd = data.get("export_cache_dir")
+        global EXPORT_CACHE_DIR
+        if isinstance(ecd, str) and ecd.strip():
+            EXPORT_CACHE_DIR = Path(ecd)
+        else:
+            EXPORT_CACHE_DIR = None
+        ecm = data.get("export_cache_max_gb")
+        if isinstance(ecm, int) and 1 <= ecm <= 4096:
+            global EXPORT_CACHE_MAX_GB
+            EXPORT_CACHE_MAX_GB = ecm
+        # OUTPUT_FORMAT / OUTPUT_FILE
+        of = data.get("output_format")
+        if isinstance(of, str) and of.lower() in {"text", "json", "jsonl"}:
+            global OUTPUT_FORMAT
+            OUTPUT_FORMAT = of.lower()
+        dp = data.get("driver_prefilter")
+        if isinstance(dp, bool):
+            global DRIVER_PREFILTER
+            DRIVER_PREFILTER = dp
+        pa = data.get("placement_auto")
+        if isinstance(pa, bool):
+            global PLACEMENT_AUTO
+            PLACEMENT_AUTO = pa
+        pc = data.get("placement_candidates")
+        if isinstance(pc, list):
+            global PLACEMENT_CANDIDATES
+            PLACEMENT_CANDIDATES = [str(p) for p in pc if isinstance(p, str) and p.strip()]
+        ss = data.get("source_staging")
+        if isinstance(ss, bool):
+            global SOURCE_STAGING
+            SOURCE_STAGING = ss
+        sd = data.get("staging_dir")
+        global STAGING_DIR
+        STAGING_DIR = Path(sd) if isinstance(sd, str) and sd.strip() else None
+        sm = data.get("staging_max_gb")
+        if isinstance(sm, int) and 1 <= sm <= 4096:
+            global STAGING_MAX_GB
+            STAGING_MAX_GB = sm
+        cp = data.get("child_cpu_priority")
+        if cp in _CPU_CLASSES:
+            global CHILD_CPU_PRIORITY
+            CHILD_CPU_PRIORITY = cp
+        ip = data.get("child_io_priority")
+        if ip in _IO_CLASSES:
+            global CHILD_IO_PRIORITY
+            CHILD_IO_PRIORITY = ip
+        ca = data.get("child_affinity")
+        if isinstance(ca, list):
+            global CHILD_AFFINITY
+            CHILD_AFFINITY = [c for c in ca if isinstance(c, int) and 0 <= c < 64]
+        cm = data.get("child_io_mbps")
+        if isinstance(cm, int) and cm >= 0:
+            global CHILD_IO_MBPS
+            CHILD_IO_MBPS = cm
+        sp = data.get("speculative_mount")
+        if isinstance(sp, bool):
+            global SPECULATIVE_MOUNT
+            SPECULATIVE_MOUNT = sp
+        ma = data.get("manifest_auto")
+        if isinstance(ma, bool):
+            global MANIFEST_AUTO
+            MANIFEST_AUTO = ma
+        pw = data.get("parallel_workers")
+        if isinstance(pw, int) and 1 <= pw <= 16:
+            global PARALLEL_WORKERS
+            PARALLEL_WORKERS = pw
+        ofile = data.get("output_file")
+        global OUTPUT_FILE
+        if isinstance(ofile, str) and ofile.strip():
+            OUTPUT_FILE = Path(ofile)
+        else:
+            OUTPUT_FILE = None
     except Exception as e:
         log_error(f"Error loading config: {e}")
 
@@ -212,6 +313,24 @@ def save_config() -> None:
             "always_on_top": ALWAYS_ON_TOP,
             "wimlib_progress": WIMLIB_PROGRESS_MODE,
             "info_spinner": INFO_SPINNER,
+            "export_cache": EXPORT_CACHE,
+            "export_cache_dir": str(EXPORT_CACHE_DIR) if EXPORT_CACHE_DIR else "",
+            "export_cache_max_gb": EXPORT_CACHE_MAX_GB,
+            "output_format": OUTPUT_FORMAT,
+            "output_file": str(OUTPUT_FILE) if OUTPUT_FILE else "",
+            "parallel_workers": PARALLEL_WORKERS,
+            "driver_prefilter": DRIVER_PREFILTER,
+            "placement_auto": PLACEMENT_AUTO,
+            "placement_candidates": PLACEMENT_CANDIDATES,
+            "source_staging": SOURCE_STAGING,
+            "staging_dir": str(STAGING_DIR) if STAGING_DIR else "",
+            "staging_max_gb": STAGING_MAX_GB,
+            "manifest_auto": MANIFEST_AUTO,
+            "speculative_mount": SPECULATIVE_MOUNT,
+            "child_cpu_priority": CHILD_CPU_PRIORITY,
+            "child_io_priority": CHILD_IO_PRIORITY,
+            "child_affinity": CHILD_AFFINITY,
+            "child_io_mbps": CHILD_IO_MBPS,
         }
         with open(CONFIG_FILE, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
@@ -413,6 +532,7 @@ def menu_cleanup_local_temp_dirs() -> None:
                     _CREATED_MOUNT_DIRS.remove(d)
                 except Exception:
                     pass
+                unregister_mount(d)
                 removed += 1
                 if 'size_before' in locals():
                     reclaimed_bytes += size_before
@@ -745,20 +865,190 @@ def relaunch_as_admin() -> None:
     sys.exit(0)
 
 
+# ====== Priorità CPU/I/O dei processi figli (DISM, wimlib) ======
+# classe -> (flag Windows per CreateProcess/SetPriorityClass, niceness POSIX)
+_CPU_CLASSES = {
+    "idle": (0x00000040, 19),
+    "below_normal": (0x00004000, 10),
+    "normal": (0x00000020, 0),
+    "above_normal": (0x00008000, -5),
+    "high": (0x00000080, -10),
+}
+# priorità I/O -> (IoPriorityHint Windows, (classe ioprio, livello) POSIX via psutil)
+_IO_CLASSES = {"very_low": (0, (3, 0)), "low": (1, (2, 7)), "normal": (2, (2, 4))}
+# profili rapidi per i job: nome -> (cpu, io)
+PRIORITY_PROFILES = {
+    "low": ("idle", "very_low"),
+    "background": ("below_normal", "low"),
+    "normal": ("normal", "normal"),
+    "high": ("high", "normal"),
+}
+
+
+@dataclass
+class ChildPriority:
+    """Priorità applicata ai processi figli: globale (settings.json) o specifica di un job."""
+    __slots__ = ("cpu", "io", "affinity", "io_mbps")
+    cpu: str
+    io: str
+    affinity: List[int]
+    io_mbps: int  # limite banda I/O (0 = nessuno; solo Windows 10+, tramite job object)
+
+    @classmethod
+    def profile(cls, name: str, io_mbps: Optional[int] = None) -> Optional["ChildPriority"]:
+        p = PRIORITY_PROFILES.get(name.lower())
+        if not p:
+            return None
+        return cls(p[0], p[1], list(CHILD_AFFINITY), CHILD_IO_MBPS if io_mbps is None else io_mbps)
+
+    def describe(self) -> str:
+        aff = ",".join(map(str, self.affinity)) or "all"
+        cap = f"{self.io_mbps} MB/s" if self.io_mbps else "no cap"
+        return f"cpu {self.cpu}, io {self.io}, cpus {aff}, {cap}"
+
+
+_WIN_JOB_OBJECTS: Dict[object, int] = {}  # owner (id job o None) -> handle del job object Windows
+_WIN_IO_CAPPED: set = set()  # owner con un limite di banda I/O impostato (da azzerare se rimosso)
+_PRIORITY_WARNED: set = set()
+
+
+def _effective_priority() -> ChildPriority:
+    job = _current_job()
+    if job is not None and job.priority is not None:
+        return job.priority
+    return ChildPriority(CHILD_CPU_PRIORITY, CHILD_IO_PRIORITY, list(CHILD_AFFINITY), CHILD_IO_MBPS)
+
+
+def _priority_warn(key: str, msg: str) -> None:
+    """Un avviso per tipo: le impostazioni non supportate non devono riempire il log."""
+    if key not in _PRIORITY_WARNED:
+        _PRIORITY_WARNED.add(key)
+        log_error(f"[PRIORITY] {msg}")
+
+
+class _IoRateControl(ctypes.Structure):
+    _fields_ = [("MaxIops", ctypes.c_int64), ("MaxBandwidth", ctypes.c_int64), ("ReservationIops", ctypes.c_int64),
+                ("VolumeName", ctypes.c_wchar_p), ("BaseIoSize", ctypes.c_uint32), ("ControlFlags", ctypes.c_uint32)]
+
+
+class _JobBasicLimits(ctypes.Structure):
+    _fields_ = [("PerProcessUserTimeLimit", ctypes.c_int64), ("PerJobUserTimeLimit", ctypes.c_int64),
+                ("LimitFlags", ctypes.c_uint32), ("MinimumWorkingSetSize", ctypes.c_size_t),
+                ("MaximumWorkingSetSize", ctypes.c_size_t), ("ActiveProcessLimit", ctypes.c_uint32),
+                ("Affinity", ctypes.c_size_t), ("PriorityClass", ctypes.c_uint32), ("SchedulingClass", ctypes.c_uint32)]
+
+
+def _win_job(owner: object, prio: ChildPriority) -> Optional[int]:
+    """Job object Windows (uno per job PyDism o per il foreground) con classe CPU, affinità e limite di
+    banda I/O. I processi avviati da DISM (DismHost.exe, che fa il lavoro) entrano nello stesso job
+    object, quindi i limiti valgono per tutto l'albero; SetPriorityClass sul solo dism.exe non basta,
+    perché above_normal/high non vengono ereditati. La priorità I/O non ha un equivalente nei job
+    object: resta applicata al solo dism.exe.
+    """
+    k32 = ctypes.windll.kernel32
+    h = _WIN_JOB_OBJECTS.get(owner)
+    if h is None:
+        h = k32.CreateJobObjectW(None, None)
+        if not h:
+            return None
+        _WIN_JOB_OBJECTS[owner] = h
+    mask = sum(1 << c for c in prio.affinity)
+    # JOB_OBJECT_LIMIT_PRIORITY_CLASS (0x20) | JOB_OBJECT_LIMIT_AFFINITY (0x10); JobObjectBasicLimitInformation = 2
+    limits = _JobBasicLimits(0, 0, 0x20 | (0x10 if mask else 0), 0, 0, 0, mask,
+                             _CPU_CLASSES.get(prio.cpu, _CPU_CLASSES["normal"])[0], 0)
+    if not k32.SetInformationJobObject(ctypes.c_void_p(h), 2, ctypes.byref(limits), ctypes.sizeof(limits)):
+        _priority_warn("jobprio", f"classe CPU/affinità sul job object non applicabili (errore {k32.GetLastError()})")
+    if prio.io_mbps or owner in _WIN_IO_CAPPED:
+        info = _IoRateControl(0, prio.io_mbps * 1024 * 1024 if prio.io_mbps else 0, 0, None, 0, 1 if prio.io_mbps else 0)
+        if not k32.SetIoRateControlInformationJobObject(ctypes.c_void_p(h), ctypes.byref(info)):
+            _priority_warn("iorate", f"limite banda I/O non applicabile (errore {k32.GetLastError()})")
+        elif prio.io_mbps:
+            _WIN_IO_CAPPED.add(owner)
+        else:
+            _WIN_IO_CAPPED.discard(owner)
+    return h
+
+
+def apply_child_priority(proc: subprocess.Popen, prio: Optional[ChildPriority] = None, owner: object = None) -> None:
+    """Applica a un figlio già avviato priorità I/O, affinità e limite di banda (la classe CPU
+    è già impostata alla creazione su Windows). Usata anche per cambiare priorità a un job in corso.
+    owner: id del job PyDism a cui appartiene il figlio (None = menu), per il job object Windows.
+    Ogni impostazione è best effort: un errore viene annotato nel log e non interrompe l'operazione.
+    """
+    prio = prio or _effective_priority()
+    cpu_flag, nice = _CPU_CLASSES.get(prio.cpu, _CPU_CLASSES["normal"])
+    io_hint, ioprio = _IO_CLASSES.get(prio.io, _IO_CLASSES["normal"])
+    if os.name == "nt":
+        k32 = ctypes.windll.kernel32
+        # PROCESS_SET_INFORMATION | PROCESS_SET_QUOTA | PROCESS_TERMINATE
+        h = k32.OpenProcess(0x0200 | 0x0100 | 0x0001, False, proc.pid)
+        if not h:
+            _priority_warn("open", f"OpenProcess fallita per pid {proc.pid}")
+            return
+        try:
+            k32.SetPriorityClass(h, cpu_flag)
+            value = ctypes.c_ulong(io_hint)
+            # ProcessIoPriority = 33
+            if ctypes.windll.ntdll.NtSetInformationProcess(h, 33, ctypes.byref(value), ctypes.sizeof(value)) != 0:
+                _priority_warn("io", "priorità I/O non applicabile")
+            if prio.affinity:
+                mask = sum(1 << c for c in prio.affinity)
+                if not k32.SetProcessAffinityMask(h, ctypes.c_size_t(mask)):
+                    _priority_warn("affinity", f"affinità {prio.affinity} non applicabile")
+            # Job object: i limiti si estendono ai processi che dism.exe avvia dopo l'assegnazione
+            hjob = _win_job(owner, prio)
+            if hjob and not k32.AssignProcessToJobObject(ctypes.c_void_p(hjob), h):
+                _priority_warn("assign", f"AssignProcessToJobObject fallita (errore {k32.GetLastError()})")
+        finally:
+            k32.CloseHandle(h)
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, proc.pid, nice)
+    except (OSError, AttributeError) as e:
+        _priority_warn("nice", f"niceness {nice} non applicabile: {e}")
+    if prio.affinity and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(proc.pid, set(prio.affinity))
+        except OSError as e:
+            _priority_warn("affinity", f"affinità {prio.affinity} non applicabile: {e}")
+    if prio.io != "normal":
+        try:
+            import psutil  # type: ignore
+            psutil.Process(proc.pid).ionice(*ioprio)
+        except ImportError:
+            _priority_warn("psutil", "priorità I/O su POSIX richiede psutil")
+        except Exception as e:
+            _priority_warn("io", f"priorità I/O non applicabile: {e}")
+    if prio.io_mbps:
+        _priority_warn("iorate", "limite banda I/O supportato solo su Windows")
+
+
+def _popen_child(cmd: List[str], **kwargs) -> subprocess.Popen:
+    """subprocess.Popen con la priorità corrente (globale o del job) applicata al figlio."""
+    prio = _effective_priority()
+    if os.name == "nt":
+        kwargs["creationflags"] = kwargs.get("creationflags", 0) | _CPU_CLASSES.get(prio.cpu, _CPU_CLASSES["normal"])[0]
+    proc = subprocess.Popen(cmd, **kwargs)
+    if prio != ChildPriority("normal", "normal", [], 0):
+        job = _current_job()
+        apply_child_priority(proc, prio, job.id if job is not None else None)
+    return proc
+
+
 def run(cmd: List[str], check: bool = False, capture: Optional[bool] = None, cwd: Optional[Path] = None) -> subprocess.CompletedProcess:
     # Usa esecuzione sicura senza shell, cattura stdout/stderr opzionalmente
     if capture is None:
         capture = VERBOSE
     try:
-        cp = subprocess.run(
-            cmd,
-            check=False,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-            capture_output=capture,
-            cwd=str(cwd) if cwd else None,
-        )
+        pipe = subprocess.PIPE if capture else None
+        with _popen_child(cmd, stdout=pipe, stderr=pipe, text=True, encoding="utf-8", errors="replace",
+                          cwd=str(cwd) if cwd else None) as proc:
+            try:
+                out, err = proc.communicate()
+            except BaseException:
+                proc.kill()
+                raise
+        cp = subprocess.CompletedProcess(cmd, proc.returncode, out, err)
     except FileNotFoundError:
         log_error(f"Comando non trovato: {cmd[0]}")
         raise
@@ -791,9 +1081,199 @@ def dism(*args: str, capture: Optional[bool] = None, check: bool = False) -> sub
     return run(["dism", *args], capture=capture, check=check)
 
 
+# ====== Coordinamento tra istanze (lock advisory e registro dei mount condiviso) ======
+_IPC_DIR_NAME = ".pydism"
+_IPC_LOCK = threading.Lock()
+
+
+class _FileLock:
+    """Lock advisory tra processi su un file. Il sistema lo rilascia anche se il processo
+    termina in modo anomalo, quindi un lock acquisibile indica sempre uno stato orfano.
+    Su Windows si blocca un byte oltre il contenuto, che resta leggibile dalle altre istanze.
+    """
+    _OFFSET = 1 << 30
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._fh = None
+
+    def try_acquire(self, info: Optional[Dict[str, object]] = None) -> bool:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab"):
+            pass
+        fh = open(self.path, "r+b")
+        try:
+            if os.name == "nt":
+                import msvcrt  # type: ignore
+                fh.seek(self._OFFSET)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fh.close()
+            return False
+        if info is not None:
+            fh.seek(0)
+            fh.truncate()
+            fh.write(json.dumps(info, ensure_ascii=False).encode("utf-8"))
+            fh.flush()
+        self._fh = fh
+        return True
+
+    def release(self) -> None:
+        fh, self._fh = self._fh, None
+        if fh is None:
+            return
+        try:
+            if os.name == "nt":
+                import msvcrt  # type: ignore
+                fh.seek(self._OFFSET)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        fh.close()
+
+    def read_info(self) -> Dict[str, object]:
+        try:
+            return json.loads(self.path.read_bytes().decode("utf-8") or "{}")
+        except (OSError, ValueError):
+            return {}
+
+
+# lock tenuti da questa istanza: chiave -> [lock, contatore] (più mount RO della stessa immagine)
+_IPC_HELD: Dict[str, list] = {}
+# mount registrati da questa istanza: chiave cartella -> (lock della voce di registro, chiave immagine)
+_IPC_MOUNTS: Dict[str, tuple] = {}
+
+
+def _ipc_dir(sub: str) -> Path:
+    """Registro condiviso accanto ai mount: tutte le istanze con lo stesso MOUNT_BASE lo vedono."""
+    return (MOUNT_BASE or Path(TEMP)) / _IPC_DIR_NAME / sub
+
+
+def _ipc_owner_info(**extra) -> Dict[str, object]:
+    import platform
+    return {"pid": os.getpid(), "host": platform.node(), "since": time.strftime("%Y-%m-%dT%H:%M:%S"), **extra}
+
+
+def ipc_acquire(key: str, what: str) -> Optional[Dict[str, object]]:
+    """Lock esclusivo tra istanze su una risorsa (ricorsivo all'interno dell'istanza).
+    Ritorna None se acquisito, altrimenti le informazioni sul proprietario.
+    """
+    with _IPC_LOCK:
+        held = _IPC_HELD.get(key)
+        if held:
+            held[1] += 1
+            return None
+        lock = _FileLock(_ipc_dir("locks") / (hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + ".lock"))
+        if not lock.try_acquire(_ipc_owner_info(resource=what)):
+            return lock.read_info() or {"pid": "?"}
+        _IPC_HELD[key] = [lock, 1]
+        return None
+
+
+def ipc_release(key: str) -> None:
+    with _IPC_LOCK:
+        held = _IPC_HELD.get(key)
+        if not held:
+            return
+        held[1] -= 1
+        if held[1] <= 0:
+            held[0].release()
+            del _IPC_HELD[key]
+
+
+def register_mount(mount_dir: Path, image: Path, index: Optional[int], ro: bool) -> None:
+    """Riserva l'immagine tra istanze e pubblica il mount nel registro condiviso.
+    Solleva RuntimeError se un'altra istanza PyDism sta usando la stessa immagine.
+    """
+    img_key = _resource_key(image)
+    owner = ipc_acquire(img_key, str(image))
+    if owner is not None:
+        raise RuntimeError(f"{image} is in use by another PyDism instance (pid {owner.get('pid')}, since {owner.get('since', '?')}).")
+    entry = _FileLock(_ipc_dir("mounts") / (mount_dir.name + ".json"))
+    info = _ipc_owner_info(mount_dir=str(mount_dir), image=str(image), index=index, readonly=ro)
+    if not entry.try_acquire(info):
+        ipc_release(img_key)
+        raise RuntimeError(f"Mount folder {mount_dir} is registered by another PyDism instance.")
+    with _IPC_LOCK:
+        _IPC_MOUNTS[_resource_key(mount_dir)] = (entry, img_key)
+
+
+def unregister_mount(mount_dir: Path) -> None:
+    with _IPC_LOCK:
+        item = _IPC_MOUNTS.pop(_resource_key(mount_dir), None)
+    if not item:
+        return
+    entry, img_key = item
+    entry.release()
+    try:
+        entry.path.unlink()
+    except OSError:
+        pass
+    ipc_release(img_key)
+
+
+def registered_mounts() -> List[Dict[str, object]]:
+    """Voci del registro con 'live': True se l'istanza proprietaria è ancora attiva (lock tenuto)."""
+    out = []
+    d = _ipc_dir("mounts")
+    if not d.is_dir():
+        return out
+    with _IPC_LOCK:
+        ours = {e.path for e, _ in _IPC_MOUNTS.values()}
+    for p in sorted(d.glob("*.json")):
+        probe = _FileLock(p)
+        info = probe.read_info()
+        if p in ours:
+            live = True
+        elif probe.try_acquire():
+            probe.release()
+            live = False
+        else:
+            live = True
+        out.append({**info, "entry": str(p), "live": live})
+    return out
+
+
+def _cleanup_orphan_registry() -> int:
+    """Smonta (discard) e rimuove solo i mount registrati da istanze non più attive."""
+    n = 0
+    for e in registered_mounts():
+        if e["live"]:
+            continue
+        probe = _FileLock(Path(str(e["entry"])))
+        if not probe.try_acquire():
+            continue  # ripreso nel frattempo da un'altra istanza che sta pulendo
+        try:
+            mdir = Path(str(e.get("mount_dir") or ""))
+            if e.get("mount_dir") and mdir.exists():
+                log_error(f"[CLEANUP] mount orfano di pid {e.get('pid')}: {mdir} ({e.get('image')})")
+                run(["dism", "/Unmount-Wim", f"/MountDir:{mdir}", "/Discard"], check=False)
+                _remove_dir_tree(mdir)
+            n += 1
+        finally:
+            probe.release()
+            try:
+                probe.path.unlink()
+            except OSError:
+                pass
+    return n
+
+
 def cleanup_mountpoints() -> None:
+    """Pulisce i mount orfani. /Cleanup-Mountpoints agisce su tutto il sistema, quindi viene
+    eseguito solo se nessun'altra istanza PyDism ha mount attivi nel registro condiviso.
+    """
+    _cleanup_orphan_registry()
+    others = [e for e in registered_mounts() if e["live"] and e.get("pid") != os.getpid()]
+    if others:
+        log_error(f"[CLEANUP] /Cleanup-Mountpoints saltato: {len(others)} mount attivi di altre istanze")
+        return
     run(["dism", "/Cleanup-Mountpoints"], check=False)
 
+
 def _onerror_make_writable(func, path, exc_info):
     try:
         os.chmod(path, 0o777)
@@ -863,10 +1343,15 @@ def _atexit_cleanup() -> None:
             _remove_dir_tree(d)
         except Exception:
             pass
+        unregister_mount(d)
 
 atexit.register(_atexit_cleanup)
 
 def show_mounted_wims() -> None:
+    if _json_mode():
+        res = get_mounted_images()
+        emit_records("mount", res.records, returncode=res.returncode)
+        return
     print_header("Current mounted WIMs")
     cp = dism("/Get-MountedWimInfo", capture=True)
     if cp.stdout:
@@ -880,7 +1365,10 @@ def cleanup_orphan_mounts() -> None:
     if ans not in {"y", "yes"}:
         print("Operation cancelled.")
         return
+    others = [e for e in registered_mounts() if e["live"] and e.get("pid") != os.getpid()]
     cleanup_mountpoints()
+    if others:
+        print(f"[INFO] {len(others)} mount(s) of other PyDism instances are active: only orphaned mounts were cleaned.")
     print("[OK] Cleanup completed.")
     # Show mount status immediately for verification
     print()
@@ -888,17 +1376,29 @@ def cleanup_orphan_mounts() -> None:
     show_mounted_wims()
 
 
-def make_temp_mount(prefix: str = "mnt_") -> Path:
-    cleanup_mountpoints()
+def make_temp_mount(prefix: str = "mnt_", cleanup: bool = True, base: Optional[Path] = None,
+                    image: Optional[Path] = None, index: Optional[int] = None, ro: bool = False) -> Path:
+    # cleanup=False quando altri mount sono in corso (fan-out parallelo): /Cleanup-Mountpoints li disturberebbe
+    # base: cartella scelta dal pianificatore per questa operazione (default MOUNT_BASE)
+    # image/index/ro: il mount viene registrato per le altre istanze e l'immagine riservata
+    if cleanup:
+        cleanup_mountpoints()
     base_dir: Optional[str] = None
-    if MOUNT_BASE:
+    base = base or MOUNT_BASE
+    if base:
         try:
-            MOUNT_BASE.mkdir(parents=True, exist_ok=True)
-            base_dir = str(MOUNT_BASE)
+            base.mkdir(parents=True, exist_ok=True)
+            base_dir = str(base)
         except Exception as e:
-            print(f"[WARN] Unable to use custom mount folder '{MOUNT_BASE}': {e}. Using TEMP.")
+            print(f"[WARN] Unable to use custom mount folder '{base}': {e}. Using TEMP.")
             base_dir = None
     mount_dir = Path(tempfile.mkdtemp(prefix=prefix, dir=base_dir))
+    if image is not None:
+        try:
+            register_mount(mount_dir, image, index, ro)
+        except RuntimeError:
+            _remove_dir_tree(mount_dir)
+            raise
     # Traccia per cleanup a fine processo
     _CREATED_MOUNT_DIRS.append(mount_dir)
     return mount_dir
@@ -906,20 +1406,29 @@ def make_temp_mount(prefix: str = "mnt_") -> Path:
 
 def unmount(mount_dir: Path, commit: bool = False) -> None:
     if not mount_dir or not mount_dir.exists():
+        if mount_dir:
+            _release_foreground(mount_dir)
         return
     args = ["/Unmount-Wim", f"/MountDir:{str(mount_dir)}", "/Commit" if commit else "/Discard"]
     _stream_dism_progress(args)
+    _forget_mount_dir(mount_dir)
+    _release_foreground(mount_dir)
+
+
+def _forget_mount_dir(mount_dir: Path) -> None:
+    """Rimuove una cartella di mount già smontata e la toglie dal tracciamento di sessione."""
     # Togli la cartella
     try:
         _remove_dir_tree(mount_dir)
     except Exception:
         pass
-    # Rimuovi dalla lista di tracciamento
+    # Rimuovi dalla lista di tracciamento e dal registro condiviso
     try:
         if mount_dir in _CREATED_MOUNT_DIRS:
             _CREATED_MOUNT_DIRS.remove(mount_dir)
     except Exception:
         pass
+    unregister_mount(mount_dir)
 
 
 def ensure_rw_allowed(image_path: Path) -> None:
@@ -929,19 +1438,102 @@ def ensure_rw_allowed(image_path: Path) -> None:
 
 # ===== Input e autocompletamento =====
 try:
-    from prompt_toolkit import prompt  # type: ignore
-    from prompt_toolkit.completion import PathCompleter  # type: ignore
+    from prompt_toolkit import PromptSession  # type: ignore
+    from prompt_toolkit.completion import Completer, Completion, ThreadedCompleter  # type: ignore
+    from prompt_toolkit.history import FileHistory, InMemoryHistory  # type: ignore
     HAVE_PTK = True
 except Exception as e:
     HAVE_PTK = False
     print(color(f"[DEBUG] prompt_toolkit NON disponibile: {e}", fg="bright_red"))
 
-def input_path(prompt_text: str) -> str:
-    """Input percorso con autocompletamento TAB."""
+IMAGE_EXTS = (".wim", ".esd", ".swm")
+PACKAGE_EXTS = (".cab", ".msu")
+DRIVER_EXTS = (".inf",)
+PATH_HISTORY_FILE = CONFIG_DIR / "path_history.txt"
+DIR_CACHE_TTL = 30.0  # secondi: su share UNC molto popolose l'elenco resta valido tra un TAB e l'altro
+_DIR_CACHE_MAX_ENTRIES = 5000
+
+
+class _DirListingCache:
+    """Elenchi di cartella (nome, è_cartella) con scadenza, condivisi da tutti i prompt."""
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: Dict[str, tuple] = {}
+
+    def list(self, folder: str) -> List[tuple]:
+        key = os.path.normcase(os.path.abspath(folder))
+        now = time.monotonic()
+        with self._lock:
+            hit = self._data.get(key)
+            if hit and now - hit[0] < self.ttl:
+                return hit[1]
+        entries: List[tuple] = []
+        try:
+            with os.scandir(folder) as it:
+                for de in it:
+                    try:
+                        entries.append((de.name, de.is_dir()))
+                    except OSError:
+                        continue
+                    if len(entries) >= _DIR_CACHE_MAX_ENTRIES:
+                        break
+        except OSError:
+            entries = []
+        entries.sort(key=lambda e: (not e[1], e[0].lower()))
+        with self._lock:
+            self._data[key] = (now, entries)
+        return entries
+
+
+_DIR_CACHE = _DirListingCache(DIR_CACHE_TTL)
+_PROMPT_SESSION = None
+
+if HAVE_PTK:
+    class _CachedPathCompleter(Completer):
+        """Completamento percorsi da _DIR_CACHE, con i file filtrati per estensione (cartelle sempre proposte)."""
+
+        def __init__(self, exts: Optional[Iterable[str]] = None) -> None:
+            self.exts = tuple(e.lower() for e in exts) if exts else None
+
+        def get_completions(self, document, complete_event):
+            text = document.text_before_cursor
+            expanded = os.path.expanduser(os.path.expandvars(text))
+            if not expanded or expanded.endswith(("/", "\\")):
+                folder, partial = expanded or ".", ""
+            else:
+                folder, partial = os.path.split(expanded)
+                folder = folder or "."
+            low = partial.lower()
+            for name, is_dir in _DIR_CACHE.list(folder):
+                if not name.lower().startswith(low):
+                    continue
+                if not is_dir and self.exts and not name.lower().endswith(self.exts):
+                    continue
+                shown = name + (os.sep if is_dir else "")
+                yield Completion(name[len(partial):] + (os.sep if is_dir else ""), start_position=0, display=shown)
+
+
+def _prompt_session():
+    """Una sola PromptSession per tutta la sessione, con storico persistente dei percorsi."""
+    global _PROMPT_SESSION
+    if _PROMPT_SESSION is None:
+        try:
+            CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+            history = FileHistory(str(PATH_HISTORY_FILE))
+        except OSError:
+            history = InMemoryHistory()
+        _PROMPT_SESSION = PromptSession(history=history)
+    return _PROMPT_SESSION
+
+
+def input_path(prompt_text: str, exts: Optional[Iterable[str]] = None) -> str:
+    """Input percorso con autocompletamento TAB (in background, elenchi di cartella in cache)."""
     if HAVE_PTK:
         try:
-            result = prompt(prompt_text, completer=PathCompleter())
-            return result
+            completer = ThreadedCompleter(_CachedPathCompleter(exts))
+            return _prompt_session().prompt(prompt_text, completer=completer, complete_while_typing=False)
         except Exception as e:
             print(color(f"[DEBUG] prompt_toolkit ERRORE: {type(e).__name__}: {e}", fg="bright_yellow"))
             log_error(f"prompt_toolkit error: {type(e).__name__}: {e}")
@@ -951,8 +1543,8 @@ def input_path(prompt_text: str) -> str:
     return input(prompt_text)
 
 
-def ask_path(prompt: str) -> Optional[Path]:
-    p = input_path(prompt).strip().strip('"')
+def ask_path(prompt: str, exts: Optional[Iterable[str]] = None) -> Optional[Path]:
+    p = input_path(prompt, exts).strip().strip('"')
     if not p:
         return None
     path = Path(p)
@@ -962,13 +1554,13 @@ def ask_path(prompt: str) -> Optional[Path]:
     return path
 
 
-def ask_output_path(prompt: str) -> Optional[Path]:
+def ask_output_path(prompt: str, exts: Optional[Iterable[str]] = IMAGE_EXTS) -> Optional[Path]:
     """Chiede un percorso di OUTPUT.
     - Accetta file che NON esistono ancora.
     - Richiede che la cartella padre esista ed è una directory.
     - Rifiuta percorsi che puntano a una cartella esistente.
     """
-    p = input_path(prompt).strip().strip('"')
+    p = input_path(prompt, exts).strip().strip('"')
     if not p:
         return None
     path = Path(p)
@@ -983,16 +1575,191 @@ def ask_output_path(prompt: str) -> Optional[Path]:
     return path
 
 
-def ask_index() -> Optional[int]:
-    s = input("Indice: ").strip()
+def ask_index(wim: Optional[Path] = None) -> Optional[int]:
+    """Indice numerico; con 'wim' mostra gli indici dal catalogo e accetta anche il nome dell'edizione."""
+    meta = image_meta(wim) if wim else None
+    if meta:
+        _print_image_indexes(meta)
+        s = input("Index (number or name): ").strip()
+    else:
+        s = input("Indice: ").strip()
     if not s:
         return None
+    if meta and not s.isdigit():
+        return _match_index_name(meta, s)
     if not re.fullmatch(r"\d+", s):
         print("[ERRORE] L'indice deve essere numerico.")
         return None
     return int(s)
 
 
+# ====== Catalogo immagini recenti (metadati nativi, prefetch in background) ======
+RECENT_IMAGES_FILE = CONFIG_DIR / "recent_images.json"
+RECENT_IMAGES_MAX = 15
+RECENT_IMAGES_SHOWN = 9
+_RECENT_LOCK = threading.Lock()
+_IMAGE_META: Dict[str, Dict[str, object]] = {}
+_IMAGE_META_THREADS: Dict[str, threading.Thread] = {}
+
+
+def _load_recent_images() -> List[Dict[str, object]]:
+    try:
+        data = json.loads(RECENT_IMAGES_FILE.read_text(encoding="utf-8"))
+        return [e for e in data if isinstance(e, dict) and e.get("path")] if isinstance(data, list) else []
+    except (OSError, ValueError):
+        return []
+
+
+def _read_image_meta(p: Path) -> Optional[Dict[str, object]]:
+    """Percorso, GUID e nome/dimensione per indice dall'header e dall'XML del WIM (nessun DISM)."""
+    hdr = _read_wim_header(p)
+    if hdr is None:
+        return None
+    st = p.stat()
+    images = [{"index": int(x.get("INDEX") or 0), "name": x.get("NAME") or x.get("DISPLAYNAME") or "",
+               "size": int(x.get("TOTALBYTES") or 0)} for x in _read_wim_xml(p, hdr)]
+    return {"path": str(p), "guid": hdr.guid, "size": st.st_size, "mtime": st.st_mtime, "images": images}
+
+
+def _remember_image(meta: Dict[str, object]) -> None:
+    """Porta l'immagine in testa al catalogo (persistito accanto a settings.json)."""
+    key = _resource_key(Path(str(meta["path"])))
+    with _RECENT_LOCK:
+        entries = [e for e in _load_recent_images() if _resource_key(Path(str(e["path"]))) != key]
+        entries.insert(0, {**meta, "used": time.time()})
+        try:
+            # File temporaneo + os.replace: chi legge senza lock vede sempre un JSON completo
+            CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = RECENT_IMAGES_FILE.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entries[:RECENT_IMAGES_MAX], f, ensure_ascii=False, indent=2)
+            os.replace(tmp, RECENT_IMAGES_FILE)
+        except OSError as e:
+            log_error(f"[RECENT] salvataggio catalogo fallito: {e}")
+
+
+def _fetch_image_meta(p: Path) -> None:
+    key = _resource_key(p)
+    try:
+        st = p.stat()
+        cached = next((e for e in _load_recent_images() if _resource_key(Path(str(e["path"]))) == key
+                       and e.get("size") == st.st_size and e.get("mtime") == st.st_mtime), None)
+        meta = cached or _read_image_meta(p)
+    except OSError as e:
+        log_error(f"[RECENT] lettura metadati {p}: {e}")
+        meta = None
+    if meta:
+        meta = {k: v for k, v in meta.items() if k != "used"}
+        _IMAGE_META[key] = meta
+        _remember_image(meta)
+
+
+def prefetch_image_meta(p: Path) -> None:
+    """Legge i metadati in background appena il percorso è noto (il prompt successivo non attende)."""
+    key = _resource_key(p)
+    t = _IMAGE_META_THREADS.get(key)
+    if key in _IMAGE_META or (t is not None and t.is_alive()):
+        return
+    t = threading.Thread(target=_fetch_image_meta, args=(p,), daemon=True)
+    _IMAGE_META_THREADS[key] = t
+    t.start()
+
+
+def image_meta(p: Path, timeout: float = 5.0) -> Optional[Dict[str, object]]:
+    """Metadati dell'immagine (attende il prefetch se ancora in corso); None se non è un WIM leggibile.
+    Rilegge se dimensione o mtime sono cambiati (export accodato, commit) dall'ultima lettura.
+    """
+    key = _resource_key(p)
+    meta = _IMAGE_META.get(key)
+    if meta is not None:
+        try:
+            st = p.stat()
+            if meta.get("size") != st.st_size or meta.get("mtime") != st.st_mtime:
+                _IMAGE_META.pop(key, None)
+        except OSError:
+            _IMAGE_META.pop(key, None)
+    if key not in _IMAGE_META:
+        prefetch_image_meta(p)
+        t = _IMAGE_META_THREADS.get(key)
+        if t is not None:
+            t.join(timeout)
+    return _IMAGE_META.get(key)
+
+
+def _print_image_indexes(meta: Dict[str, object]) -> None:
+    for im in meta.get("images", []):
+        size = f"{im['size'] / _GB:6.2f} GB" if im.get("size") else ""
+        print(f"  {im['index']:>3}  {im['name']:<40} {size}")
+
+
+def _match_index_name(meta: Dict[str, object], text: str) -> Optional[int]:
+    """Indice dal nome dell'edizione: corrispondenza esatta, altrimenti sottostringa univoca."""
+    t = text.strip().lower()
+    images = meta.get("images", [])
+    hits = [im for im in images if im["name"].lower() == t] or [im for im in images if t in im["name"].lower()]
+    if len(hits) == 1:
+        return hits[0]["index"]
+    if hits:
+        print("[ERROR] Ambiguous name: " + ", ".join(f"{im['index']}={im['name']}" for im in hits))
+    else:
+        print(f"[ERROR] No index named '{text}'.")
+    return None
+
+
+def ask_image(prompt: str) -> Optional[Path]:
+    """Come ask_path per le immagini, con le immagini recenti selezionabili per numero o nome.
+    Avvia subito la lettura dei metadati, così la scelta dell'indice è immediata.
+    """
+    recent = [e for e in _load_recent_images() if Path(str(e["path"])).exists()][:RECENT_IMAGES_SHOWN]
+    if recent and not _json_to_stdout():
+        print(color("Recent images:", fg="bright_black"))
+        for n, e in enumerate(recent, 1):
+            names = ", ".join(im["name"] for im in e.get("images", [])[:3])
+            more = "..." if len(e.get("images", [])) > 3 else ""
+            print(color(f"  [{n}] {e['path']}  ({len(e.get('images', []))} idx: {names}{more})", fg="bright_black"))
+    text = input_path(prompt, IMAGE_EXTS).strip().strip('"')
+    if not text:
+        return None
+    path: Optional[Path] = None
+    if text.isdigit() and 1 <= int(text) <= len(recent):
+        path = Path(str(recent[int(text) - 1]["path"]))
+    elif not Path(text).exists() and recent:
+        hits = [e for e in recent if text.lower() in Path(str(e["path"])).name.lower()
+                or any(text.lower() in im["name"].lower() for im in e.get("images", []))]
+        if len(hits) == 1:
+            path = Path(str(hits[0]["path"]))
+    if path is None:
+        path = Path(text)
+        if not path.exists():
+            print(f"[ERRORE] File/Cartella non trovato: {path}")
+            return None
+    if path.is_file():
+        prefetch_image_meta(path)
+    return path
+
+
+def _ask_indexes(wim: Optional[Path] = None) -> Optional[List[int]]:
+    """Più indici separati da spazio (o da virgola, per poter usare i nomi delle edizioni)."""
+    meta = image_meta(wim) if wim else None
+    print()
+    ind = input("Indici (spazio separati" + (", o nomi separati da virgola" if meta else "") + "): ").strip()
+    if not ind:
+        return None
+    out: List[int] = []
+    for tok in (ind.split(",") if "," in ind else ind.split()):
+        tok = tok.strip()
+        if tok.isdigit():
+            out.append(int(tok))
+            continue
+        idx = _match_index_name(meta, tok) if meta and tok else None
+        if idx is None:
+            if not meta:
+                print(f"[ERRORE] Indice non numerico: {tok}")
+            return None
+        out.append(idx)
+    return out
+
+
 def ask_compression() -> Optional[str]:
     print("\n[Compressione] Valori: max, fast, none, recovery")
     while True:
@@ -1007,7 +1774,20 @@ def get_wiminfo(path: Path) -> None:
 
 
 def mount_image(wim: Path, index: int, ro: bool = False) -> Path:
-    mdir = make_temp_mount("mnt_")
+    if ro:
+        # Sola lettura: si può montare la copia locale di una sorgente remota
+        wim = stage_source(wim)
+    need = estimate_mount_bytes(wim, index)
+    base = plan_placement("mount", need).mount_base
+    if _current_job() is None and not preflight_space([("mount (expanded image)", base or Path(TEMP), need)]):
+        raise RuntimeError("Mount cancelled: not enough free space for the mount folder (menu 18 to change it).")
+    mdir = make_temp_mount("mnt_", base=base, image=wim, index=index, ro=ro)
+    if _current_job() is None:
+        try:
+            _claim_for_foreground(wim, mdir)
+        except RuntimeError:
+            _forget_mount_dir(mdir)
+            raise
     args = [
         "/Mount-Wim",
         f"/WimFile:{str(wim)}",
@@ -1024,22 +1804,137 @@ def mount_image(wim: Path, index: int, ro: bool = False) -> Path:
     return mdir
 
 
+class SpeculativeMount:
+    """Mount RW avviato appena immagine e indice sono noti, mentre l'utente risponde agli altri prompt.
+    result() attende solo il tempo di mount residuo e passa la cartella al chiamante; se non viene
+    chiesta (annullamento, errore, CTRL+C) l'uscita dal blocco 'with' smonta con /Discard.
+    Disattivato con SPECULATIVE_MOUNT=False, dentro i job e per gli ESD (mount sincrono come prima);
+    con start=False il mount parte solo se result() viene chiesta (può non servire affatto).
+    """
+
+    def __init__(self, wim: Path, index: int, prefix: str = "mnt_", start: bool = True) -> None:
+        self.wim = wim
+        self.index = index
+        self.prefix = prefix
+        self.mdir: Optional[Path] = None
+        self.rc: Optional[int] = None
+        self.tail = ""
+        self.percent = 0.0
+        self.started = 0.0
+        self.active = start and SPECULATIVE_MOUNT and _current_job() is None and wim.suffix.lower() != ".esd"
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[RuntimeError] = None
+        self._taken = False
+
+    def __enter__(self) -> "SpeculativeMount":
+        if self.active:
+            try:
+                self._start()
+            except RuntimeError as e:
+                self._error = e  # riproposto da result(), dopo i prompt
+                self.active = False
+        return self
+
+    def __exit__(self, exc_type, *_) -> None:
+        # Preso dal chiamante e nessun errore nel blocco: lo smontaggio spetta al chiamante
+        if self.mdir is not None and (not self._taken or exc_type is not None):
+            self.discard()
+
+    def _start(self) -> None:
+        need = estimate_mount_bytes(self.wim, self.index)
+        base = plan_placement("mount", need).mount_base
+        if not preflight_space([("mount (expanded image)", base or Path(TEMP), need)]):
+            raise RuntimeError("Mount cancelled: not enough free space for the mount folder (menu 18 to change it).")
+        mdir = make_temp_mount(self.prefix, base=base, image=self.wim, index=self.index)
+        try:
+            _claim_for_foreground(self.wim, mdir)
+        except RuntimeError:
+            _forget_mount_dir(mdir)
+            raise
+        self.mdir = mdir
+        cmd = ["dism", "/Mount-Wim", f"/WimFile:{self.wim}", f"/Index:{self.index}", f"/MountDir:{mdir}"]
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, args=(cmd,), daemon=True)
+        self._thread.start()
+
+    def _run(self, cmd: List[str]) -> None:
+        self.rc, self.tail = _run_child(cmd, self._on_percent)
+
+    def _on_percent(self, p: float) -> None:
+        self.percent = p
+
+    def _wait(self, label: str) -> None:
+        if self._thread is None:
+            return
+        shown = False
+        while self._thread.is_alive():
+            if not _json_to_stdout():
+                sys.stdout.write(f"\r[MOUNT] {label}: {self.percent:5.1f}%")
+                sys.stdout.flush()
+                shown = True
+            self._thread.join(0.25)
+        if shown:
+            print()
+
+    def ready(self) -> Path:
+        """Attende il mount in corso senza prenderne possesso (es. per elencare le feature)."""
+        if self._error is not None:
+            raise self._error
+        if not self.active:
+            self.active = True
+            self.mdir = mount_image(self.wim, self.index, ro=False)
+            self.rc = 0
+            return self.mdir
+        if self.rc is None:
+            self._wait("Waiting for background mount")
+            if self.rc == 0:
+                print(color(f"[OK] Mounted in background while answering prompts ({time.monotonic() - self.started:.0f}s since start).", fg="bright_green"))
+        if self.rc != 0 or self.mdir is None:
+            log_error(f"Mount fallito: DISM rc={self.rc}\n{self.tail}")
+            self._error = RuntimeError("Montaggio immagine fallito")
+            mdir, self.mdir = self.mdir, None
+            if mdir is not None:
+                unmount(mdir, commit=False)
+            raise self._error
+        return self.mdir
+
+    def result(self) -> Path:
+        """Cartella montata (attende il mount in corso) di cui il chiamante diventa responsabile;
+        solleva RuntimeError come mount_image."""
+        mdir = self.ready()
+        self._taken = True
+        return mdir
+
+    def discard(self) -> None:
+        """Operazione annullata: attende la fine del mount e lo scarta."""
+        mdir, self.mdir = self.mdir, None
+        if mdir is None:
+            return
+        self._wait("Cancelled, finishing background mount before discarding")
+        print("[INFO] Discarding background mount...")
+        unmount(mdir, commit=False)
+
+
 # ====== Operazioni di menu ======
 
 def menu_getinfo() -> None:
-    wim = ask_path("WIM/ESD path: ")
+    wim = ask_image("WIM/ESD path: ")
     if not wim:
         return
+    if _json_mode():
+        res = get_images(wim)
+        emit_records("image", res.records, source=str(wim), returncode=res.returncode)
+        return
     cp = _run_dism_with_spinner_capture(["/Get-WimInfo", f"/WimFile:{str(wim)}"])
     if cp.stdout:
         print(cp.stdout, end="" if cp.stdout.endswith("\n") else "\n")
 
 
 def menu_mount_rw() -> None:
-    wim = ask_path("WIM/ESD path: ")
+    wim = ask_image("WIM/ESD path: ")
     if not wim:
         return
-    idx = ask_index()
+    idx = ask_index(wim)
     if idx is None:
         return
     ensure_rw_allowed(wim)
@@ -1082,10 +1977,10 @@ def menu_mount_rw() -> None:
 
 
 def menu_mount_ro() -> None:
-    wim = ask_path("WIM/ESD path: ")
+    wim = ask_image("WIM/ESD path: ")
     if not wim:
         return
-    idx = ask_index()
+    idx = ask_index(wim)
     if idx is None:
         return
     mdir = mount_image(wim, idx, ro=True)
@@ -1137,7 +2032,7 @@ def menu_unmount_dir() -> None:
         print(f"[ERROR] Unmount failed: {e}")
 
 
-def _features_with_filter(wim: Path, idx: int) -> None:
+def _features_with_filter(wim: Path, idx: int, spec: Optional["SpeculativeMount"] = None) -> None:
     print("\n=== Available features list ===")
     print("[1] All")
     print("[2] Only Disabled")
@@ -1149,70 +2044,60 @@ def _features_with_filter(wim: Path, idx: int) -> None:
         return
     if choice == "0":
         return
-    mdir = mount_image(wim, idx, ro=True)
+    # Con un mount speculativo in corso si elenca dalla stessa cartella, senza un secondo mount
+    mdir = spec.ready() if spec is not None else mount_image(wim, idx, ro=True)
     try:
-        # Usa spinner a riga singola durante la raccolta dell'output delle feature
-        cp = _run_dism_with_spinner_capture(["/Image:" + str(mdir), "/Get-Features", "/English"])
-        out = cp.stdout or ""
-        lines = out.splitlines()
-        if choice == "1":
-            print(out)
-        else:
-            # Raggruppa blocchi Feature Name/State per stamparli completi
-            current_name = None
-            current_state = None
-            matched = 0
-            for line in lines:
-                if line.strip().startswith("Feature Name :"):
-                    current_name = line.strip()
-                elif line.strip().startswith("State :"):
-                    current_state = line.strip()
-                    if choice == "2" and "Disabled" in current_state:
-                        # stampa nome e stato
-                        if current_name:
-                            print(current_name)
-                        print(current_state)
-                        print()
-                        matched += 1
-                    if choice == "3" and "Payload Removed" in current_state:
-                        if current_name:
-                            print(current_name)
-                        print(current_state)
-                        print()
-                        matched += 1
-            if matched == 0:
-                print("[INFO] No matching features found.")
+        # Parsing in streaming: si conservano solo i record feature, non l'output completo
+        res = get_features(mdir)
+        if res.ok:
+            _store_feature_catalog(wim, idx, res.records)
+        wanted = {"2": "Disabled", "3": "Payload Removed"}.get(choice)
+        matched = [f for f in res.records if wanted is None or wanted in f.state]
+        if _json_mode():
+            emit_records("feature", matched, image=str(wim), index=idx, filter=wanted, returncode=res.returncode)
+            return
+        if not res.ok:
+            print(color(f"[ERROR] DISM /Get-Features failed (rc={res.returncode}).", fg="bright_red"))
+            print(res.tail)
+        for f in matched:
+            print(f"Feature Name : {f.name}")
+            print(f"State : {f.state}")
+            print()
+        if not matched:
+            print("[INFO] No matching features found.")
     finally:
-        unmount(mdir, commit=False)
+        if spec is None:
+            unmount(mdir, commit=False)
         # nessuna pausa qui; il loop principale gestisce la pausa di ritorno
 
 
 def menu_listfeat() -> None:
-    wim = ask_path("WIM/ESD path: ")
+    wim = ask_image("WIM/ESD path: ")
     if not wim:
         return
-    idx = ask_index()
+    idx = ask_index(wim)
     if idx is None:
         return
     _features_with_filter(wim, idx)
 
 
 def menu_enablefeat() -> None:
-    wim = ask_path("WIM/ESD path: ")
+    wim = ask_image("WIM/ESD path: ")
     if not wim:
         return
-    idx = ask_index()
+    idx = ask_index(wim)
     if idx is None:
         return
-    print("\n[Filter] 1=All 2=Disabled 3=Payload Removed 0=Skip")
-    pre = input("Choice: ").strip()
-    if pre in {"1", "2", "3"}:
-        _features_with_filter(wim, idx)
-    feat = input("Feature to ENABLE: ").strip()
-    if not feat:
-        return
-    ensure_rw_allowed(wim)
-    mdir = mount_image(wim, idx, ro=False)
+    with SpeculativeMount(wim, idx) as spec:
+        print("\n[Filter] 1=All 2=Disabled 3=Payload Removed 0=Skip")
+        pre = input("Choice: ").strip()
+        if pre in {"1", "2", "3"}:
+            _features_with_filter(wim, idx, spec if spec.active else None)
+        feat = input("Feature to ENABLE: ").strip()
+        if not feat:
+            return
+        ensure_rw_allowed(wim)
+        mdir = spec.result()
     try:
         rc = _stream_dism_progress(["/Image:" + str(mdir), "/Enable-Feature", f"/FeatureName:{feat}", "/All"])
         commit_ok = (rc == 0)
@@ -1220,10 +2105,8 @@ def menu_enablefeat() -> None:
             log_error(f"ENABLEFEAT: enable fallito ({feat})")
         # Verifica stato finale
         try:
-            cpv = _run_dism_with_spinner_capture(["/Image:" + str(mdir), "/Get-FeatureInfo", f"/FeatureName:{feat}", "/English"])
-            out = (cpv.stdout or "") + "\n" + (cpv.stderr or "")
-            m = re.search(r"^\s*State\s*:\s*(.+)$", out, re.MULTILINE)
-            state = (m.group(1).strip() if m else "?")
+            info = get_feature_info(mdir, feat)
+            state = info.records[0].state if info.records else "?"
             if re.search(r"Enabled", state, re.IGNORECASE):
                 print(color(f"[OK] Feature '{feat}' enabled (state: {state}).", fg="bright_green", bold=True))
                 commit_ok = True
@@ -1242,21 +2125,22 @@ def menu_enablefeat() -> None:
 
 
 def menu_disablefeat() -> None:
-    wim = ask_path("WIM/ESD path: ")
+    wim = ask_image("WIM/ESD path: ")
     if not wim:
         return
-    idx = ask_index()
+    idx = ask_index(wim)
     if idx is None:
         return
-    print("\n[Filter] 1=All 2=Disabled 3=Payload Removed 0=Skip")
-    pre = input("Choice: ").strip()
-    if pre in {"1", "2", "3"}:
-        _features_with_filter(wim, idx)
-    feat = input("Feature to DISABLE: ").strip()
-    if not feat:
-        return
-    ensure_rw_allowed(wim)
-    mdir = mount_image(wim, idx, ro=False)
+    with SpeculativeMount(wim, idx) as spec:
+        print("\n[Filter] 1=All 2=Disabled 3=Payload Removed 0=Skip")
+        pre = input("Choice: ").strip()
+        if pre in {"1", "2", "3"}:
+            _features_with_filter(wim, idx, spec if spec.active else None)
+        feat = input("Feature to DISABLE: ").strip()
+        if not feat:
+            return
+        ensure_rw_allowed(wim)
+        mdir = spec.result()
     try:
         rc = _stream_dism_progress(["/Image:" + str(mdir), "/Disable-Feature", f"/FeatureName:{feat}"])
         commit_ok = (rc == 0)
@@ -1264,10 +2148,8 @@ def menu_disablefeat() -> None:
             log_error(f"DISABLEFEAT: disable fallito ({feat})")
         # Verifica stato finale
         try:
-            cpv = _run_dism_with_spinner_capture(["/Image:" + str(mdir), "/Get-FeatureInfo", f"/FeatureName:{feat}", "/English"])
-            out = (cpv.stdout or "") + "\n" + (cpv.stderr or "")
-            m = re.search(r"^\s*State\s*:\s*(.+)$", out, re.MULTILINE)
-            state = (m.group(1).strip() if m else "?")
+            info = get_feature_info(mdir, feat)
+            state = info.records[0].state if info.records else "?"
             if re.search(r"Disabled", state, re.IGNORECASE):
                 print(color(f"[OK] Feature '{feat}' disabled (state: {state}).", fg="bright_green", bold=True))
                 commit_ok = True
@@ -1285,39 +2167,414 @@ def menu_disablefeat() -> None:
             pass
 
 
-def menu_addpkg() -> None:
-    wim = ask_path("WIM/ESD path: ")
+# ====== Catalogo feature e modifica multipla ======
+FEATURE_CATALOG_FILE = CONFIG_DIR / "feature_catalog.json"
+FEATURE_CATALOG_MAX = 64
+
+
+def _feature_catalog_key(wim: Path, idx: int) -> str:
+    """Chiave per indice: GUID + hash dei metadati dell'immagine (cambia a ogni commit).
+    Se l'header non è leggibile si ripiega su percorso + mtime + size.
+    """
+    hdr = _read_wim_header(wim)
+    if hdr and 1 <= idx <= len(hdr.metadata_hashes):
+        return f"{hdr.guid}:{idx}:{hdr.metadata_hashes[idx - 1]}"
+    try:
+        st = wim.stat()
+        return f"{str(wim).lower()}:{idx}:{st.st_mtime_ns}:{st.st_size}"
+    except OSError:
+        return f"{str(wim).lower()}:{idx}"
+
+
+def _load_feature_catalog() -> Dict[str, dict]:
+    try:
+        with open(FEATURE_CATALOG_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _cached_features(wim: Path, idx: int) -> Optional[Dict[str, str]]:
+    ent = _load_feature_catalog().get(_feature_catalog_key(wim, idx))
+    feats = ent.get("features") if isinstance(ent, dict) else None
+    return feats if isinstance(feats, dict) else None
+
+
+def _store_feature_catalog(wim: Path, idx: int, features: List[FeatureInfo], key: Optional[str] = None) -> None:
+    """Salva nome → stato delle feature di un indice; mantiene solo le voci più recenti."""
+    cat = _load_feature_catalog()
+    cat[key or _feature_catalog_key(wim, idx)] = {
+        "image": str(wim), "index": idx, "updated": time.time(),
+        "features": {f.name: f.state for f in features},
+    }
+    if len(cat) > FEATURE_CATALOG_MAX:
+        for k in sorted(cat, key=lambda k: cat[k].get("updated", 0))[: len(cat) - FEATURE_CATALOG_MAX]:
+            del cat[k]
+    try:
+        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = FEATURE_CATALOG_FILE.with_name(FEATURE_CATALOG_FILE.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(cat, f)
+        os.replace(tmp, FEATURE_CATALOG_FILE)
+    except Exception as e:
+        log_error(f"[FEATCAT] salvataggio catalogo fallito: {e}")
+
+
+def _parse_feature_spec(spec: str) -> List[tuple[str, str]]:
+    """'+A, -B C*' → [('enable','A'), ('disable','B'), ('enable','C*')]. '@file' legge i token da file."""
+    tokens: List[str] = []
+    for tok in re.split(r"[,;\s]+", spec.strip()):
+        if tok.startswith("@") and len(tok) > 1:
+            try:
+                text = Path(tok[1:].strip('"')).read_text(encoding="utf-8-sig")
+            except OSError as e:
+                print(color(f"[WARN] Cannot read list {tok[1:]}: {e}", fg="bright_yellow"))
+                continue
+            lines = [ln.split("#", 1)[0] for ln in text.splitlines()]
+            tokens.extend(t for t in re.split(r"[,;\s]+", " ".join(lines)) if t)
+        elif tok:
+            tokens.append(tok)
+    out = []
+    for tok in tokens:
+        action = "disable" if tok.startswith("-") else "enable"
+        name = tok.lstrip("+-")
+        if name:
+            out.append((action, name))
+    return out
+
+
+def _feature_state_ok(action: str, state: str) -> bool:
+    """True se lo stato DISM ('Enabled', 'Disable Pending', ...) soddisfa già l'azione richiesta.
+    Unico criterio sia per omettere le feature dal piano sia per verificarle dopo il cambio.
+    """
+    target = "Enable" if action == "enable" else "Disable"
+    return bool(re.match(rf"{target}d|{target} Pending", state, re.IGNORECASE))
+
+
+def resolve_feature_spec(spec: List[tuple[str, str]], catalog: Dict[str, str]) -> tuple[Dict[str, List[str]], List[str]]:
+    """Risolve nomi e pattern (* ?) sul catalogo, case-insensitive come DISM.
+    Le voci successive prevalgono. Le feature già nello stato richiesto vengono omesse.
+    Ritorna ({'enable': [...], 'disable': [...]}, pattern senza corrispondenze).
+    """
+    import fnmatch
+    by_lower = {n.lower(): n for n in catalog}
+    wanted: Dict[str, str] = {}
+    unmatched: List[str] = []
+    for action, pat in spec:
+        names = [by_lower[k] for k in fnmatch.filter(by_lower, pat.lower())]
+        if not names:
+            unmatched.append(pat)
+        for n in names:
+            wanted[n] = action
+    plan: Dict[str, List[str]] = {"enable": [], "disable": []}
+    for name, action in wanted.items():
+        if not _feature_state_ok(action, catalog.get(name, "")):
+            plan[action].append(name)
+    return plan, unmatched
+
+
+def menu_features_batch() -> None:
+    """Abilita/disabilita più feature con un solo mount: una chiamata DISM per azione,
+    verifica da un unico /Get-Features e un solo commit.
+    """
+    wim = ask_image("WIM path: ")
     if not wim:
         return
-    idx = ask_index()
+    idx = ask_index(wim)
     if idx is None:
         return
-    pkg = ask_path("CAB/MSU package path: ")
-    if not pkg:
+    ensure_rw_allowed(wim)
+    key = _feature_catalog_key(wim, idx)
+    catalog = _cached_features(wim, idx)
+    # Con il catalogo in cache il mount serve solo se qualche feature va cambiata: si decide dopo il prompt
+    with SpeculativeMount(wim, idx, start=catalog is None) as pending:
+        print("Features: names or patterns separated by comma/space; prefix '-' to disable, '+' (or none) to enable;")
+        print("          '@file.txt' reads the list from a file (one or more per line, '#' comments).")
+        spec = _parse_feature_spec(input("Features: "))
+        if not spec:
+            return
+        if catalog is not None:
+            plan, unmatched = resolve_feature_spec(spec, catalog)
+            if unmatched:
+                print(color("[WARN] No match in feature catalog: " + ", ".join(unmatched), fg="bright_yellow"))
+            if not plan["enable"] and not plan["disable"]:
+                print("[INFO] All requested features are already in the requested state.")
+                return
+        mdir = pending.result()
+    commit_ok = False
+    try:
+        if catalog is None:
+            # Primo utilizzo per questo indice: catalogo dall'immagine montata
+            res = get_features(mdir)
+            if not res.ok:
+                print(color(f"[ERROR] DISM /Get-Features failed (rc={res.returncode}).", fg="bright_red"))
+                print(res.tail)
+                return
+            _store_feature_catalog(wim, idx, res.records, key)
+            catalog = {f.name: f.state for f in res.records}
+            plan, unmatched = resolve_feature_spec(spec, catalog)
+            if unmatched:
+                print(color("[WARN] No match in feature catalog: " + ", ".join(unmatched), fg="bright_yellow"))
+            if not plan["enable"] and not plan["disable"]:
+                print("[INFO] All requested features are already in the requested state.")
+                return
+        for action in ("enable", "disable"):
+            names = plan[action]
+            if not names:
+                continue
+            print(color(f"[INFO] {action.capitalize()}: " + ", ".join(names), fg="bright_cyan"))
+            args = ["/Image:" + str(mdir), "/Enable-Feature" if action == "enable" else "/Disable-Feature"]
+            args += [f"/FeatureName:{n}" for n in names]
+            if action == "enable":
+                args.append("/All")
+            rc = _stream_dism_progress(args)
+            if rc not in (0, 3010) and len(names) > 1:
+                # DISM rifiuta l'intera chiamata se una feature non è valida: si ripete una per volta
+                log_error(f"FEATURES: {action} multiplo fallito rc={rc}, ripeto singolarmente")
+                for n in names:
+                    one = args[:2] + [f"/FeatureName:{n}"] + (["/All"] if action == "enable" else [])
+                    if _stream_dism_progress(one) not in (0, 3010):
+                        log_error(f"FEATURES: {action} fallito ({n})")
+            elif rc not in (0, 3010):
+                log_error(f"FEATURES: {action} fallito ({names[0]})")
+        # Verifica di tutti gli stati con un solo passaggio
+        res = get_features(mdir)
+        states = {f.name.lower(): f.state for f in res.records}
+        rows = []
+        for action in ("enable", "disable"):
+            for n in plan[action]:
+                state = states.get(n.lower(), "?")
+                rows.append({"feature": n, "action": action, "state": state, "ok": _feature_state_ok(action, state)})
+        failed = [r for r in rows if not r["ok"]]
+        for r in rows:
+            tag, fg = ("[OK]", "bright_green") if r["ok"] else ("[WARN]", "bright_yellow")
+            print(color(f"{tag} {r['feature']}: {r['action']} → {r['state']}", fg=fg))
+        commit_ok = res.ok and not failed
+        if failed and len(failed) < len(rows):
+            try:
+                ans = input(f"{len(failed)} feature(s) not in the requested state. Commit the others? (y/N): ").strip().lower()
+            except KeyboardInterrupt:
+                print()
+                ans = ""
+            commit_ok = ans in {"s", "si", "sì", "y", "yes"}
+        if _json_mode():
+            emit_records("feature_change", rows, image=str(wim), index=idx, committed=commit_ok)
+    finally:
+        unmount(mdir, commit=commit_ok)
+    if commit_ok and res.ok:
+        # Il commit cambia l'hash dei metadati: si registra lo stato verificato con la nuova chiave
+        _store_feature_catalog(wim, idx, res.records)
+
+
+def menu_addpkg() -> None:
+    wim = ask_image("WIM/ESD path: ")
+    if not wim:
+        return
+    idx = ask_index(wim)
+    if idx is None:
         return
     ensure_rw_allowed(wim)
-    mdir = mount_image(wim, idx, ro=False)
+    with SpeculativeMount(wim, idx) as spec:
+        pkg = ask_path("CAB/MSU package path (file, or folder for batch mode): ", PACKAGE_EXTS)
+        if not pkg:
+            return
+        mdir = spec.result()
+    if pkg.is_dir():
+        _add_packages_batch(wim, idx, pkg, mdir)
+        return
+    commit_ok = False
     try:
         rc = _stream_dism_progress(["/Image:" + str(mdir), "/Add-Package", f"/PackagePath:{str(pkg)}"])
+        commit_ok = (rc == 0)
         if rc != 0:
             log_error(f"ADDPKG: add-package fallito ({pkg})")
-        _stream_dism_progress(["/Unmount-Wim", f"/MountDir:{str(mdir)}", "/Commit"])
     finally:
-        unmount(mdir, commit=False)
+        # Un solo smontaggio: commit se il pacchetto è stato applicato, altrimenti discard
+        unmount(mdir, commit=commit_ok)
+
+
+# Ordine di servicing: stack di servicing, aggiornamento cumulativo, .NET, altri (DU, FOD, lingue)
+_KB_RE = re.compile(r"kb(\d{6,8})", re.IGNORECASE)
+_PKG_CLASSES = (
+    (re.compile(r"ssu|servicing[-_ ]?stack", re.IGNORECASE), "ssu"),
+    (re.compile(r"ndp|dotnet|\.net|netfx", re.IGNORECASE), "dotnet"),
+    (re.compile(r"windows1\d\.0-kb", re.IGNORECASE), "lcu"),
+)
+_PKG_ORDER = {"ssu": 0, "lcu": 1, "dotnet": 2, "other": 3}
+_SSU_IDENTITY_RE = re.compile(r"servicing_?stack", re.IGNORECASE)
+_SSU_MAX_BYTES = 256 * 1024 * 1024  # gli SSU pesano decine di MB: CAB più grandi sono cumulativi
+_PKG_SSU_CACHE: Dict[tuple, Optional[bool]] = {}
+
+
+def _cab_members(path: Path) -> List[tuple[str, int]]:
+    """(nome, byte) dei file contenuti in un CAB o MSU, letti dall'intestazione senza decomprimere."""
+    with open(path, "rb") as f:
+        hdr = f.read(36)
+        if len(hdr) < 36 or hdr[:4] != b"MSCF":
+            return []
+        coff_files, = struct.unpack_from("<I", hdr, 16)
+        n_files, = struct.unpack_from("<H", hdr, 28)
+        f.seek(coff_files)
+        raw = f.read(n_files * 272)
+    members: List[tuple[str, int]] = []
+    pos = 0
+    for _ in range(n_files):
+        end = raw.find(b"\0", pos + 16)
+        if end < 0:
+            break
+        size, = struct.unpack_from("<I", raw, pos)
+        attribs, = struct.unpack_from("<H", raw, pos + 14)
+        members.append((raw[pos + 16:end].decode("utf-8" if attribs & 0x80 else "cp437", errors="replace"), size))
+        pos = end + 1
+    return members
+
+
+def _cab_extract(cab: Path, member: str, dest: Path) -> Optional[Path]:
+    """Estrae un file da un CAB con expand.exe (solo Windows); None se non estraibile."""
+    if os.name != "nt":
+        return None
+    dest.mkdir(parents=True, exist_ok=True)
+    rc, _ = _run_child(["expand", str(cab), f"-F:{member}", str(dest)])
+    out = dest / member
+    return out if rc == 0 and out.is_file() else None
+
+
+def _mum_is_ssu(cab: Path, tmp: Path) -> Optional[bool]:
+    """Identità del pacchetto da update.mum: True se è 'Package_for_ServicingStack...'."""
+    if not any(name.lower() == "update.mum" for name, _ in _cab_members(cab)):
+        return None
+    mum = _cab_extract(cab, "update.mum", tmp)
+    if mum is None:
+        return None
+    return bool(_SSU_IDENTITY_RE.search(mum.read_text(encoding="utf-8", errors="replace")))
+
+
+def _package_is_ssu(p: Path) -> Optional[bool]:
+    """Riconosce uno stack di servicing dai metadati (update.mum del CAB o dei CAB interni di un MSU),
+    non dal nome: gli SSU del Catalog si chiamano come gli LCU (windows10.0-kbNNNNNNN-x64_<hash>.msu).
+    None se i metadati non sono leggibili (es. expand.exe assente).
+    """
+    try:
+        st = p.stat()
+        ck = (str(p), st.st_size, st.st_mtime_ns)
+        if ck in _PKG_SSU_CACHE:
+            return _PKG_SSU_CACHE[ck]
+        members = _cab_members(p)
+    except OSError:
+        return None
+    result: Optional[bool] = None
+    with tempfile.TemporaryDirectory(prefix="PyDism_pkg_", dir=TEMP) as tmp:
+        if p.suffix.lower() != ".msu":
+            result = False if st.st_size > _SSU_MAX_BYTES else _mum_is_ssu(p, Path(tmp))
+        else:
+            # I CAB SSU-*.cab di un MSU combinato appartengono all'LCU che li contiene
+            inner = [(n, sz) for n, sz in members if n.lower().endswith(".cab") and n.lower() != "wsusscan.cab"]
+            if inner and all(n.lower().startswith("ssu-") for n, _ in inner):
+                result = True
+            else:
+                for i, (name, size) in enumerate(n for n in inner if not n[0].lower().startswith("ssu-")):
+                    if size > _SSU_MAX_BYTES:
+                        result = False
+                        continue
+                    cab = _cab_extract(p, name, Path(tmp) / str(i))
+                    found = _mum_is_ssu(cab, Path(tmp) / f"{i}_mum") if cab else None
+                    if found is not None:
+                        result = found
+                    if found:
+                        break
+    _PKG_SSU_CACHE[ck] = result
+    return result
+
+
+def _package_class(p: Path) -> str:
+    ssu = _package_is_ssu(p)
+    if ssu:
+        return "ssu"
+    for pat, cls in _PKG_CLASSES:
+        if cls == "ssu" and ssu is False:
+            continue  # metadati letti: il nome non basta a farne uno stack di servicing
+        if pat.search(p.name):
+            return cls
+    return "other"
+
+
+def plan_package_batch(folder: Path, installed: List[PackageInfo]) -> tuple[List[tuple[str, List[Path]]], List[Path]]:
+    """Ordina i CAB/MSU di 'folder' per fase di servicing (SSU prima) e KB crescente.
+    I pacchetti il cui KB compare già nelle identità installate vengono saltati.
+    Ritorna ([(fase, pacchetti)], saltati).
+    """
+    installed_kbs = {m.group(1) for pi in installed for m in [_KB_RE.search(pi.identity)] if m}
+    files = sorted(p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in {".cab", ".msu"})
+    phases: Dict[str, List[Path]] = {}
+    skipped: List[Path] = []
+    for p in files:
+        m = _KB_RE.search(p.name)
+        if m and m.group(1) in installed_kbs:
+            skipped.append(p)
+            continue
+        phases.setdefault(_package_class(p), []).append(p)
+
+    def _kb(p: Path) -> int:
+        m = _KB_RE.search(p.name)
+        return int(m.group(1)) if m else 0
+
+    plan = [(cls, sorted(phases[cls], key=lambda p: (_kb(p), p.name.lower()))) for cls in sorted(phases, key=_PKG_ORDER.__getitem__)]
+    return plan, skipped
+
+
+def _add_packages_batch(wim: Path, idx: int, folder: Path, mdir: Optional[Path] = None) -> None:
+    """Applica tutti i pacchetti di una cartella con un solo mount e un solo commit.
+    Ogni fase è una chiamata /Add-Package con più /PackagePath; lo stack di servicing va sempre da solo, per primo.
+    mdir: immagine già montata (es. mount speculativo), smontata qui al termine.
+    """
+    if mdir is None:
+        mdir = mount_image(wim, idx, ro=False)
+    commit_ok = False
+    try:
+        plan, skipped = plan_package_batch(folder, get_packages(mdir).records)
+        for p in skipped:
+            print(color(f"[SKIP] Already installed: {p.name}", fg="bright_black"))
+        if not plan:
+            print("[INFO] No packages to apply.")
+            return
+        applied = failed = 0
+        for cls, pkgs in plan:
+            print(color(f"[INFO] Phase {cls}: " + ", ".join(p.name for p in pkgs), fg="bright_cyan"))
+            rc = _stream_dism_progress(["/Image:" + str(mdir), "/Add-Package", *[f"/PackagePath:{p}" for p in pkgs]])
+            if rc == 0:
+                applied += len(pkgs)
+                continue
+            failed += len(pkgs)
+            log_error(f"ADDPKG: fase {cls} fallita rc={rc} ({', '.join(p.name for p in pkgs)})")
+            print(color(f"[ERROR] Phase {cls} failed (rc={rc}); later phases skipped.", fg="bright_red"))
+            break
+        commit_ok = failed == 0
+        if failed and applied:
+            try:
+                ans = input(f"Commit the {applied} package(s) applied before the failure? (y/N): ").strip().lower()
+            except KeyboardInterrupt:
+                print()
+                ans = ""
+            commit_ok = ans in {"s", "si", "sì", "y", "yes"}
+        print(color(f"[RESULT] Applied: {applied}  Failed: {failed}  Skipped: {len(skipped)}", fg="yellow"))
+    finally:
+        unmount(mdir, commit=commit_ok)
 
 
 def menu_adddrv() -> None:
-    wim = ask_path("WIM/ESD path: ")
+    wim = ask_image("WIM/ESD path: ")
     if not wim:
         return
-    idx = ask_index()
+    idx = ask_index(wim)
     if idx is None:
         return
-    drv = ask_path("Driver path (.inf or folder): ")
-    if not drv:
-        return
     ensure_rw_allowed(wim)
-    mdir = mount_image(wim, idx, ro=False)
+    with SpeculativeMount(wim, idx) as spec:
+        drv = ask_path("Driver path (.inf or folder): ", DRIVER_EXTS)
+        if not drv:
+            return
+        mdir = spec.result()
     try:
         # Opzionale: forza driver non firmati
         try:
@@ -1327,13 +2584,13 @@ def menu_adddrv() -> None:
             fu = ""
         force = fu in {"s", "si", "sì", "y", "yes", "y"}
 
-        # Conteggio driver terze parti prima
-        pre_cnt = _count_third_party_drivers(mdir)
+        # Driver terze parti prima (anche per escludere gli INF già installati)
+        pre_drivers = _third_party_drivers(mdir)
+        pre_cnt = len(pre_drivers)
 
-        args = ["/Image:" + str(mdir), "/Add-Driver", f"/Driver:{str(drv)}", "/Recurse"]
-        if force:
-            args.append("/ForceUnsigned")
-        rc = _stream_dism_progress(args)
+        batches, summary = _plan_driver_add(drv, force, _image_arch(wim, idx), pre_drivers)
+        print(color(f"[INFO] Drivers: {summary}", fg="bright_cyan"))
+        rc = _run_driver_batches(mdir, batches, _stream_dism_progress)
         commit_ok = (rc == 0)
         if rc != 0:
             log_error(f"ADDDRV: add-driver fallito ({drv})")
@@ -1341,6 +2598,7 @@ def menu_adddrv() -> None:
         # Verifica: conteggio driver terze parti dopo
         post_cnt = _count_third_party_drivers(mdir)
         delta = post_cnt - pre_cnt
+        emit_records("driver_injection", [{"image": str(wim), "index": idx, "driver_path": str(drv), "rc": rc, "before": pre_cnt, "after": post_cnt, "added": delta}])
         if delta > 0:
             print(color(f"[OK] Added {delta} drivers (before: {pre_cnt}, after: {post_cnt}).", fg="bright_green", bold=True))
             commit_ok = True
@@ -1355,10 +2613,10 @@ def menu_adddrv() -> None:
 
 
 def menu_cleanup() -> None:
-    wim = ask_path("WIM/ESD path: ")
+    wim = ask_image("WIM/ESD path: ")
     if not wim:
         return
-    idx = ask_index()
+    idx = ask_index(wim)
     if idx is None:
         return
     ensure_rw_allowed(wim)
@@ -1373,28 +2631,22 @@ def menu_cleanup() -> None:
 
 
 def _boot_has_index2(boot_wim: Path) -> bool:
-    cp = dism("/Get-WimInfo", f"/WimFile:{str(boot_wim)}", "/English", capture=True)
-    out = (cp.stdout or "") + "\n" + (cp.stderr or "")
-    return bool(re.search(r"Index\s*:\s*2\b", out))
+    return any(img.index == 2 for img in get_images(boot_wim).records)
 
 
 def menu_adddrvboot() -> None:
-    boot = ask_path("Full path to boot.wim: ")
+    boot = ask_image("Full path to boot.wim: ")
     if not boot:
         return
-    drv = ask_path("Driver folder (.inf or folder): ")
-    if not drv:
-        return
     if not _boot_has_index2(boot):
         print("[ERRORE] boot.wim non contiene l'indice 2.")
         return
-    mdir = make_temp_mount("mnt_boot_")
+    with SpeculativeMount(boot, 2, prefix="mnt_boot_") as spec:
+        drv = ask_path("Driver folder (.inf or folder): ", DRIVER_EXTS)
+        if not drv:
+            return
+        mdir = spec.result()
     try:
-        rc = _stream_dism_progress(["/Mount-Wim", f"/WimFile:{str(boot)}", "/Index:2", f"/MountDir:{str(mdir)}"])
-        if rc != 0:
-            log_error("ADDDRVBOOT: mount fallito")
-            raise RuntimeError("Montaggio boot.wim fallito")
-
         # Opzionale: forza driver non firmati
         try:
             fu = input("Force unsigned drivers? (y/N): ").strip().lower()
@@ -1403,13 +2655,13 @@ def menu_adddrvboot() -> None:
             fu = ""
         force = fu in {"s", "si", "sì", "y", "yes", "y"}
 
-        # Conteggio driver terze parti prima
-        pre_cnt = _count_third_party_drivers(mdir)
+        # Driver terze parti prima (anche per escludere gli INF già installati)
+        pre_drivers = _third_party_drivers(mdir)
+        pre_cnt = len(pre_drivers)
 
-        args = ["/Image:" + str(mdir), "/Add-Driver", f"/Driver:{str(drv)}", "/Recurse"]
-        if force:
-            args.append("/ForceUnsigned")
-        rc2 = _stream_dism_progress(args)
+        batches, summary = _plan_driver_add(drv, force, _image_arch(boot, 2), pre_drivers)
+        print(color(f"[INFO] Drivers: {summary}", fg="bright_cyan"))
+        rc2 = _run_driver_batches(mdir, batches, _stream_dism_progress)
         commit_ok = (rc2 == 0)
         if rc2 != 0:
             log_error(f"ADDDRVBOOT: add-driver fallito ({drv})")
@@ -1417,6 +2669,7 @@ def menu_adddrvboot() -> None:
         # Verifica: conteggio driver terze parti dopo
         post_cnt = _count_third_party_drivers(mdir)
         delta = post_cnt - pre_cnt
+        emit_records("driver_injection", [{"image": str(boot), "index": 2, "driver_path": str(drv), "rc": rc2, "before": pre_cnt, "after": post_cnt, "added": delta}])
         if delta > 0:
             print(color(f"[OK] Added {delta} drivers to boot.wim (before: {pre_cnt}, after: {post_cnt}).", fg="bright_green", bold=True))
             commit_ok = True
@@ -1431,16 +2684,21 @@ def menu_adddrvboot() -> None:
 
 
 def menu_remdrvbootfolder() -> None:
-    boot = ask_path("Percorso completo di boot.wim: ")
+    boot = ask_image("Percorso completo di boot.wim: ")
     if not boot:
         return
-    folder = ask_path("Cartella da cui rimuovere driver (.inf ricorsivo): ")
+    folder = ask_path("Cartella da cui rimuovere driver (.inf ricorsivo): ", DRIVER_EXTS)
     if not folder:
         return
     if not _boot_has_index2(boot):
         print("[ERRORE] boot.wim non contiene l'indice 2.")
         return
-    mdir = make_temp_mount("mnt_boot_")
+    with _ForegroundClaim(boot):
+        _remove_boot_drivers(boot, folder)
+
+
+def _remove_boot_drivers(boot: Path, folder: Path) -> None:
+    mdir = make_temp_mount("mnt_boot_", image=boot, index=2)
     try:
         rc = _stream_dism_progress(["/Mount-Wim", f"/WimFile:{str(boot)}", "/Index:2", f"/MountDir:{str(mdir)}"])
         if rc != 0:
@@ -1464,18 +2722,479 @@ def menu_remdrvbootfolder() -> None:
         unmount(mdir, commit=False)
 
 
-def _ask_indexes() -> Optional[List[int]]:
-    print()
-    ind = input("Indici (spazio separati): ").strip()
-    if not ind:
+# ====== Indice del repository driver (INF pre-analizzati, cache su disco) ======
+DRIVER_INDEX_FILE = CONFIG_DIR / "driver_index.json"
+_INF_SECTION_RE = re.compile(r"^\s*\[([^\]]+)\]")
+_INF_KV_RE = re.compile(r"^\s*([^=]+?)\s*=\s*(.*?)\s*$")
+_INF_STRING_RE = re.compile(r"%([^%]+)%")
+# Decorazioni [Manufacturer] -> architettura; ARCH nell'XML WIM -> architettura
+_INF_ARCHS = {"ntx86": "x86", "ntamd64": "amd64", "ntarm64": "arm64", "ntarm": "arm", "ntia64": "ia64"}
+_WIM_ARCHS = {"0": "x86", "5": "arm", "6": "ia64", "9": "amd64", "12": "arm64"}
+_DRIVER_CMDLINE_BUDGET = 24000  # margine sotto il limite di 32767 caratteri di CreateProcess
+
+
+@dataclass
+class InfRecord:
+    """Metadati di un INF del repository driver."""
+    __slots__ = ("path", "class_name", "provider", "version", "date", "archs", "catalog", "sha1", "mtime_ns", "size")
+    path: str
+    class_name: str
+    provider: str
+    version: str
+    date: str
+    archs: List[str]
+    catalog: bool
+    sha1: str
+    mtime_ns: int
+    size: int
+
+
+def _decode_inf(raw: bytes) -> str:
+    if raw[:2] in (b"\xff\xfe", b"\xfe\xff"):
+        return raw.decode("utf-16", errors="replace")
+    if raw[:3] == b"\xef\xbb\xbf":
+        return raw[3:].decode("utf-8", errors="replace")
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("cp1252", errors="replace")
+
+
+def _parse_inf(path: Path, st: os.stat_result) -> InfRecord:
+    """Analizza [Version], [Manufacturer] e [Strings] di un INF in un'unica passata."""
+    raw = path.read_bytes()
+    sections: Dict[str, Dict[str, str]] = {}
+    manufacturer_values: List[str] = []
+    current: Optional[str] = None
+    for line in _decode_inf(raw).splitlines():
+        if ";" in line and '"' not in line:
+            line = line.split(";", 1)[0]
+        m = _INF_SECTION_RE.match(line)
+        if m:
+            current = m.group(1).strip().lower()
+            sections.setdefault(current, {})
+            continue
+        if current is None:
+            continue
+        kv = _INF_KV_RE.match(line)
+        if not kv:
+            continue
+        sections[current][kv.group(1).lower()] = kv.group(2).strip('"')
+        if current == "manufacturer":
+            manufacturer_values.append(kv.group(2))
+    strings = {k.lower(): v for k, v in sections.get("strings", {}).items()}
+
+    def _expand(v: str) -> str:
+        return _INF_STRING_RE.sub(lambda m: strings.get(m.group(1).lower(), m.group(0)), v)
+
+    ver = sections.get("version", {})
+    driver_ver = [x.strip() for x in ver.get("driverver", "").split(",")]
+    archs = set()
+    for value in manufacturer_values:
+        for deco in value.split(",")[1:]:
+            base = deco.strip().lower().split(".")[0]
+            if base in _INF_ARCHS:
+                archs.add(_INF_ARCHS[base])
+    if not archs:
+        # Sezione Models senza decorazioni: valida solo su x86
+        archs.add("x86")
+    cat_names = [v for k, v in ver.items() if k.startswith("catalogfile")]
+    catalog = any((path.parent / _expand(c)).exists() for c in cat_names if c)
+    return InfRecord(
+        str(path),
+        _expand(ver.get("class", "")),
+        _expand(ver.get("provider", "")),
+        driver_ver[1] if len(driver_ver) > 1 else "",
+        driver_ver[0] if driver_ver else "",
+        sorted(archs),
+        catalog,
+        hashlib.sha1(raw).hexdigest(),
+        st.st_mtime_ns,
+        st.st_size,
+    )
+
+
+def _iter_inf_files(root: Path):
+    """Scansione ricorsiva con os.scandir (più veloce di os.walk + stat separati)."""
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            stack.append(Path(e.path))
+                        elif e.name.lower().endswith(".inf"):
+                            yield Path(e.path), e.stat()
+                    except OSError:
+                        continue
+        except OSError as ex:
+            log_error(f"[DRVINDEX] {d}: {ex}")
+
+
+def index_driver_repo(root: Path) -> List[InfRecord]:
+    """Indicizza tutti gli INF sotto root. Gli INF invariati (stessi mtime e size) vengono
+    letti dalla cache su disco senza essere riaperti.
+    """
+    if root.is_file():
+        files = [(root, root.stat())]
+    else:
+        files = list(_iter_inf_files(root))
+    try:
+        with open(DRIVER_INDEX_FILE, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if not isinstance(cache, dict):
+            cache = {}
+    except Exception:
+        cache = {}
+    records: List[InfRecord] = []
+    dirty = False
+    for path, st in files:
+        key = str(path).lower()
+        ent = cache.get(key)
+        if ent and ent.get("mtime_ns") == st.st_mtime_ns and ent.get("size") == st.st_size:
+            try:
+                records.append(InfRecord(**ent))
+                continue
+            except TypeError:
+                pass
+        try:
+            rec = _parse_inf(path, st)
+        except Exception as e:
+            log_error(f"[DRVINDEX] INF non leggibile {path}: {e}")
+            continue
+        import dataclasses
+        cache[key] = dataclasses.asdict(rec)
+        records.append(rec)
+        dirty = True
+    if dirty:
+        try:
+            CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = DRIVER_INDEX_FILE.with_name(DRIVER_INDEX_FILE.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            os.replace(tmp, DRIVER_INDEX_FILE)
+        except Exception as e:
+            log_error(f"[DRVINDEX] salvataggio cache fallito: {e}")
+    return records
+
+
+def _oem_infs(image_dir: Path) -> Optional[List[os.DirEntry]]:
+    """Windows\\INF\\oem*.inf dell'immagine montata (un INF pubblicato per driver di terze parti).
+    None se la cartella non esiste (immagine non Windows o non montata).
+    """
+    inf_dir = image_dir / "Windows" / "INF"
+    try:
+        with os.scandir(inf_dir) as it:
+            return [e for e in it if e.name.lower().startswith("oem") and e.name.lower().endswith(".inf") and e.is_file()]
+    except OSError:
         return None
-    out: List[int] = []
-    for tok in ind.split():
-        if not tok.isdigit():
-            print(f"[ERRORE] Indice non numerico: {tok}")
-            return None
-        out.append(int(tok))
-    return out
+
+
+def scan_image_drivers(image_dir: Path) -> Optional[List[DriverInfo]]:
+    """Inventario veloce dei driver di terze parti senza DISM: intestazioni degli oem*.inf e,
+    per il nome originale, l'INF identico (stessa dimensione e SHA-1) in DriverStore\\FileRepository.
+    None se l'immagine non ha Windows\\INF: in quel caso serve /Get-Drivers.
+    """
+    oems = _oem_infs(image_dir)
+    if oems is None:
+        return None
+    by_size: Dict[int, List[Path]] = {}
+    repo = image_dir / "Windows" / "System32" / "DriverStore" / "FileRepository"
+    try:
+        with os.scandir(repo) as it:
+            for e in it:
+                name, sep, _ = e.name.lower().partition(".inf_")
+                if not sep:
+                    continue
+                inf = Path(e.path) / (name + ".inf")
+                try:
+                    by_size.setdefault(inf.stat().st_size, []).append(inf)
+                except OSError:
+                    continue
+    except OSError as ex:
+        log_error(f"[DRVSCAN] {repo}: {ex}")
+    out: List[DriverInfo] = []
+    for e in oems:
+        try:
+            st = e.stat()
+            rec = _parse_inf(Path(e.path), st)
+        except OSError as ex:
+            log_error(f"[DRVSCAN] INF non leggibile {e.path}: {ex}")
+            continue
+        original = ""
+        for cand in by_size.get(st.st_size, []):
+            try:
+                if hashlib.sha1(cand.read_bytes()).hexdigest() == rec.sha1:
+                    original = cand.name
+                    break
+            except OSError:
+                continue
+        out.append(DriverInfo(e.name, original, False, rec.class_name, rec.provider, rec.date, rec.version))
+    return sorted(out, key=lambda d: int(re.sub(r"\D", "", d.published_name) or 0))
+
+
+def _third_party_drivers(image_dir: Path, spinner: bool = True) -> List[DriverInfo]:
+    """Driver di terze parti per pianificare /Add-Driver: inventario su file system, DISM come ripiego."""
+    fast = scan_image_drivers(image_dir)
+    if fast is not None:
+        return fast
+    return [d for d in get_drivers(image_dir, spinner).records if not d.inbox]
+
+
+def _image_arch(wim: Path, index: int) -> Optional[str]:
+    """Architettura dell'immagine dall'XML del WIM (senza montare)."""
+    for d in _read_wim_xml(wim):
+        if d.get("INDEX") == str(index):
+            return _WIM_ARCHS.get(d.get("ARCH", ""))
+    return None
+
+
+def _plan_driver_add(drv: Path, force: bool, arch: Optional[str], installed: List[DriverInfo]) -> tuple[List[List[str]], str]:
+    """Prepara le chiamate /Add-Driver (argomenti senza /Image) per la cartella driver 'drv'.
+    Con DRIVER_PREFILTER passa solo gli INF per l'architettura dell'immagine e non già presenti
+    (stesso nome file e versione), raggruppati in batch di /Driver multipli.
+    Ritorna (batch, riepilogo). Lista vuota = nulla da aggiungere.
+    """
+    extra = ["/ForceUnsigned"] if force else []
+    fallback = ([["/Add-Driver", f"/Driver:{drv}", "/Recurse", *extra]], f"DISM /Recurse on {drv}")
+    if not DRIVER_PREFILTER or not drv.is_dir():
+        return fallback
+    records = index_driver_repo(drv)
+    if not records:
+        return fallback
+    have = {(Path(d.original_file_name).name.lower(), d.version) for d in installed}
+    selected: List[str] = []
+    skipped_arch = skipped_inst = 0
+    for r in records:
+        if arch and arch not in r.archs:
+            skipped_arch += 1
+        elif (Path(r.path).name.lower(), r.version) in have:
+            skipped_inst += 1
+        else:
+            selected.append(r.path)
+    summary = (f"{len(records)} INF indexed, {len(selected)} to add, "
+               f"{skipped_arch} skipped (not {arch}), {skipped_inst} skipped (already installed)")
+    batches: List[List[str]] = []
+    cur: List[str] = []
+    size = 0
+    for inf in selected:
+        arg = f"/Driver:{inf}"
+        if cur and size + len(arg) + 1 > _DRIVER_CMDLINE_BUDGET:
+            batches.append(["/Add-Driver", *cur, *extra])
+            cur, size = [], 0
+        cur.append(arg)
+        size += len(arg) + 1
+    if cur:
+        batches.append(["/Add-Driver", *cur, *extra])
+    return batches, summary
+
+
+def _run_driver_batches(image_dir: Path, batches: List[List[str]], runner) -> int:
+    """Esegue i batch /Add-Driver con runner(args)->rc. Se DISM rifiuta un batch con più /Driver
+    (rc 87, parametro non valido), ripiega su una chiamata per INF. Ritorna il primo rc non nullo.
+    """
+    # /Driver ripetuto è documentato per /Remove-Driver; per /Add-Driver non è garantito da tutte le
+    # versioni di DISM. Una riga non accettata fallisce con rc 87 (ERROR_INVALID_PARAMETER) prima di
+    # toccare l'immagine, e il ripiego per INF equivale alle chiamate singole di prima
+    # (tests/test_driver_batches.py).
+    rc_final = 0
+    for batch in batches:
+        args = ["/Image:" + str(image_dir), *batch]
+        rc = runner(args)
+        drivers = [a for a in batch if a.startswith("/Driver:")]
+        if rc == 87 and len(drivers) > 1:
+            opts = [a for a in batch if not a.startswith("/Driver:")]
+            for d in drivers:
+                rc_one = runner(["/Image:" + str(image_dir), *opts[:1], d, *opts[1:]])
+                if rc_one != 0 and rc_final == 0:
+                    rc_final = rc_one
+            continue
+        if rc != 0 and rc_final == 0:
+            rc_final = rc
+    return rc_final
+
+
+# ====== Iniezione driver parallela su più indici ======
+@dataclass
+class DriverFanoutResult:
+    """Esito per indice dell'iniezione driver parallela."""
+    __slots__ = ("image", "index", "mount_dir", "mount_rc", "add_rc", "before", "after", "commit_rc", "committed")
+    image: str
+    index: int
+    mount_dir: str
+    mount_rc: Optional[int]
+    add_rc: Optional[int]
+    before: Optional[int]
+    after: Optional[int]
+    commit_rc: Optional[int]
+    committed: bool
+
+
+def _wim_indexes(wim: Path) -> List[int]:
+    """Indici presenti nel WIM: header nativo (istantaneo), altrimenti DISM /Get-WimInfo."""
+    hdr = _read_wim_header(wim)
+    if hdr and hdr.image_count:
+        return list(range(1, hdr.image_count + 1))
+    return [img.index for img in get_images(wim).records]
+
+
+def inject_drivers_parallel(targets: List[tuple[Path, int]], drv: Path, force: bool, workers: int) -> List[DriverFanoutResult]:
+    """Monta più indici contemporaneamente (cartelle separate), inietta i driver in processi DISM
+    paralleli (al massimo 'workers' alla volta) e poi esegue i commit: in sequenza sullo stesso WIM,
+    in parallelo tra WIM diversi.
+    """
+    cleanup_mountpoints()
+    if DRIVER_PREFILTER and drv.is_dir():
+        # Indicizza una sola volta: i worker leggono poi la cache senza riscriverla in concorrenza
+        index_driver_repo(drv)
+    results: List[DriverFanoutResult] = []
+    try:
+        for wim, idx in targets:
+            mdir = make_temp_mount("mnt_drv_", cleanup=False, base=plan_placement("mount", estimate_mount_bytes(wim, idx)).mount_base,
+                                   image=wim, index=idx)
+            results.append(DriverFanoutResult(str(wim), idx, str(mdir), None, None, None, None, None, False))
+    except RuntimeError:
+        # Immagine riservata da un'altra istanza: nessun mount è ancora partito
+        for r in results:
+            _forget_mount_dir(Path(r.mount_dir))
+        raise
+    board = _ProgressBoard()
+    for r in results:
+        board.add(f"{r.image}#{r.index}", f"{Path(r.image).stem}:{r.index}")
+
+    def _inject(r: DriverFanoutResult) -> DriverFanoutResult:
+        key = f"{r.image}#{r.index}"
+        cb = board.percent_callback(key)
+        board.update(key, phase="mount")
+        r.mount_rc, tail = _run_child(["dism", "/Mount-Wim", f"/WimFile:{r.image}", f"/Index:{r.index}", f"/MountDir:{r.mount_dir}"], cb)
+        if r.mount_rc != 0:
+            log_error(f"ADDDRVALL: mount fallito {r.image} idx {r.index} rc={r.mount_rc}\n{tail}")
+            board.update(key, state="failed")
+            return r
+        pre_drivers = _third_party_drivers(Path(r.mount_dir), spinner=False)
+        r.before = len(pre_drivers)
+        board.update(key, phase="add")
+        batches, _ = _plan_driver_add(drv, force, _image_arch(Path(r.image), r.index), pre_drivers)
+        tails: List[str] = []
+
+        def _runner(args: List[str]) -> int:
+            rc, tail = _run_child(["dism", *_scratch_args(args)], cb)
+            if rc != 0:
+                tails.append(tail)
+            return rc
+
+        r.add_rc = _run_driver_batches(Path(r.mount_dir), batches, _runner)
+        if r.add_rc != 0:
+            log_error(f"ADDDRVALL: add-driver fallito {r.image} idx {r.index} rc={r.add_rc}\n" + "\n".join(tails))
+        r.after = _count_third_party_drivers(Path(r.mount_dir), spinner=False)
+        board.update(key, phase="wait")
+        return r
+
+    def _finish(group: List[DriverFanoutResult]) -> None:
+        # Commit sequenziali: più commit concorrenti sullo stesso file WIM non sono sicuri
+        for r in group:
+            key = f"{r.image}#{r.index}"
+            if r.mount_rc == 0:
+                commit = not _job_cancelled() and (r.add_rc == 0 or (r.after or 0) > (r.before or 0))
+                board.update(key, phase="commit" if commit else "discard")
+                r.commit_rc, tail = _run_child(["dism", "/Unmount-Wim", f"/MountDir:{r.mount_dir}", "/Commit" if commit else "/Discard"], board.percent_callback(key))
+                r.committed = commit and r.commit_rc == 0
+                if r.commit_rc != 0:
+                    log_error(f"ADDDRVALL: unmount fallito {r.mount_dir} rc={r.commit_rc}\n{tail}")
+            else:
+                # Mount parziale: prova comunque a rilasciarlo
+                _run_child(["dism", "/Unmount-Wim", f"/MountDir:{r.mount_dir}", "/Discard"])
+            _forget_mount_dir(Path(r.mount_dir))
+            board.update(key, state="ok" if r.committed else "failed")
+
+    groups: Dict[str, List[DriverFanoutResult]] = {}
+    for r in results:
+        groups.setdefault(r.image, []).append(r)
+    try:
+        with board:
+            _run_parallel(workers, [(_with_job_ctx(_inject), results), (_with_job_ctx(_finish), list(groups.values()))])
+    except KeyboardInterrupt:
+        print("\n[INFO] Operazione annullata dall'utente: smontaggio (discard) in corso...")
+        for r in results:
+            unmount(Path(r.mount_dir), commit=False)
+        raise
+    return results
+
+
+def menu_adddrv_all() -> None:
+    """Menu 28: aggiunge gli stessi driver a tutti gli indici di install.wim e/o boot.wim in parallelo."""
+    print_header("Add driver to all indexes (parallel)")
+    wim = ask_image("install.wim path (ENTER=skip): ")
+    boot = ask_image("boot.wim path (ENTER=skip): ")
+    if not wim and not boot:
+        return
+    drv = ask_path("Driver path (.inf or folder): ", DRIVER_EXTS)
+    if not drv:
+        return
+    targets: List[tuple[Path, int]] = []
+    if wim:
+        ensure_rw_allowed(wim)
+        avail = _wim_indexes(wim)
+        print(f"[INFO] {wim.name}: indexes {avail}")
+        try:
+            sel = input("install.wim indexes (space separated, ENTER=all): ").strip()
+        except KeyboardInterrupt:
+            print()
+            return
+        chosen = avail
+        if sel:
+            if not all(tok.isdigit() and int(tok) in avail for tok in sel.split()):
+                print(f"[ERROR] Indexes must be among: {avail}")
+                return
+            chosen = [int(tok) for tok in sel.split()]
+        targets += [(wim, i) for i in chosen]
+    if boot:
+        ensure_rw_allowed(boot)
+        targets += [(boot, i) for i in _wim_indexes(boot)]
+    if not targets:
+        print("[INFO] Nothing to do.")
+        return
+    try:
+        fu = input("Force unsigned drivers? (y/N): ").strip().lower()
+    except KeyboardInterrupt:
+        print()
+        fu = ""
+    force = fu in {"s", "si", "sì", "y", "yes"}
+    workers = min(PARALLEL_WORKERS, len(targets))
+    print(f"[INFO] {len(targets)} image(s), {workers} parallel DISM worker(s). Mount base: {MOUNT_BASE or '%TEMP%'}")
+    # Tutti gli indici restano montati fino al commit: lo spazio serve per tutti insieme
+    if not preflight_space([(f"mount {w.name}:{i}", _mount_base_dir(), estimate_mount_bytes(w, i)) for w, i in targets]):
+        return
+
+    def _do_inject() -> int:
+        try:
+            results = inject_drivers_parallel(targets, drv, force, workers)
+        except RuntimeError as e:
+            print(color(f"[ERROR] {e}", fg="bright_red"))
+            return 1
+        return 0 if _report_driver_fanout(results, drv) else 1
+
+    bg = _ask_background()
+    if bg:
+        _submit_job(f"Add driver {drv.name} to {len(targets)} index(es)", "driver", sorted({w for w, _ in targets}), _do_inject, bg)
+        return
+    with _ForegroundClaim(*{w for w, _ in targets}):
+        _do_inject()
+
+
+def _report_driver_fanout(results: List[DriverFanoutResult], drv: Path) -> bool:
+    print()
+    for r in results:
+        delta = (r.after or 0) - (r.before or 0)
+        status = "OK" if r.committed else "FAILED"
+        line = f"[{status}] {Path(r.image).name} idx {r.index}: +{delta} drivers (before {r.before}, after {r.after}), mount rc={r.mount_rc} add rc={r.add_rc} unmount rc={r.commit_rc}"
+        print(color(line, fg="bright_green" if r.committed else "bright_red"))
+    emit_records("driver_injection", results, driver_path=str(drv))
+    ok = sum(1 for r in results if r.committed)
+    print(color(f"[RESULT] Committed: {ok}/{len(results)}", fg="yellow"))
+    return ok == len(results)
 
 
 def _normalize_compression_for_dest(compress: str, dest: Path) -> str:
@@ -1486,13 +3205,11 @@ def _normalize_compression_for_dest(compress: str, dest: Path) -> str:
 
 
 def menu_export() -> None:
-    src = ask_path("WIM/ESD sorgente: ")
+    src = ask_image("WIM/ESD sorgente: ")
     if not src:
         return
-    cp_info = dism("/Get-WimInfo", f"/WimFile:{str(src)}", capture=True)
-    if cp_info.stdout:
-        print(cp_info.stdout, end="" if cp_info.stdout.endswith("\n") else "\n")
-    indexes = _ask_indexes()
+    _show_wim_info(src)
+    indexes = _ask_indexes(src)
     if not indexes:
         return
     dest = ask_output_path("File WIM/ESD destinazione: ")
@@ -1502,19 +3219,28 @@ def menu_export() -> None:
     if not comp:
         return
     comp = _normalize_compression_for_dest(comp, dest)
-    export_indices(src, indexes, dest, comp, label="EXPORT")
+    export_indices(src, indexes, dest, comp, label="EXPORT", background=_ask_background())
 
 
 def menu_checkhealth() -> None:
-    wim = ask_path("Percorso WIM/ESD: ")
+    wim = ask_image("Percorso WIM/ESD: ")
     if not wim:
         return
-    idx = ask_index()
+    idx = ask_index(wim)
     if idx is None:
         return
     print(color("[INFO] ", fg="bright_cyan", bold=True) + "Montaggio immagine per Check/Scan Health...")
     mdir = mount_image(wim, idx, ro=True)
     try:
+        if _json_mode():
+            # DISM richiede il contesto /Cleanup-Image per usare CheckHealth/ScanHealth
+            rec: Dict[str, object] = {"image": str(wim), "index": idx}
+            for op in ("CheckHealth", "ScanHealth"):
+                stream = _DismLineStream(["/Image:" + str(mdir), "/Cleanup-Image", f"/{op}", "/English"])
+                rec[op.lower()] = parse_health(stream)
+                rec[op.lower() + "_rc"] = stream.returncode
+            emit_records("health", [rec])
+            return
         print("\n[CheckHealth]")
         # DISM richiede il contesto /Cleanup-Image per usare CheckHealth/ScanHealth
         cp1 = dism("/Image:" + str(mdir), "/Cleanup-Image", "/CheckHealth", capture=True)
@@ -1528,14 +3254,126 @@ def menu_checkhealth() -> None:
         unmount(mdir, commit=False)
 
 
+@dataclass
+class HealthScanResult:
+    """Esito per indice della scansione di integrità multi-indice."""
+    __slots__ = ("image", "index", "name", "mount_rc", "checkhealth", "scanhealth", "scan_rc", "seconds", "passed")
+    image: str
+    index: int
+    name: str
+    mount_rc: Optional[int]
+    checkhealth: str
+    scanhealth: str
+    scan_rc: Optional[int]
+    seconds: float
+    passed: bool
+
+
+def scan_health_parallel(wim: Path, indexes: List[int], workers: int) -> List[HealthScanResult]:
+    """Monta in sola lettura più indici contemporaneamente (cartelle separate) ed esegue
+    CheckHealth + ScanHealth in processi DISM paralleli, al massimo 'workers' alla volta.
+    """
+    cleanup_mountpoints()
+    wim = stage_source(wim)
+    names = {}
+    try:
+        names = {int(im.get("INDEX", 0)): im.get("NAME", "") for im in _read_wim_xml(wim)}
+    except Exception:
+        pass
+    results = [HealthScanResult(str(wim), i, names.get(i, ""), None, "unknown", "unknown", None, 0.0, False) for i in indexes]
+    if PLACEMENT_AUTO:
+        volume_benchmarks()  # eventuali misure scadute una volta sola, prima dei worker
+    board = _ProgressBoard()
+    for r in results:
+        board.add(str(r.index), f"{wim.stem}:{r.index}")
+    mdirs: Dict[int, Path] = {}
+
+    def _scan(r: HealthScanResult) -> HealthScanResult:
+        key = str(r.index)
+        cb = board.percent_callback(key)
+        t0 = time.monotonic()
+        mdir = make_temp_mount("mnt_health_", cleanup=False, base=plan_placement("mount", estimate_mount_bytes(wim, r.index)).mount_base,
+                               image=wim, index=r.index, ro=True)
+        mdirs[r.index] = mdir
+        try:
+            board.update(key, phase="mount")
+            r.mount_rc, tail = _run_child(["dism", "/Mount-Wim", f"/WimFile:{wim}", f"/Index:{r.index}", f"/MountDir:{mdir}", "/ReadOnly"], cb)
+            if r.mount_rc != 0:
+                log_error(f"HEALTHALL: mount fallito {wim} idx {r.index} rc={r.mount_rc}\n{tail}")
+                return r
+            board.update(key, phase="check")
+            _, tail = _run_child(["dism", "/Image:" + str(mdir), "/Cleanup-Image", "/CheckHealth", "/English"], cb)
+            r.checkhealth = parse_health(tail.splitlines())
+            board.update(key, phase="scan")
+            r.scan_rc, tail = _run_child(["dism", "/Image:" + str(mdir), "/Cleanup-Image", "/ScanHealth", "/English"], cb)
+            r.scanhealth = parse_health(tail.splitlines())
+            if r.scan_rc != 0:
+                log_error(f"HEALTHALL: ScanHealth rc={r.scan_rc} {wim} idx {r.index}\n{tail}")
+            r.passed = r.scan_rc == 0 and r.scanhealth == "healthy" and r.checkhealth in {"healthy", "unknown"}
+        finally:
+            board.update(key, phase="unmount")
+            _run_child(["dism", "/Unmount-Wim", f"/MountDir:{mdir}", "/Discard"], cb)
+            _forget_mount_dir(mdir)
+            r.seconds = round(time.monotonic() - t0, 1)
+            board.update(key, state="ok" if r.passed else "failed")
+        return r
+
+    try:
+        with board:
+            _run_parallel(workers, [(_scan, results)])
+    except KeyboardInterrupt:
+        print("\n[INFO] Operazione annullata dall'utente: smontaggio (discard) in corso...")
+        for mdir in mdirs.values():
+            unmount(mdir, commit=False)
+        raise
+    return results
+
+
+def menu_checkhealth_all() -> None:
+    """Menu 30: scansione di integrità di più indici con mount RO paralleli e report consolidato."""
+    print_header("Health scan of all indexes (parallel)")
+    wim = ask_image("WIM/ESD path: ")
+    if not wim:
+        return
+    avail = _wim_indexes(wim)
+    print(f"[INFO] {wim.name}: indexes {avail}")
+    try:
+        sel = input("Indexes (space separated, ENTER=all): ").strip()
+    except KeyboardInterrupt:
+        print()
+        return
+    chosen = avail
+    if sel:
+        if not all(tok.isdigit() and int(tok) in avail for tok in sel.split()):
+            print(f"[ERROR] Indexes must be among: {avail}")
+            return
+        chosen = [int(tok) for tok in sel.split()]
+    if not chosen:
+        print("[INFO] Nothing to do.")
+        return
+    workers = min(PARALLEL_WORKERS, len(chosen))
+    print(f"[INFO] {len(chosen)} index(es), {workers} parallel DISM worker(s). Mount base: {MOUNT_BASE or '%TEMP%'}")
+    # Al più 'workers' mount contemporanei: conta i più grandi
+    sizes = sorted((estimate_mount_bytes(wim, i) or 0 for i in chosen), reverse=True)[:workers]
+    if not preflight_space([(f"{len(sizes)} concurrent read-only mount(s)", _mount_base_dir(), sum(sizes))]):
+        return
+    results = scan_health_parallel(wim, chosen, workers)
+    print()
+    for r in results:
+        status = "PASS" if r.passed else "FAIL"
+        line = f"[{status}] idx {r.index} {r.name}: CheckHealth={r.checkhealth} ScanHealth={r.scanhealth} (mount rc={r.mount_rc}, scan rc={r.scan_rc}, {r.seconds}s)"
+        print(color(line, fg="bright_green" if r.passed else "bright_red"))
+    emit_records("health", results)
+    ok = sum(1 for r in results if r.passed)
+    print(color(f"[RESULT] Passed: {ok}/{len(results)}", fg="yellow"))
+
+
 def menu_convertesd() -> None:
-    src = ask_path("Percorso file ESD: ")
+    src = ask_image("Percorso file ESD: ")
     if not src:
         return
-    cp_info = dism("/Get-WimInfo", f"/WimFile:{str(src)}", capture=True)
-    if cp_info.stdout:
-        print(cp_info.stdout, end="" if cp_info.stdout.endswith("\n") else "\n")
-    indexes = _ask_indexes()
+    _show_wim_info(src)
+    indexes = _ask_indexes(src)
     if not indexes:
         return
     dest = ask_output_path("File WIM di destinazione (.wim): ")
@@ -1545,137 +3383,1202 @@ def menu_convertesd() -> None:
     if not comp:
         return
     comp = _normalize_compression_for_dest(comp, dest)
-    export_indices(src, indexes, dest, comp, label="CONVERTESD")
+    export_indices(src, indexes, dest, comp, label="CONVERTESD", background=_ask_background())
+
+# ====== Metadati WIM (lettura nativa header / blob table / XML) ======
+_WIM_MAGICS = (b"MSWIM\x00\x00\x00", b"WLPWM\x00\x00\x00")
+_WIM_HEADER_SIZE = 208
+_WIM_RESHDR_FLAG_METADATA = 0x02
+_WIM_BLOB_ENTRY_SIZE = 50
+_WIM_HDR_FLAG_RP_FIX = 0x80
+
+
+@dataclass
+class WimHeader:
+    """Campi essenziali dell'header WIM/ESD/SWM (senza invocare DISM)."""
+    __slots__ = ("guid", "part_number", "total_parts", "image_count", "flags", "chunk_size", "metadata_hashes", "xml_offset", "xml_size")
+    guid: str
+    part_number: int
+    total_parts: int
+    image_count: int
+    flags: int
+    chunk_size: int
+    metadata_hashes: List[str]
+    xml_offset: int
+    xml_size: int
+
+
+def _unpack_reshdr(buf: bytes, off: int) -> tuple[int, int, int, int]:
+    """Decodifica un reshdr su disco: (size_in_wim, flags, offset_in_wim, uncompressed_size)."""
+    size_and_flags, offset, orig = struct.unpack_from("<QQQ", buf, off)
+    return size_and_flags & 0x00FFFFFFFFFFFFFF, size_and_flags >> 56, offset, orig
+
+
+def _read_wim_header(path: Path) -> Optional[WimHeader]:
+    """Legge header e blob table del WIM. Ritorna None se il file non è un WIM valido.
+    Gli hash SHA-1 delle risorse metadati seguono l'ordine degli indici immagine.
+    """
+    try:
+        with open(path, "rb") as f:
+            hdr = f.read(_WIM_HEADER_SIZE)
+            if len(hdr) < _WIM_HEADER_SIZE or hdr[:8] not in _WIM_MAGICS:
+                return None
+            _, _, flags, chunk_size = struct.unpack_from("<IIII", hdr, 8)
+            guid = hdr[24:40].hex()
+            part_number, total_parts, image_count = struct.unpack_from("<HHI", hdr, 40)
+            bt_size, _, bt_offset, _ = _unpack_reshdr(hdr, 48)
+            xml_size, _, xml_offset, _ = _unpack_reshdr(hdr, 72)
+            hashes: List[str] = []
+            if bt_size and bt_offset:
+                f.seek(bt_offset)
+                table = f.read(bt_size)
+                for off in range(0, len(table) - _WIM_BLOB_ENTRY_SIZE + 1, _WIM_BLOB_ENTRY_SIZE):
+                    if table[off + 7] & _WIM_RESHDR_FLAG_METADATA:
+                        hashes.append(table[off + 30:off + 50].hex())
+    except OSError as e:
+        log_error(f"[WIMHDR] {path}: {e}")
+        return None
+    return WimHeader(guid, part_number, total_parts, image_count, flags, chunk_size, hashes, xml_offset, xml_size)
 
-# ====== Wimlib integration & export helpers ======
-def has_wimlib() -> bool:
+
+def _read_wim_xml(path: Path, hdr: Optional[WimHeader] = None) -> List[Dict[str, str]]:
+    """Ritorna i dati XML per immagine (INDEX, NAME, TOTALBYTES, ARCH, ...) come dict di stringhe."""
+    import xml.etree.ElementTree as ET
+    hdr = hdr or _read_wim_header(path)
+    if not hdr or not hdr.xml_offset or not hdr.xml_size:
+        return []
     try:
-        cp = run([_find_wimlib_exe(), "--version"], capture=True)
-        return cp.returncode == 0
-    except Exception:
-        return False
+        with open(path, "rb") as f:
+            f.seek(hdr.xml_offset)
+            raw = f.read(hdr.xml_size)
+        root = ET.fromstring(raw.decode("utf-16-le", errors="replace").lstrip("\ufeff"))
+    except Exception as e:
+        log_error(f"[WIMXML] {path}: {e}")
+        return []
+    images: List[Dict[str, str]] = []
+    for img in root.findall("IMAGE"):
+        d: Dict[str, str] = {"INDEX": img.get("INDEX", "")}
+        for child in img:
+            if len(child):
+                # WINDOWS/ARCH, WINDOWS/EDITIONID, WINDOWS/VERSION/BUILD, ...
+                for sub in child.iter():
+                    if sub is not child and not len(sub) and sub.text:
+                        d[sub.tag] = sub.text.strip()
+            elif child.text:
+                d[child.tag] = child.text.strip()
+        images.append(d)
+    return images
+
+
+# ====== Cache file LRU (export) ======
+def _link_or_copy(src: Path, dst: Path) -> str:
+    """Crea dst come hard link di src (stesso volume) o, in alternativa, come copia.
+    Ritorna 'link' oppure 'copy'.
+    """
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        pass
+    with open(src, "rb") as fi, open(dst, "wb") as fo:
+        shutil.copyfileobj(fi, fo, 8 * 1024 * 1024)
+    shutil.copystat(src, dst)
+    return "copy"
 
 
-def _wimlib_compress_args(dest: Path, compress: str) -> List[str]:
-    args: List[str] = []
-    # Se il target è .esd o l'utente ha scelto 'recovery', forziamo --esd
-    if dest.suffix.lower() == ".esd" or compress.lower() == "recovery":
-        args.append("--esd")
-        return args
-    comp = compress.lower()
-    if comp == "none":
-        args.append("--compress=none")
-    elif comp == "fast":
-        args.append("--compress=XPRESS")
-    else:  # max
-        args.append("--compress=LZX")
-    return args
+class _LruFileCache:
+    """Cache di file indicizzata da chiave, con indice JSON ed eviction LRU per dimensione.
+    Ogni voce registra size/mtime: se il file in cache viene modificato (es. hard link
+    della destinazione poi montata RW) la voce viene scartata alla lettura.
+    """
 
+    INDEX_NAME = "index.json"
 
-def export_with_wimlib(src: Path, indexes: List[int], dest: Path, compress: str, label: str) -> None:
-    for i in indexes:
-        print(("Converto" if label == "CONVERTESD" else "Esporto"), f"indice {i} (wimlib)...")
-        cmd = [
-            _find_wimlib_exe(),
-            "export",
-            str(src),
-            str(i),
-            str(dest),
-            "--check",
-        ] + _wimlib_compress_args(dest, compress)
-        rc = _stream_wimlib_progress(cmd)
-        if rc != 0:
-            log_error(f"{label}: indice {i} fallito (wimlib)")
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        self.root = root
+        self.max_bytes = max(0, int(max_bytes))
 
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.root / self.INDEX_NAME, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception:
+            return {}
 
-def export_with_dism(src: Path, indexes: List[int], dest: Path, compress: str, label: str) -> None:
-    for i in indexes:
-        print(("Converto" if label == "CONVERTESD" else "Esporto"), f"indice {i} (dism)...")
-        # Usa una barra di progresso a riga singola anche per DISM (stderr parsing)
-        args = [
-            "/Export-Image",
-            f"/SourceImageFile:{str(src)}",
-            f"/SourceIndex:{i}",
-            f"/DestinationImageFile:{str(dest)}",
-            f"/Compress:{compress}",
-            "/CheckIntegrity",
-        ]
-        rc = _stream_dism_progress(args)
-        if rc != 0:
-            log_error(f"{label}: indice {i} fallito (dism)")
+    def _save(self, entries: Dict[str, dict]) -> None:
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.root / (self.INDEX_NAME + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.root / self.INDEX_NAME)
+        except Exception as e:
+            log_error(f"[CACHE] save index {self.root}: {e}")
 
+    def _drop(self, entries: Dict[str, dict], key: str) -> None:
+        ent = entries.pop(key, None)
+        if ent:
+            try:
+                (self.root / ent.get("file", "")).unlink()
+            except Exception:
+                pass
 
-def export_indices(src: Path, indexes: List[int], dest: Path, compress: str, label: str) -> None:
-    # Se il file di destinazione esiste, chiedi conferma per cancellare
-    if dest.exists() and dest.is_file():
-        ans = input(f"Il file di destinazione esiste ({dest}). Cancellarlo? [s/N]: ").strip().lower()
-        if ans not in {"s", "si", "sì", "y", "yes"}:
-            print("Operazione annullata.")
-            return
+    def get(self, key: str) -> Optional[Path]:
+        entries = self._load()
+        ent = entries.get(key)
+        if not ent:
+            return None
+        p = self.root / ent.get("file", "")
         try:
-            dest.unlink()
+            st = p.stat()
+            valid = st.st_size == ent.get("size") and st.st_mtime_ns == ent.get("mtime_ns")
+        except OSError:
+            valid = False
+        if not valid:
+            self._drop(entries, key)
+            self._save(entries)
+            return None
+        ent["last_used"] = time.time()
+        self._save(entries)
+        return p
+
+    def put(self, key: str, src: Path, meta: Optional[dict] = None) -> Optional[Path]:
+        try:
+            size = src.stat().st_size
+        except OSError:
+            return None
+        if size > self.max_bytes:
+            return None
+        entries = self._load()
+        self._drop(entries, key)
+        self._evict(entries, self.max_bytes - size)
+        self.root.mkdir(parents=True, exist_ok=True)
+        dst = self.root / (key + src.suffix.lower())
+        try:
+            if dst.exists():
+                dst.unlink()
+            _link_or_copy(src, dst)
+            st = dst.stat()
         except Exception as e:
-            print(f"[ERRORE] Impossibile cancellare {dest}: {e}")
-            return
-    backend = EXPORT_BACKEND
-    if backend == "auto":
-        backend = "wimlib" if has_wimlib() else "dism"
-    if backend == "wimlib":
-        export_with_wimlib(src, indexes, dest, compress, label)
-    else:
-        export_with_dism(src, indexes, dest, compress, label)
+            log_error(f"[CACHE] put {src} -> {dst}: {e}")
+            self._save(entries)
+            return None
+        entries[key] = {
+            "file": dst.name,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "last_used": time.time(),
+            "meta": meta or {},
+        }
+        self._save(entries)
+        return dst
+
+    def _evict(self, entries: Dict[str, dict], budget: int) -> None:
+        """Rimuove le voci meno recenti finché la dimensione totale non rientra in budget."""
+        total = sum(int(e.get("size", 0)) for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k].get("last_used", 0)):
+            if total <= budget:
+                break
+            total -= int(entries[key].get("size", 0))
+            self._drop(entries, key)
+
+    def total_bytes(self) -> int:
+        return sum(int(e.get("size", 0)) for e in self._load().values())
+
+    def clear(self) -> int:
+        entries = self._load()
+        n = len(entries)
+        for key in list(entries):
+            self._drop(entries, key)
+        self._save(entries)
+        return n
+
+
+def _export_cache() -> _LruFileCache:
+    root = EXPORT_CACHE_DIR if EXPORT_CACHE_DIR else Path(TEMP) / "PyDism_ExportCache"
+    return _LruFileCache(root, EXPORT_CACHE_MAX_GB * 1024**3)
+
+
+def _export_cache_key(src: Path, indexes: List[int], dest: Path, compress: str) -> Optional[str]:
+    """Chiave content-addressed: GUID sorgente + hash SHA-1 metadati per indice + profilo compressione.
+    Ritorna None se la sorgente non è leggibile nativamente (niente cache).
+    """
+    hdr = _read_wim_header(src)
+    if not hdr or hdr.total_parts != 1:
+        return None
+    parts = [hdr.guid]
+    for i in indexes:
+        if not 1 <= i <= len(hdr.metadata_hashes):
+            return None
+        parts.append(f"{i}:{hdr.metadata_hashes[i - 1]}")
+    # Il formato di destinazione (.esd => LZMS solid) fa parte del profilo di compressione
+    parts.append(f"{compress.lower()}:{dest.suffix.lower()}")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
 
-# ====== Helpers UI/log e progresso wimlib ======
-def tail_file(p: Path, n: int) -> List[str]:
-    if not p.exists():
-        return []
-    try:
-        with open(p, "r", encoding="utf-8", errors="replace") as f:
-            lines = f.readlines()
-        return lines[-n:]
-    except Exception:
-        return []
+# ====== Preflight spazio disco ======
+_GB = 1024 ** 3
+# Rapporto compresso/non compresso tipico per profilo (stima quando la sorgente ha un altro formato)
+_COMPRESS_RATIO = {"none": 1.0, "fast": 0.55, "max": 0.45, "recovery": 0.35, "lzms": 0.35}
+_WIM_HDR_COMPRESS_FLAGS = ((0x80000, "recovery"), (0x40000, "max"), (0x20000, "fast"))
+SPACE_MARGIN = 0.10  # margine relativo oltre alla stima
+SPACE_MARGIN_MIN = 512 * 1024 * 1024
 
 
-def menu_show_logs() -> None:
-    print_header("Log recenti")
-    print(f"[Error log] {ERRLOG}")
-    for line in tail_file(ERRLOG, LOG_TAIL_LINES):
-        print(line, end="")
-    print("\n")
-    print(f"[Verbose log] {VERBOSE_FILE}")
-    for line in tail_file(VERBOSE_FILE, LOG_TAIL_LINES):
-        print(line, end="")
-    print("\n")
-    # Nessuna pausa qui: il main gestisce già la pausa di ritorno al menu
+def _existing_ancestor(p: Path) -> Path:
+    p = Path(p).absolute()
+    while not p.exists() and p.parent != p:
+        p = p.parent
+    return p
 
 
-def _stream_wimlib_progress(cmd: List[str]) -> int:
-    """Esegue wimlib-imagex in streaming, mostrando una progress bar su UNA sola riga.
-    - Legge da stderr (dove wimlib scrive il progresso)
-    - Sopprime stdout (DEVNULL) per evitare output indesiderato e possibili wrap
-    - Adatta la lunghezza della barra alla larghezza della console per evitare il going-to-next-line
-    Ritorna il codice di uscita del processo.
-    """
-    def term_width(default: int = 80) -> int:
-        try:
-            import shutil as _sh
-            return int(_sh.get_terminal_size((default, 20)).columns)
-        except Exception:
-            return default
+def _free_bytes(p: Path) -> Optional[int]:
+    try:
+        return shutil.disk_usage(str(_existing_ancestor(p))).free
+    except OSError:
+        return None
+
 
+def _volume_of(p: Path) -> str:
+    """Identificativo del volume (lettera di unità su Windows, st_dev altrove)."""
+    anc = _existing_ancestor(p)
+    if anc.drive:
+        return anc.drive.upper()
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-        )
-    except FileNotFoundError:
-        log_error("wimlib-imagex non trovato")
-        return 1
+        return str(anc.stat().st_dev)
+    except OSError:
+        return str(anc.anchor)
+
+
+def _candidate_volumes() -> List[Path]:
+    """Radici dei volumi locali utilizzabili come posizione alternativa."""
+    if os.name == "nt":
+        import string
+        return [Path(f"{c}:\\") for c in string.ascii_uppercase if os.path.exists(f"{c}:\\")]
+    return [Path(p) for p in dict.fromkeys([TEMP, str(Path.home()), "/"])]
+
+
+def _source_compression(hdr: Optional[WimHeader], path: Path) -> str:
+    if hdr:
+        for flag, name in _WIM_HDR_COMPRESS_FLAGS:
+            if hdr.flags & flag:
+                return name
+        if not hdr.flags & 0x2:
+            return "none"
+    return "recovery" if path.suffix.lower() == ".esd" else "max"
+
+
+def estimate_mount_bytes(wim: Path, index: int) -> Optional[int]:
+    """Un mount DISM espande l'intero indice: TOTALBYTES dell'immagine."""
+    return _image_total_bytes(wim, index)
+
+
+def estimate_export_bytes(src: Path, indexes: List[int], dest: Path, compress: str) -> Optional[int]:
+    """Dimensione stimata dell'export: byte non compressi degli indici × rapporto di compressione
+    osservato sulla sorgente (dimensione file / byte totali), riscalato se il formato cambia.
+    """
+    hdr = _read_wim_header(src)
+    images = _read_wim_xml(src, hdr)
+    sizes = {im.get("INDEX"): int(im["TOTALBYTES"]) for im in images if im.get("TOTALBYTES", "").isdigit()}
+    if not sizes:
+        return None
+    try:
+        src_size = src.stat().st_size
+    except OSError:
+        return None
+    selected = sum(sizes.get(str(i), 0) for i in indexes)
+    target = "recovery" if dest.suffix.lower() == ".esd" else compress.lower()
+    src_comp = _source_compression(hdr, src)
+    observed = src_size / max(1, sum(sizes.values()))
+    ratio = observed * _COMPRESS_RATIO.get(target, 0.45) / _COMPRESS_RATIO.get(src_comp, 0.45)
+    # Export di tutti gli indici: mai meno della sorgente riscalata; mai più dei byte non compressi
+    return int(min(selected, max(selected * ratio, 1)))
+
+
+def preflight_space(needs: List[tuple[str, Path, Optional[int]]]) -> bool:
+    """Confronta le stime (etichetta, percorso di destinazione, byte) con lo spazio libero di ogni volume.
+    Se un volume non basta mostra il dettaglio, suggerisce volumi con spazio sufficiente e chiede conferma.
+    Dal thread di un job in background non chiede nulla (la console è del menu) e rifiuta.
+    Ritorna True se si può procedere.
+    """
+    per_vol: Dict[str, List[tuple[str, Path, int]]] = {}
+    for label, path, need in needs:
+        if need:
+            per_vol.setdefault(_volume_of(path), []).append((label, path, int(need * (1 + SPACE_MARGIN)) + SPACE_MARGIN_MIN))
+    ok = True
+    for vol, items in per_vol.items():
+        total = sum(n for _, _, n in items)
+        free = _free_bytes(items[0][1])
+        if free is None or free >= total:
+            continue
+        ok = False
+        print(color(f"[SPACE] Not enough free space on {items[0][1].anchor or vol}: need ~{total / _GB:.1f} GB, free {free / _GB:.1f} GB.", fg="bright_red", bold=True))
+        for label, path, n in items:
+            print(f"        - {label}: ~{n / _GB:.1f} GB in {path}")
+        alts = [(v, _free_bytes(v) or 0) for v in _candidate_volumes() if _volume_of(v) != vol]
+        alts = sorted([a for a in alts if a[1] >= total], key=lambda a: -a[1])
+        if alts:
+            print("        Locations with enough space: " + ", ".join(f"{v} ({f / _GB:.0f} GB free)" for v, f in alts[:4]))
+    if ok:
+        return True
+    if _current_job() is not None:
+        return False
+    try:
+        ans = input("Start anyway? (y/N): ").strip().lower()
+    except KeyboardInterrupt:
+        print()
+        return False
+    return ans in {"s", "si", "sì", "y", "yes"}
+
+
+def _mount_base_dir() -> Path:
+    return MOUNT_BASE if MOUNT_BASE else Path(TEMP)
+
+
+# ====== Pianificatore di posizionamento (mount, scratch DISM, export temporaneo) ======
+VOLUME_BENCH_FILE = CONFIG_DIR / "volume_bench.json"
+VOLUME_BENCH_MAX_AGE = 7 * 24 * 3600
+_WORK_DIR_NAME = "PyDism_Work"
+
+
+@dataclass
+class VolumeBench:
+    """Misura di un volume candidato: scrittura sequenziale (MB/s), file piccoli (file/s), spazio libero."""
+    __slots__ = ("folder", "volume", "seq_mbps", "small_fps", "free", "measured")
+    folder: str
+    volume: str
+    seq_mbps: float
+    small_fps: float
+    free: int
+    measured: float
+
+
+@dataclass
+class Placement:
+    """Cartelle scelte per un'operazione: base di mount, /ScratchDir di DISM, export temporaneo."""
+    __slots__ = ("mount_base", "scratch_dir", "export_temp")
+    mount_base: Optional[Path]
+    scratch_dir: Optional[Path]
+    export_temp: Optional[Path]
+
+
+def _local_work_folders() -> List[Path]:
+    """Cartelle di lavoro candidate: quelle configurate, altrimenti <volume>\\PyDism_Work sui dischi
+    fissi e RAM disk locali (più MOUNT_BASE e TEMP).
+    """
+    if PLACEMENT_CANDIDATES:
+        return [Path(p) for p in PLACEMENT_CANDIDATES]
+    out: List[Path] = []
+    if os.name == "nt":
+        try:
+            get_type = ctypes.windll.kernel32.GetDriveTypeW
+            # 3 = DRIVE_FIXED, 6 = DRIVE_RAMDISK (esclude rete, rimovibili, CD)
+            out = [v / _WORK_DIR_NAME for v in _candidate_volumes() if get_type(str(v)) in (3, 6)]
+        except Exception:
+            out = []
+    if MOUNT_BASE:
+        out.insert(0, MOUNT_BASE)
+    out.append(Path(TEMP))
+    seen, uniq = set(), []
+    for p in out:
+        vol = _volume_of(p)
+        if vol not in seen:
+            seen.add(vol)
+            uniq.append(p)
+    return uniq
+
+
+def benchmark_folder(folder: Path, seq_mb: int = 256, small_files: int = 300) -> Optional[VolumeBench]:
+    """Scrive seq_mb MB con buffer da 4 MiB (+fsync) e small_files file da 4 KiB; pulisce sempre."""
+    try:
+        folder.mkdir(parents=True, exist_ok=True)
+        probe = Path(tempfile.mkdtemp(prefix="bench_", dir=str(folder)))
+    except OSError as e:
+        log_error(f"[PLACEMENT] {folder} non utilizzabile: {e}")
+        return None
+    try:
+        block = os.urandom(4 * 1024 * 1024)
+        t0 = time.perf_counter()
+        with open(probe / "seq.bin", "wb", buffering=0) as f:
+            for _ in range(max(1, seq_mb // 4)):
+                f.write(block)
+            os.fsync(f.fileno())
+        seq_s = time.perf_counter() - t0
+        small = os.urandom(4096)
+        t0 = time.perf_counter()
+        for n in range(small_files):
+            with open(probe / f"s{n}.bin", "wb") as f:
+                f.write(small)
+        small_s = time.perf_counter() - t0
+        free = _free_bytes(folder) or 0
+        return VolumeBench(str(folder), _volume_of(folder), round(seq_mb / max(seq_s, 1e-6), 1),
+                           round(small_files / max(small_s, 1e-6), 1), free, time.time())
+    except OSError as e:
+        log_error(f"[PLACEMENT] benchmark fallito su {folder}: {e}")
+        return None
+    finally:
+        _remove_dir_tree(probe)
+
+
+_BENCH_LOCK = threading.Lock()
+
+
+def volume_benchmarks(refresh: bool = False) -> List[VolumeBench]:
+    """Misure dei candidati, dalla cache su disco se recenti (la velocità non cambia spesso;
+    lo spazio libero viene sempre riletto). Serializzato: con la cache scaduta un solo thread
+    misura (misure concorrenti si falserebbero a vicenda), gli altri leggono il risultato.
+    """
+    with _BENCH_LOCK:
+        return _volume_benchmarks(refresh)
+
+
+def _volume_benchmarks(refresh: bool) -> List[VolumeBench]:
+    try:
+        with open(VOLUME_BENCH_FILE, "r", encoding="utf-8") as f:
+            cached = {d["folder"]: VolumeBench(**d) for d in json.load(f)}
+    except Exception:
+        cached = {}
+    out: List[VolumeBench] = []
+    dirty = False
+    for folder in _local_work_folders():
+        b = cached.get(str(folder))
+        if refresh or not b or time.time() - b.measured > VOLUME_BENCH_MAX_AGE:
+            print(color(f"[PLACEMENT] Benchmarking {folder}...", fg="bright_black"))
+            b = benchmark_folder(folder)
+            dirty = True
+            if not b:
+                continue
+        else:
+            b.free = _free_bytes(Path(b.folder)) or 0
+        out.append(b)
+    if dirty:
+        import dataclasses
+        try:
+            CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = VOLUME_BENCH_FILE.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump([dataclasses.asdict(b) for b in out], f, indent=2)
+            os.replace(tmp, VOLUME_BENCH_FILE)
+        except Exception as e:
+            log_error(f"[PLACEMENT] salvataggio benchmark fallito: {e}")
+    return out
+
+
+def plan_placement(kind: str, need_bytes: Optional[int] = None) -> Placement:
+    """Sceglie le cartelle per un'operazione.
+    - kind='mount': mount base sul volume con più file piccoli/s e spazio per l'immagine espansa
+    - kind='export': export temporaneo sul volume con la scrittura sequenziale più veloce
+    La /ScratchDir va sul volume più veloce a file piccoli con almeno 1 GB libero.
+    Con il pianificatore disattivato ritorna le impostazioni statiche (MOUNT_BASE, nessuno scratch).
+    """
+    if not PLACEMENT_AUTO:
+        return Placement(MOUNT_BASE, None, None)
+    benches = volume_benchmarks()
+    need = int((need_bytes or 0) * (1 + SPACE_MARGIN)) + SPACE_MARGIN_MIN
+    # Cartelle di mount e /ScratchDir di DISM devono stare su NTFS (FAT32/exFAT rifiutati)
+    ntfs = [b for b in benches if os.name != "nt" or _fs_name(Path(b.folder)) == "NTFS"]
+
+    def _best(key, min_free: int, pool: List[VolumeBench] = benches) -> Optional[Path]:
+        fit = [b for b in pool if b.free >= min_free]
+        return Path(max(fit, key=key).folder) if fit else None
+
+    scratch = _best(lambda b: b.small_fps, 1 * _GB, ntfs)
+    if kind == "mount":
+        return Placement(_best(lambda b: b.small_fps, need, ntfs) or MOUNT_BASE, scratch, None)
+    if kind == "export":
+        return Placement(MOUNT_BASE, scratch, _best(lambda b: b.seq_mbps, need))
+    return Placement(MOUNT_BASE, scratch, None)
+
+
+def _scratch_args(args: List[str]) -> List[str]:
+    """Aggiunge /ScratchDir ai comandi di servicing offline (/Image:) se il pianificatore è attivo."""
+    if not PLACEMENT_AUTO or not args or not args[0].lower().startswith("/image:"):
+        return args
+    if any(a.lower().startswith("/scratchdir:") for a in args):
+        return args
+    scratch = plan_placement("scratch").scratch_dir
+    if not scratch:
+        return args
+    try:
+        scratch.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return args
+    return [*args, f"/ScratchDir:{scratch}"]
+
+
+def _export_staging_path(dest: Path, need: Optional[int]) -> Optional[Path]:
+    """Export temporaneo su un volume più veloce della destinazione (almeno 2× in scrittura sequenziale)."""
+    fast = plan_placement("export", need).export_temp
+    if not fast or _volume_of(fast) == _volume_of(dest):
+        return None
+    benches = {b.volume: b for b in volume_benchmarks()}
+    dest_b = benches.get(_volume_of(dest))
+    fast_b = benches.get(_volume_of(fast))
+    # Destinazione non misurata (es. share di rete) o nettamente più lenta
+    if dest_b and fast_b and fast_b.seq_mbps < 2 * dest_b.seq_mbps:
+        return None
+    try:
+        fast.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return fast / f"export_{os.getpid()}_{int(time.time())}{dest.suffix}"
+
+
+# ====== Staging locale delle sorgenti remote ======
+_STAGE_BUFFER = 16 * 1024 * 1024
+STAGING_PROBE_BYTES = 64 * 1024 * 1024
+STAGING_SLOW_MBPS = 60.0  # sotto questa velocità di lettura sequenziale la sorgente è "lenta"
+
+
+def _staging_cache() -> _LruFileCache:
+    root = STAGING_DIR if STAGING_DIR else Path(TEMP) / "PyDism_Staging"
+    return _LruFileCache(root, STAGING_MAX_GB * 1024**3)
+
+
+def _is_remote_path(p: Path) -> bool:
+    """Percorso UNC o unità di rete mappata."""
+    s = str(p)
+    if s.startswith("\\\\") or s.startswith("//"):
+        return True
+    if os.name == "nt":
+        try:
+            root = Path(s).resolve().anchor
+            # 4 = DRIVE_REMOTE
+            return ctypes.windll.kernel32.GetDriveTypeW(root) == 4
+        except Exception:
+            return False
+    return False
+
+
+def _probe_read_mbps(p: Path, nbytes: int = STAGING_PROBE_BYTES) -> Optional[float]:
+    """Velocità di lettura sequenziale dalla metà del file (evita l'header appena letto, già in cache)."""
+    try:
+        size = p.stat().st_size
+        if size < 2 * nbytes:
+            return None
+        with open(p, "rb", buffering=0) as f:
+            f.seek(size // 2)
+            t0 = time.perf_counter()
+            left = nbytes
+            while left > 0:
+                chunk = f.read(min(_STAGE_BUFFER, left))
+                if not chunk:
+                    break
+                left -= len(chunk)
+            secs = time.perf_counter() - t0
+        return (nbytes - left) / max(secs, 1e-6) / (1024 * 1024)
+    except OSError:
+        return None
+
+
+def _copy_large(src: Path, dst: Path, total: int) -> None:
+    """Copia sequenziale con buffer grandi e riga di progresso (MB/s, ETA)."""
+    meter = _RateMeter(total)
+    job = _current_job()
+    if job is not None:
+        job.set_progress(0.0, phase="stage")
+    done = 0
+    last = 0.0
+    show = WIMLIB_PROGRESS_MODE != "off" and not _json_to_stdout() and job is None
+    with open(src, "rb", buffering=0) as fi, open(dst, "wb", buffering=0) as fo:
+        buf = bytearray(_STAGE_BUFFER)
+        view = memoryview(buf)
+        while True:
+            n = fi.readinto(buf)
+            if not n:
+                break
+            fo.write(view[:n])
+            done += n
+            meter.update(done)
+            now = time.monotonic()
+            if now - last >= 0.5:
+                last = now
+                pct = done * 100.0 / max(1, total)
+                if job is not None:
+                    job.set_progress(pct)
+                elif show:
+                    sys.stdout.write("\r" + color("Staging:", fg="bright_cyan", bold=True) + f" {int(pct):3d}%{meter.suffix()}   ")
+                    sys.stdout.flush()
+        os.fsync(fo.fileno())
+    if show:
+        sys.stdout.write("\r" + color("Staging:", fg="bright_cyan", bold=True) + " 100%" + " " * 30 + "\n")
+        sys.stdout.flush()
+    _record_telemetry("stage-copy", meter, 0, source=str(src))
+
+
+def stage_source(src: Path) -> Path:
+    """Se la sorgente è remota (o lenta) ritorna una copia locale dalla cache di staging,
+    creandola se serve; altrimenti ritorna src. La copia è verificata per dimensione e GUID
+    ed è riusata finché la sorgente non cambia (chiave: GUID + dimensione + mtime).
+    Solo per letture: export e mount in sola lettura.
+    """
+    if not SOURCE_STAGING or src.suffix.lower() == ".swm":
+        return src
+    hdr = _read_wim_header(src)
+    if not hdr or hdr.total_parts != 1:
+        return src
+    try:
+        st = src.stat()
+    except OSError:
+        return src
+    key = hashlib.sha1(f"{hdr.guid}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8")).hexdigest()
+    cache = _staging_cache()
+    hit = cache.get(key)
+    if hit:
+        print(color(f"[STAGING] Using local copy of {src.name}: {hit}", fg="bright_green"))
+        return hit
+    if not _is_remote_path(src):
+        rate = _probe_read_mbps(src)
+        if rate is None or rate >= STAGING_SLOW_MBPS:
+            return src
+        print(color(f"[STAGING] {src.name}: slow source ({rate:.0f} MB/s).", fg="bright_cyan"))
+    if st.st_size > cache.max_bytes:
+        print(color(f"[STAGING] {src.name} is larger than the staging cache ({STAGING_MAX_GB} GB): reading in place.", fg="bright_yellow"))
+        return src
+    if not preflight_space([("staging copy", cache.root, st.st_size)]):
+        print(color(f"[STAGING] Not staging {src.name}: reading in place.", fg="bright_yellow"))
+        return src
+    cache.root.mkdir(parents=True, exist_ok=True)
+    tmp = cache.root / f"incoming_{key}{src.suffix.lower()}"
+    print(color(f"[STAGING] Copying {src.name} ({st.st_size / _GB:.1f} GB) to {cache.root}...", fg="bright_cyan"))
+    try:
+        _copy_large(src, tmp, st.st_size)
+        copy_hdr = _read_wim_header(tmp)
+        if tmp.stat().st_size != st.st_size or not copy_hdr or copy_hdr.guid != hdr.guid:
+            raise OSError("verification failed (size/GUID mismatch)")
+        staged = cache.put(key, tmp, {"src": str(src), "guid": hdr.guid, "size": st.st_size})
+    except Exception as e:
+        log_error(f"[STAGING] copia di {src} fallita: {e}")
+        print(color(f"[WARN] Staging failed ({e}): reading the source in place.", fg="bright_yellow"))
+        staged = None
+    finally:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+    return staged or src
+
+
+# ====== Wimlib integration & export helpers ======
+def has_wimlib() -> bool:
+    try:
+        cp = run([_find_wimlib_exe(), "--version"], capture=True)
+        return cp.returncode == 0
+    except Exception:
+        return False
+
+
+def _wimlib_compress_args(dest: Path, compress: str) -> List[str]:
+    args: List[str] = []
+    # Se il target è .esd o l'utente ha scelto 'recovery', forziamo --esd
+    if dest.suffix.lower() == ".esd" or compress.lower() == "recovery":
+        args.append("--esd")
+        return args
+    comp = compress.lower()
+    if comp == "none":
+        args.append("--compress=none")
+    elif comp == "fast":
+        args.append("--compress=XPRESS")
+    else:  # max
+        args.append("--compress=LZX")
+    return args
+
+
+class _ExportJournal:
+    """Journal di un export multi-indice, salvato accanto alla destinazione.
+    Registra gli indici già verificati nella destinazione (in ordine di scrittura) e i GUID
+    di sorgente/destinazione, così un export interrotto può riprendere dal primo indice mancante.
+    """
+
+    SUFFIX = ".pydism-job.json"
+
+    def __init__(self, src: Path, dest: Path, indexes: List[int], compress: str, src_guid: str) -> None:
+        self.src = src
+        self.dest = dest
+        self.indexes = list(indexes)
+        self.compress = compress
+        self.src_guid = src_guid
+        self.dest_guid: Optional[str] = None
+        self.done: List[int] = []
+
+    @property
+    def path(self) -> Path:
+        return self.dest.with_name(self.dest.name + self.SUFFIX)
+
+    @classmethod
+    def load(cls, dest: Path) -> Optional["_ExportJournal"]:
+        p = dest.with_name(dest.name + cls.SUFFIX)
+        try:
+            with open(p, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            j = cls(Path(data["src"]), dest, [int(i) for i in data["indexes"]], str(data["compress"]), str(data["src_guid"]))
+            j.dest_guid = data.get("dest_guid")
+            j.done = [int(i) for i in data.get("done", [])]
+            return j
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log_error(f"[JOURNAL] journal non leggibile {p}: {e}")
+            return None
+
+    def save(self) -> None:
+        data = {
+            "src": str(self.src),
+            "src_guid": self.src_guid,
+            "indexes": self.indexes,
+            "compress": self.compress,
+            "dest_guid": self.dest_guid,
+            "done": self.done,
+            "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        try:
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            log_error(f"[JOURNAL] salvataggio fallito {self.path}: {e}")
+
+    def remove(self) -> None:
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_error(f"[JOURNAL] rimozione fallita {self.path}: {e}")
+
+    def remaining(self) -> List[int]:
+        return [i for i in self.indexes if i not in self.done]
+
+    def _dest_matches(self, expected: List[int]) -> bool:
+        """Verifica che la destinazione contenga esattamente le immagini 'expected' (per nome, in ordine)."""
+        hdr = _read_wim_header(self.dest)
+        if not hdr or hdr.image_count != len(expected):
+            return False
+        if self.dest_guid and hdr.guid != self.dest_guid:
+            return False
+        src_names = {d.get("INDEX"): d.get("NAME") for d in _read_wim_xml(self.src)}
+        dest_names = [d.get("NAME") for d in _read_wim_xml(self.dest, hdr)]
+        if len(dest_names) != len(expected):
+            return False
+        for pos, i in enumerate(expected):
+            if src_names.get(str(i)) != dest_names[pos]:
+                return False
+        self.dest_guid = hdr.guid
+        return True
+
+    def record(self, index: int) -> bool:
+        """Registra 'index' come completato solo se la destinazione lo contiene davvero."""
+        if not self._dest_matches(self.done + [index]):
+            log_error(f"[JOURNAL] indice {index} non verificato in {self.dest}")
+            return False
+        self.done.append(index)
+        self.save()
+        return True
+
+    def can_resume(self, src: Path, indexes: List[int], compress: str) -> bool:
+        """True se journal e destinazione parziale sono coerenti con la richiesta corrente."""
+        hdr = _read_wim_header(src)
+        if not hdr or hdr.guid != self.src_guid:
+            return False
+        if self.indexes != list(indexes) or self.compress != compress or not self.done:
+            return False
+        return self._dest_matches(self.done)
+
+
+def export_with_wimlib(src: Path, indexes: List[int], dest: Path, compress: str, label: str, journal: Optional[_ExportJournal] = None) -> bool:
+    ok = True
+    for i in indexes:
+        print(("Converto" if label == "CONVERTESD" else "Esporto"), f"indice {i} (wimlib)...")
+        cmd = [
+            _find_wimlib_exe(),
+            "export",
+            str(src),
+            str(i),
+            str(dest),
+            "--check",
+        ] + _wimlib_compress_args(dest, compress)
+        rc = _stream_wimlib_progress(cmd, _image_total_bytes(src, i), dest)
+        if rc != 0:
+            ok = False
+            log_error(f"{label}: indice {i} fallito (wimlib)")
+            if journal:
+                # Con il journal ci si ferma: la ripresa accoda gli indici mancanti nell'ordine richiesto
+                return False
+        elif journal and not journal.record(i):
+            # Destinazione non coerente: proseguire renderebbe il journal inutilizzabile
+            return False
+    return ok
+
+
+def export_with_dism(src: Path, indexes: List[int], dest: Path, compress: str, label: str, journal: Optional[_ExportJournal] = None) -> bool:
+    ok = True
+    for i in indexes:
+        print(("Converto" if label == "CONVERTESD" else "Esporto"), f"indice {i} (dism)...")
+        # Usa una barra di progresso a riga singola anche per DISM (stderr parsing)
+        args = [
+            "/Export-Image",
+            f"/SourceImageFile:{str(src)}",
+            f"/SourceIndex:{i}",
+            f"/DestinationImageFile:{str(dest)}",
+            f"/Compress:{compress}",
+            "/CheckIntegrity",
+        ]
+        rc = _stream_dism_progress(args, _image_total_bytes(src, i), dest)
+        if rc != 0:
+            ok = False
+            log_error(f"{label}: indice {i} fallito (dism)")
+            if journal:
+                return False
+        elif journal and not journal.record(i):
+            return False
+    return ok
+
+
+def export_indices(src: Path, indexes: List[int], dest: Path, compress: str, label: str,
+                   background: Optional[BackgroundChoice] = None) -> bool:
+    """Prompt interattivi (ripresa, sovrascrittura), cache, poi export vero e proprio.
+    Con background (risposta di _ask_background) l'export viene accodato come job dopo le domande; ritorna True se accodato.
+    Sorgente e destinazione restano riservate al menu per tutta la durata (un job accodato attende).
+    """
+    with _ForegroundClaim(src, dest):
+        return _export_indices(src, indexes, dest, compress, label, background)
+
+
+def _export_indices(src: Path, indexes: List[int], dest: Path, compress: str, label: str,
+                    background: Optional[BackgroundChoice]) -> bool:
+    def _start(journal: Optional[_ExportJournal], cache_key: Optional[str]) -> bool:
+        todo = journal.remaining() if journal else indexes
+        if not preflight_space([(f"{label.lower()} output", dest, estimate_export_bytes(src, todo, dest, compress))]):
+            print("Operazione annullata.")
+            return False
+        if not background:
+            return _run_export(src, indexes, dest, compress, label, journal, cache_key)
+        _submit_job(f"{label.capitalize()} {src.name} [{' '.join(map(str, indexes))}] -> {dest.name}", label.lower(), [src, dest],
+                    lambda: _run_export(src, indexes, dest, compress, label, journal, cache_key), background)
+        return True
+
+    # Export interrotto in precedenza: se journal e destinazione parziale sono coerenti, riprendi
+    journal = _ExportJournal.load(dest)
+    if journal and dest.is_file():
+        if journal.can_resume(src, indexes, compress):
+            print(color(f"[RESUME] Partial export found: indexes {journal.done} already verified in {dest.name}.", fg="bright_cyan", bold=True))
+            ans = input("Resume from the first missing index? [Y/n]: ").strip().lower()
+            if ans in {"", "y", "yes", "s", "si", "sì"}:
+                return _start(journal, None)
+        else:
+            print("[INFO] Export journal found but it does not match this request/destination: starting over.")
+    if journal:
+        journal.remove()
+    # Se il file di destinazione esiste, chiedi conferma per cancellare
+    if dest.exists() and dest.is_file():
+        ans = input(f"Il file di destinazione esiste ({dest}). Cancellarlo? [s/N]: ").strip().lower()
+        if ans not in {"s", "si", "sì", "y", "yes"}:
+            print("Operazione annullata.")
+            return False
+        try:
+            dest.unlink()
+        except Exception as e:
+            print(f"[ERRORE] Impossibile cancellare {dest}: {e}")
+            return False
+    # Cache export: stessa sorgente/indici/compressione => riusa l'artefatto già prodotto
+    cache_key = _export_cache_key(src, indexes, dest, compress) if EXPORT_CACHE else None
+    if cache_key:
+        hit = _export_cache().get(cache_key)
+        if hit:
+            try:
+                how = _link_or_copy(hit, dest)
+                print(color(f"[CACHE] Export served from cache ({how}): {hit.name}", fg="bright_green", bold=True))
+                _auto_manifest([dest], label.lower())
+                return True
+            except Exception as e:
+                log_error(f"{label}: cache hit non utilizzabile {hit}: {e}")
+    journal = None
+    if len(indexes) > 1:
+        src_hdr = _read_wim_header(src)
+        if src_hdr:
+            journal = _ExportJournal(src, dest, indexes, compress, src_hdr.guid)
+            journal.save()
+    return _start(journal, cache_key)
+
+
+def _run_export(src: Path, indexes: List[int], dest: Path, compress: str, label: str,
+                journal: Optional[_ExportJournal], cache_key: Optional[str]) -> bool:
+    """Esegue l'export con il backend configurato, saltando gli indici già nel journal."""
+    src = stage_source(src)
+    todo = journal.remaining() if journal else list(indexes)
+    backend = EXPORT_BACKEND
+    if backend == "auto":
+        backend = "wimlib" if has_wimlib() else "dism"
+    # Pianificatore: export su un volume veloce e spostamento finale (solo export non ancora iniziati;
+    # un export parziale resta accanto al suo journal per poter riprendere)
+    final_dest = dest
+    staging = None
+    if PLACEMENT_AUTO and not dest.exists() and (journal is None or not journal.done):
+        staging = _export_staging_path(dest, estimate_export_bytes(src, todo, dest, compress))
+    if staging:
+        print(color(f"[PLACEMENT] Exporting to {staging.parent} then moving to {dest.parent}.", fg="bright_cyan"))
+        if journal:
+            journal.remove()
+            journal = None
+        dest = staging
+    if backend == "wimlib":
+        ok = export_with_wimlib(src, todo, dest, compress, label, journal)
+    else:
+        ok = export_with_dism(src, todo, dest, compress, label, journal)
+    if staging:
+        dest = final_dest
+        try:
+            if ok:
+                shutil.move(str(staging), str(dest))
+            else:
+                staging.unlink()
+        except OSError as e:
+            ok = False
+            log_error(f"{label}: spostamento export temporaneo {staging} -> {dest} fallito: {e}")
+            print(color(f"[ERROR] Could not move {staging} to {dest}: {e}", fg="bright_red"))
+    if journal:
+        if ok and not journal.remaining():
+            journal.remove()
+        else:
+            ok = False
+            print(color(f"[INFO] Export incomplete: verified {journal.done}. Run the same export again to resume.", fg="bright_yellow"))
+    if ok and cache_key is None and EXPORT_CACHE:
+        cache_key = _export_cache_key(src, indexes, dest, compress)
+    if ok and cache_key and dest.exists():
+        meta = {"src": str(src), "indexes": indexes, "compress": compress, "backend": backend}
+        if _export_cache().put(cache_key, dest, meta):
+            print(color("[CACHE] Export stored in cache.", fg="bright_cyan"))
+    if ok:
+        _auto_manifest([dest], label.lower())
+    return ok
+
+# ====== Helpers UI/log e progresso wimlib ======
+def tail_file(p: Path, n: int) -> List[str]:
+    if not p.exists():
+        return []
+    try:
+        with open(p, "r", encoding="utf-8", errors="replace") as f:
+            lines = f.readlines()
+        return lines[-n:]
+    except Exception:
+        return []
+
+
+def menu_show_logs() -> None:
+    print_header("Log recenti")
+    print(f"[Error log] {ERRLOG}")
+    for line in tail_file(ERRLOG, LOG_TAIL_LINES):
+        print(line, end="")
+    print("\n")
+    print(f"[Verbose log] {VERBOSE_FILE}")
+    for line in tail_file(VERBOSE_FILE, LOG_TAIL_LINES):
+        print(line, end="")
+    print("\n")
+    print(f"[Telemetry] {TELEMETRY_FILE}")
+    for line in tail_file(TELEMETRY_FILE, LOG_TAIL_LINES):
+        try:
+            t = json.loads(line)
+            print(f"{t.get('timestamp')} {t.get('op')} rc={t.get('rc')} {t.get('seconds')}s avg={t.get('avg_mbps', '-')} MB/s "
+                  f"min={t.get('min_mbps', '-')} write={t.get('write_mbps', '-')} MB/s {t.get('target_drive', '')} {t.get('target', '')}")
+        except Exception:
+            print(line, end="")
+    print("\n")
+    # Nessuna pausa qui: il main gestisce già la pausa di ritorno al menu
+
+
+# ====== Throughput, ETA e telemetria delle operazioni ======
+TELEMETRY_FILE: Path = Path(TEMP) / "PyDism_Telemetry.jsonl"
+_WIMLIB_BYTES_RE = re.compile(r"(\d+)\s*(B|KiB|MiB|GiB|TiB) of (\d+)\s*(B|KiB|MiB|GiB|TiB)")
+_UNIT_SHIFT = {"B": 0, "KiB": 10, "MiB": 20, "GiB": 30, "TiB": 40}
+
+
+class _RateMeter:
+    """Throughput su finestra mobile (media degli ultimi WINDOW secondi) ed ETA.
+    I byte elaborati arrivano dai contatori di wimlib oppure da percentuale × byte totali;
+    in parallelo si campiona la crescita del file di destinazione (velocità di scrittura).
+    MB/s mostrati: contatori wimlib, altrimenti crescita del file, altrimenti percentuale × totale.
+    """
+
+    WINDOW = 10.0
+    SAMPLE_EVERY = 0.5
+
+    def __init__(self, total_bytes: Optional[int] = None, watch: Optional[Path] = None) -> None:
+        import collections
+        self.total = total_bytes or None
+        self.watch = watch
+        self.t0 = time.monotonic()
+        self.done = 0
+        self._samples: "collections.deque[tuple[float, int]]" = collections.deque()
+        self._w_samples: "collections.deque[tuple[float, int]]" = collections.deque()
+        self._counters = False  # True dopo la prima riga con contatori di byte wimlib
+        self._w_start: Optional[int] = self._watch_size()
+        self._w_last = self._w_start
+        self._last_sample = 0.0
+        self.min_mbps: Optional[float] = None
+        self.max_mbps: Optional[float] = None
+
+    def _watch_size(self) -> Optional[int]:
+        if not self.watch:
+            return None
+        try:
+            return self.watch.stat().st_size
+        except OSError:
+            return 0
+
+    def feed_line(self, raw: str, percent: Optional[float]) -> None:
+        """Aggiorna da una riga di output: contatori wimlib se presenti, altrimenti percentuale."""
+        m = _WIMLIB_BYTES_RE.search(raw)
+        if m:
+            done = int(m.group(1)) << _UNIT_SHIFT[m.group(2)]
+            total = int(m.group(3)) << _UNIT_SHIFT[m.group(4)]
+            if total:
+                self.total = total
+                self._counters = True
+                # Con unità grossolane (GiB) la percentuale è più fine del contatore
+                if percent is not None:
+                    done = max(done, int(total * percent / 100.0))
+                self.update(done)
+                return
+        if percent is not None and self.total:
+            self.update(int(self.total * percent / 100.0))
+        elif self.watch:
+            self.update(self.done)
+
+    def update(self, done: int) -> None:
+        now = time.monotonic()
+        self.done = max(self.done, done)
+        if now - self._last_sample < self.SAMPLE_EVERY and self._samples:
+            return
+        self._last_sample = now
+        self._samples.append((now, self.done))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.WINDOW:
+            self._samples.popleft()
+        if self.watch:
+            self._w_last = self._watch_size()
+            self._w_samples.append((now, self._w_last or 0))
+            while len(self._w_samples) > 2 and now - self._w_samples[0][0] > self.WINDOW:
+                self._w_samples.popleft()
+        r = self.mbps()
+        if r is not None and now - self.t0 >= self.WINDOW:
+            # Estremi solo a regime, quando la finestra è piena
+            self.min_mbps = r if self.min_mbps is None else min(self.min_mbps, r)
+            self.max_mbps = r if self.max_mbps is None else max(self.max_mbps, r)
+
+    @staticmethod
+    def _window_rate(samples) -> Optional[float]:
+        if len(samples) < 2:
+            return None
+        (t1, b1), (t2, b2) = samples[0], samples[-1]
+        if t2 - t1 < 1.0:
+            return None
+        return (b2 - b1) / (t2 - t1) / (1024 * 1024)
+
+    def mbps(self) -> Optional[float]:
+        # Senza contatori wimlib la crescita del file misura byte reali, non una stima da percentuale
+        if not self._counters and self.watch:
+            r = self._window_rate(self._w_samples)
+            if r is not None:
+                return r
+        return self._window_rate(self._samples)
+
+    def eta(self) -> Optional[float]:
+        # Stessa unità di total/done (byte elaborati), anche quando i MB/s mostrati sono di scrittura
+        r = self._window_rate(self._samples)
+        if not r or not self.total:
+            return None
+        return max(0.0, (self.total - self.done) / (r * 1024 * 1024))
+
+    def suffix(self) -> str:
+        """' 123.4 MB/s ETA 02:10' per la barra di progresso (vuoto finché non misurabile)."""
+        r = self.mbps()
+        if r is None:
+            return ""
+        return f" {r:6.1f} MB/s ETA {_fmt_duration(self.eta())}"
+
+    def summary(self) -> Dict[str, object]:
+        secs = max(0.001, time.monotonic() - self.t0)
+        written = None
+        if self.watch and self._w_start is not None:
+            self._w_last = self._watch_size()
+            written = max(0, (self._w_last or 0) - self._w_start)
+        return {
+            "seconds": round(secs, 1),
+            "bytes": self.done or None,
+            "total_bytes": self.total,
+            "avg_mbps": round(self.done / secs / (1024 * 1024), 2) if self.done else None,
+            "min_mbps": round(self.min_mbps, 2) if self.min_mbps is not None else None,
+            "max_mbps": round(self.max_mbps, 2) if self.max_mbps is not None else None,
+            "written_bytes": written,
+            "write_mbps": round(written / secs / (1024 * 1024), 2) if written else None,
+        }
+
+
+def _record_telemetry(op: str, meter: _RateMeter, rc: int, **context) -> None:
+    """Accoda una riga JSON per operazione (durata, MB/s medio/min/max, byte scritti, volume di destinazione)."""
+    rec: Dict[str, object] = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "op": op, "rc": rc}
+    if meter.watch:
+        rec["target"] = str(meter.watch)
+        try:
+            full = meter.watch.resolve()
+        except OSError:
+            full = meter.watch
+        rec["target_drive"] = full.drive or full.anchor
+    rec.update({k: v for k, v in context.items() if v is not None})
+    rec.update({k: v for k, v in meter.summary().items() if v is not None})
+    try:
+        with _VERBOSE_LOCK, open(TELEMETRY_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    except Exception:
+        pass
+
+
+def _image_total_bytes(wim: Path, index: int) -> Optional[int]:
+    """TOTALBYTES dell'indice dall'XML del WIM (dimensione non compressa), se disponibile."""
+    try:
+        for im in _read_wim_xml(wim):
+            if im.get("INDEX") == str(index) and im.get("TOTALBYTES", "").isdigit():
+                return int(im["TOTALBYTES"])
+    except Exception:
+        pass
+    return None
+
+
+def _stream_wimlib_progress(cmd: List[str], total_bytes: Optional[int] = None, watch: Optional[Path] = None) -> int:
+    """Esegue wimlib-imagex in streaming, mostrando una progress bar su UNA sola riga.
+    - Legge da stderr (dove wimlib scrive il progresso)
+    - Sopprime stdout (DEVNULL) per evitare output indesiderato e possibili wrap
+    - Adatta la lunghezza della barra alla larghezza della console per evitare il going-to-next-line
+    - MB/s ed ETA dai contatori di byte di wimlib (o percentuale × total_bytes); 'watch' = file di destinazione
+    Ritorna il codice di uscita del processo.
+    """
+    meter = _RateMeter(total_bytes, watch)
+    op = f"wimlib-{cmd[1]}" if len(cmd) > 1 else "wimlib"
+    job = _current_job()
+    if job is not None:
+        rc = job.run(cmd, meter)
+        _record_telemetry(op, meter, rc, job=job.id)
+        return rc
+
+    def term_width(default: int = 80) -> int:
+        try:
+            import shutil as _sh
+            return int(_sh.get_terminal_size((default, 20)).columns)
+        except Exception:
+            return default
+
+    try:
+        proc = _popen_child(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+    except FileNotFoundError:
+        log_error("wimlib-imagex non trovato")
+        return 1
 
     percent_last = -1
     last_print_len = 0
@@ -1686,7 +4589,9 @@ def _stream_wimlib_progress(cmd: List[str]) -> int:
     prefix_plain = "Progresso: "
     suffix_plain = " []"
     # riserva 12 char per "XXX% " e 2 per le parentesi + 2 margini
-    bar_max = max(10, min(50, cols - (len(prefix_plain) + 12 + 2 + 2)))
+    # riserva anche ~24 char per " 123.4 MB/s ETA 00:00"
+    bar_max = max(10, min(50, cols - (len(prefix_plain) + 12 + 2 + 2 + 24)))
+    last_draw = 0.0
 
     assert proc.stderr is not None
     try:
@@ -1694,27 +4599,157 @@ def _stream_wimlib_progress(cmd: List[str]) -> int:
             raw = line.rstrip("\r\n")
             # Cerca percentuali intere o decimali e arrotonda
             m = re.search(r"(\d+(?:\.\d+)?)%", raw)
+            meter.feed_line(raw, float(m.group(1)) if m else None)
             if m:
                 try:
                     p = int(float(m.group(1)) + 0.5)
                     p = max(0, min(100, p))
-                    if p != percent_last:
+                    if p != percent_last or time.monotonic() - last_draw >= 1.0:
                         percent_last = p
-                        if WIMLIB_PROGRESS_MODE != "off":
+                        last_draw = time.monotonic()
+                        if WIMLIB_PROGRESS_MODE != "off" and not _json_to_stdout():
                             # Calcola barra
                             filled = int((p / 100.0) * bar_max)
                             bar_plain = "#" * filled
+                            rate = meter.suffix()
                             # Costruisci stringa colorata (stessa lunghezza visiva)
                             prog = (
                                 color("Progresso:", fg="bright_cyan", bold=True)
                                 + f" {p:3d}% ["
                                 + color(f"{bar_plain:<{bar_max}}", fg="bright_green")
                                 + "]"
+                                + rate
                             )
                             # Stampa su una riga: CR + stringa + padding spazi per cancellare residui
                             sys.stdout.write("\r" + prog)
                             # Padding per cancellare eventuali residui da stampe più lunghe
-                            vis_len_est = len(prefix_plain) + 5 + 2 + bar_max  # stima senza codici ANSI
+                            vis_len_est = len(prefix_plain) + 5 + 2 + bar_max + len(rate)  # stima senza codici ANSI
+                            pad = max(0, last_print_len - vis_len_est)
+                            if pad:
+                                sys.stdout.write(" " * pad)
+                            sys.stdout.flush()
+                            last_print_len = vis_len_est
+                except Exception:
+                    pass
+            # In verbose, riporta anche le linee complete sul file
+            if VERBOSE:
+                try:
+                    with open(VERBOSE_FILE, "a", encoding="utf-8") as f:
+                        f.write(raw + "\n")
+                except Exception:
+                    pass
+    except KeyboardInterrupt:
+        try:
+            proc.terminate()
+        except Exception:
+            pass
+        proc.wait(timeout=5)
+        print("\n[INFO] Operazione annullata dall'utente.")
+        return 130
+
+    rc = proc.wait()
+    if percent_last >= 0 and WIMLIB_PROGRESS_MODE != "off" and not _json_to_stdout():
+        # Forza 100% su singola riga e a capo finale
+        filled = bar_max
+        prog = (
+            color("Progresso:", fg="bright_cyan", bold=True)
+            + " 100% ["
+            + color("#" * filled, fg="bright_green")
+            + "]"
+        )
+        summ = meter.summary()
+        done_txt = f" avg {summ['avg_mbps']:.1f} MB/s in {_fmt_duration(summ['seconds'])}" if summ["avg_mbps"] else ""
+        vis_len_est = len(prefix_plain) + 5 + 2 + bar_max + len(done_txt)
+        sys.stdout.write("\r" + prog + done_txt + " " * max(0, last_print_len - vis_len_est) + "\n")
+        sys.stdout.flush()
+    _record_telemetry(op, meter, rc)
+    return rc
+
+def _count_third_party_drivers(image_dir: Path, spinner: bool = True) -> int:
+    r"""Conta i driver di terze parti nell'immagine montata: oem*.inf in Windows\INF (istantaneo),
+    oppure DISM /Get-Drivers se la cartella non è leggibile. Stessa fonte di _third_party_drivers,
+    così il delta prima/dopo che decide il commit confronta conteggi omogenei.
+    Ritorna un intero >= 0. In caso di errore restituisce 0 e logga l'evento.
+    """
+    oems = _oem_infs(image_dir)
+    if oems is not None:
+        return len(oems)
+    try:
+        return sum(1 for d in get_drivers(image_dir, spinner).records if not d.inbox)
+    except Exception as e:
+        log_error(f"_count_third_party_drivers error: {e}")
+        return 0
+
+def _stream_dism_progress(args: List[str], total_bytes: Optional[int] = None, watch: Optional[Path] = None) -> int:
+    """Esegue DISM in streaming e mostra progresso su una sola riga.
+    Analogo a _stream_wimlib_progress: legge stderr, estrae percentuali e riscrive la riga.
+    DISM espone solo la percentuale: i MB/s derivano da percentuale × total_bytes (TOTALBYTES della sorgente).
+    """
+    def term_width(default: int = 80) -> int:
+        try:
+            import shutil as _sh
+            return int(_sh.get_terminal_size((default, 20)).columns)
+        except Exception:
+            return default
+
+    args = _scratch_args(args)
+    cmd = ["dism", *args]
+    meter = _RateMeter(total_bytes, watch)
+    op = "dism-" + (args[0].lstrip("/").lower() if args else "")
+    job = _current_job()
+    if job is not None:
+        rc = job.run(cmd, meter)
+        _record_telemetry(op, meter, rc, job=job.id)
+        return rc
+    try:
+        proc = _popen_child(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+    except FileNotFoundError:
+        log_error("DISM non trovato nel PATH")
+        return 1
+
+    percent_last = -1
+    last_print_len = 0
+    cols = max(40, term_width(80))
+    prefix_plain = "Progresso: "
+    # riserva anche ~24 char per " 123.4 MB/s ETA 00:00"
+    bar_max = max(10, min(50, cols - (len(prefix_plain) + 12 + 2 + 2 + 24)))
+    last_draw = 0.0
+
+    assert proc.stderr is not None
+    try:
+        for line in proc.stderr:
+            raw = line.rstrip("\r\n")
+            # Cerca percentuali stile "10%", "10.0%" etc.
+            m = re.search(r"(\d+(?:\.\d+)?)%", raw)
+            meter.feed_line(raw, float(m.group(1)) if m else None)
+            if m:
+                try:
+                    p = int(float(m.group(1)) + 0.5)
+                    p = max(0, min(100, p))
+                    if p != percent_last or time.monotonic() - last_draw >= 1.0:
+                        percent_last = p
+                        last_draw = time.monotonic()
+                        # Riusa lo stesso schema della barra (rispettando eventuale preferenza)
+                        if WIMLIB_PROGRESS_MODE != "off" and not _json_to_stdout():
+                            filled = int((p / 100.0) * bar_max)
+                            rate = meter.suffix()
+                            prog = (
+                                color("Progresso:", fg="bright_cyan", bold=True)
+                                + f" {p:3d}% ["
+                                + color(f"{'#'*filled:<{bar_max}}", fg="bright_green")
+                                + "]"
+                                + rate
+                            )
+                            sys.stdout.write("\r" + prog)
+                            # Stima lunghezza visiva per pulizia residui
+                            vis_len_est = len(prefix_plain) + 5 + 2 + bar_max + len(rate)
                             pad = max(0, last_print_len - vis_len_est)
                             if pad:
                                 sys.stdout.write(" " * pad)
@@ -1722,141 +4757,1515 @@ def _stream_wimlib_progress(cmd: List[str]) -> int:
                             last_print_len = vis_len_est
                 except Exception:
                     pass
-            # In verbose, riporta anche le linee complete sul file
-            if VERBOSE:
+            if VERBOSE:
+                try:
+                    with open(VERBOSE_FILE, "a", encoding="utf-8") as f:
+                        f.write(raw + "\n")
+                except Exception:
+                    pass
+    except KeyboardInterrupt:
+        try:
+            proc.terminate()
+        except Exception:
+            pass
+        proc.wait(timeout=5)
+        print("\n[INFO] Operazione annullata dall'utente.")
+        return 130
+
+    rc = proc.wait()
+    if percent_last >= 0 and WIMLIB_PROGRESS_MODE != "off" and not _json_to_stdout():
+        filled = bar_max
+        prog = (
+            color("Progresso:", fg="bright_cyan", bold=True)
+            + " 100% ["
+            + color("#" * filled, fg="bright_green")
+            + "]"
+        )
+        summ = meter.summary()
+        done_txt = f" avg {summ['avg_mbps']:.1f} MB/s in {_fmt_duration(summ['seconds'])}" if summ["avg_mbps"] else ""
+        vis_len_est = len(prefix_plain) + 5 + 2 + bar_max + len(done_txt)
+        sys.stdout.write("\r" + prog + done_txt + " " * max(0, last_print_len - vis_len_est) + "\n")
+        sys.stdout.flush()
+    _record_telemetry(op, meter, rc)
+    return rc
+
+# ====== Motore di progresso condiviso (processi figli concorrenti) ======
+_PERCENT_RE = re.compile(r"(\d+(?:\.\d+)?)%")
+_VERBOSE_LOCK = threading.Lock()
+_CHILDREN_LOCK = threading.Lock()
+_ACTIVE_CHILDREN: "set[subprocess.Popen]" = set()
+
+
+def _verbose_write(text: str) -> None:
+    """Accoda testo al log verbose in modo sicuro tra thread."""
+    try:
+        with _VERBOSE_LOCK, open(VERBOSE_FILE, "a", encoding="utf-8") as f:
+            f.write(text)
+    except Exception:
+        pass
+
+
+def _run_child(cmd: List[str], on_percent=None, tail_lines: int = 50, on_line=None) -> tuple[int, str]:
+    """Esegue un processo figlio senza scrivere su console (adatto a thread paralleli).
+    Le percentuali trovate in stdout/stderr vengono passate a on_percent(float); on_line(riga, percentuale
+    o None) riceve ogni riga non vuota (es. contatori di byte di wimlib per il meter MB/s).
+    Ritorna (returncode, ultime righe di output).
+    """
+    import collections
+    tail: "collections.deque[str]" = collections.deque(maxlen=tail_lines)
+    try:
+        proc = _popen_child(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+    except FileNotFoundError:
+        log_error(f"Comando non trovato: {cmd[0]}")
+        return 1, f"{cmd[0]} not found"
+    job = _current_job()
+    with _CHILDREN_LOCK:
+        _ACTIVE_CHILDREN.add(proc)
+        if job is not None:
+            job.procs.add(proc)
+    try:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            raw = line.rstrip("\r\n")
+            if not raw.strip():
+                continue
+            m = _PERCENT_RE.search(raw)
+            pct = max(0.0, min(100.0, float(m.group(1)))) if m else None
+            if on_line:
+                try:
+                    on_line(raw, pct)
+                except Exception:
+                    pass
+            if pct is not None and on_percent:
                 try:
-                    with open(VERBOSE_FILE, "a", encoding="utf-8") as f:
-                        f.write(raw + "\n")
+                    on_percent(pct)
                 except Exception:
                     pass
-    except KeyboardInterrupt:
+            elif pct is None or not on_line:
+                tail.append(raw)
+        rc = proc.wait()
+    finally:
+        with _CHILDREN_LOCK:
+            _ACTIVE_CHILDREN.discard(proc)
+            if job is not None:
+                job.procs.discard(proc)
+    if VERBOSE:
+        _verbose_write("\n== CMD ==\n" + " ".join(cmd) + f"\nRC: {rc}\n" + "\n".join(tail) + "\n")
+    return rc, "\n".join(tail)
+
+
+def _terminate_children() -> None:
+    """Termina tutti i processi figli avviati da _run_child (CTRL+C durante operazioni parallele)."""
+    with _CHILDREN_LOCK:
+        procs = list(_ACTIVE_CHILDREN)
+    for proc in procs:
         try:
             proc.terminate()
         except Exception:
             pass
-        proc.wait(timeout=5)
-        print("\n[INFO] Operazione annullata dall'utente.")
-        return 130
 
-    rc = proc.wait()
-    if percent_last >= 0 and WIMLIB_PROGRESS_MODE != "off":
-        # Forza 100% su singola riga e a capo finale
-        filled = bar_max
-        prog = (
-            color("Progresso:", fg="bright_cyan", bold=True)
-            + " 100% ["
-            + color("#" * filled, fg="bright_green")
-            + "]"
-        )
-        sys.stdout.write("\r" + prog + "\n")
+
+def _run_parallel(workers: int, stages: List[tuple]) -> None:
+    """Esegue le fasi [(funzione, elementi), ...] una dopo l'altra, ciascuna in parallelo su 'workers'
+    thread. CTRL+C: annulla i lavori ancora in coda, termina i processi figli finché i worker attivi
+    non escono e rilancia KeyboardInterrupt (lo smontaggio resta al chiamante).
+    """
+    import concurrent.futures as cf
+    pool = cf.ThreadPoolExecutor(max_workers=max(1, workers))
+    futures: List = []
+    try:
+        for fn, items in stages:
+            futures = [pool.submit(fn, it) for it in items]
+            # Attesa a intervalli: CTRL+C arriva al thread principale anche su Windows
+            while cf.wait(futures, timeout=0.5).not_done:
+                pass
+            for f in futures:
+                f.result()
+    except KeyboardInterrupt:
+        pool.shutdown(wait=False, cancel_futures=True)
+        running = [f for f in futures if not f.done()]
+        while running:
+            _terminate_children()
+            running = list(cf.wait(running, timeout=0.2).not_done)
+        raise
+    finally:
+        pool.shutdown(wait=True)
+
+
+@dataclass
+class ProgressTask:
+    """Stato di un'attività mostrata dal motore di progresso."""
+    __slots__ = ("key", "label", "phase", "percent", "state", "started", "rate")
+    key: str
+    label: str
+    phase: str
+    percent: float
+    state: str  # queued | running | ok | failed
+    started: float  # inizio della fase corrente (time.monotonic), base per l'ETA
+    rate: Optional[float]  # MB/s sulla finestra del _RateMeter; None finché non misurabile
+
+
+def _fmt_duration(secs: Optional[float]) -> str:
+    if secs is None:
+        return "--:--"
+    secs = int(secs)
+    return f"{secs // 3600}:{secs // 60 % 60:02d}:{secs % 60:02d}" if secs >= 3600 else f"{secs // 60:02d}:{secs % 60:02d}"
+
+
+def _eta_seconds(percent: float, started: float) -> Optional[float]:
+    """ETA lineare sulla fase corrente; None finché il progresso non è significativo."""
+    if percent < 1.0 or percent >= 100.0:
+        return None
+    elapsed = time.monotonic() - started
+    return elapsed * (100.0 - percent) / percent
+
+
+class _Dashboard:
+    """Renderer multi-riga: una riga per attività (fase, barra, %, ETA).
+    Su terminale ridisegna il blocco in place con i controlli cursore ANSI a frequenza limitata (FPS),
+    limitando il blocco all'altezza del terminale; se stdout non è un terminale scrive righe di log
+    ogni LOG_INTERVAL secondi. La modalità non dipende dai colori (NO_COLOR).
+    """
+
+    FPS = 4
+    LOG_INTERVAL = 15.0
+
+    def __init__(self, rows_fn) -> None:
+        self._rows_fn = rows_fn
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._drawn = 0
+        self._last_log = 0.0
+        try:
+            self.tty = sys.stdout.isatty()
+        except Exception:
+            self.tty = False
+
+    @staticmethod
+    def format_row(t: ProgressTask, cols: int) -> str:
+        label = t.label if len(t.label) <= 28 else t.label[:27] + "…"
+        if t.state in {"ok", "failed", "done", "cancelled"}:
+            return f"{label:<28} {t.state}"
+        if t.state in {"queued", "waiting"} or t.phase == "wait":
+            return f"{label:<28} {t.phase or t.state}"
+        bar_w = max(5, min(30, cols - 74))
+        filled = int(t.percent / 100.0 * bar_w)
+        eta = _eta_seconds(t.percent, t.started)
+        rate = f"{t.rate:6.1f}" if t.rate is not None else f"{'--':>6}"
+        return (f"{label:<28} {t.phase[:10]:<10} [{'#' * filled:<{bar_w}}] {int(t.percent):3d}%  "
+                f"{rate} MB/s  ETA {_fmt_duration(eta)}")
+
+    def render(self) -> None:
+        rows = self._rows_fn()
+        try:
+            cols, height = shutil.get_terminal_size((80, 20))
+        except Exception:
+            cols, height = 80, 20
+        lines = [self.format_row(t, cols)[: max(20, cols - 1)] for t in rows]
+        if not self.tty:
+            now = time.monotonic()
+            if now - self._last_log < self.LOG_INTERVAL:
+                return
+            self._last_log = now
+            stamp = time.strftime("%H:%M:%S")
+            sys.stdout.write("".join(f"[{stamp}] {ln}\n" for ln in lines))
+            sys.stdout.flush()
+            return
+        # Un blocco più alto del terminale farebbe scorrere lo schermo e il cursore non
+        # risalirebbe più all'inizio: le attività in eccesso vanno in una riga riassuntiva
+        max_rows = max(1, height - 1)
+        if len(lines) > max_rows:
+            hidden = rows[max_rows - 1:]
+            running = sum(1 for t in hidden if t.state not in {"ok", "failed", "done", "cancelled"})
+            lines = lines[: max_rows - 1] + [f"… {len(hidden)} more ({running} active)"[: max(20, cols - 1)]]
+        self._drawn = min(self._drawn, max_rows)
+        out = []
+        if self._drawn:
+            out.append(f"\r\x1b[{self._drawn}A")
+        for ln in lines:
+            out.append("\x1b[2K" + ln + "\n")
+        # Righe in eccesso del frame precedente (attività rimosse)
+        for _ in range(self._drawn - len(lines)):
+            out.append("\x1b[2K\n")
+        self._drawn = max(self._drawn, len(lines))
+        sys.stdout.write("".join(out))
         sys.stdout.flush()
-    return rc
 
-def _count_third_party_drivers(image_dir: Path) -> int:
-    """Conta i driver di terze parti nell'immagine montata usando DISM /Get-Drivers.
-    Ritorna un intero >= 0. In caso di errore restituisce 0 e logga l'evento.
+    def _loop(self) -> None:
+        while not self._stop.wait(1.0 / self.FPS):
+            self.render()
+
+    def start(self) -> None:
+        self.render()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        # Frame finale sempre visibile, anche in modalità log
+        self._last_log = 0.0
+        self.render()
+
+
+class _ProgressBoard:
+    """Progresso aggregato di più processi figli concorrenti.
+    I worker chiamano update(); un _Dashboard ridisegna una riga per attività
+    a frequenza limitata, così i figli non scrivono mai direttamente su console.
     """
+
+    def __init__(self) -> None:
+        self.tasks: Dict[str, ProgressTask] = {}
+        self._meters: Dict[str, _RateMeter] = {}  # per attività, alimentati dai byte elaborati
+        self._lock = threading.Lock()
+        self._dash: Optional[_Dashboard] = None
+        self._job: Optional[Job] = None
+
+    def add(self, key: str, label: str) -> ProgressTask:
+        with self._lock:
+            t = ProgressTask(key, label, "queued", 0.0, "queued", time.monotonic(), None)
+            self.tasks[key] = t
+            return t
+
+    def update(self, key: str, phase: Optional[str] = None, percent: Optional[float] = None, state: Optional[str] = None,
+               done_bytes: Optional[int] = None) -> None:
+        """done_bytes: byte elaborati nella fase corrente (cumulativi), per il throughput della riga."""
+        with self._lock:
+            t = self.tasks.get(key)
+            if not t:
+                return
+            if phase is not None and phase != t.phase:
+                t.phase = phase
+                t.percent = 0.0
+                t.started = time.monotonic()
+                t.rate = None
+                self._meters.pop(key, None)
+            if percent is not None:
+                t.percent = percent
+            if done_bytes is not None:
+                meter = self._meters.setdefault(key, _RateMeter())
+                meter.update(done_bytes)
+                t.rate = meter.mbps()
+            if state is not None:
+                t.state = state
+            elif t.state == "queued":
+                t.state = "running"
+            if self._job is not None:
+                # In un job il riepilogo va nella riga del job: media dei task e conteggio completati
+                done = sum(1 for x in self.tasks.values() if x.state in {"ok", "failed"})
+                avg = sum(100.0 if x.state in {"ok", "failed"} else x.percent for x in self.tasks.values()) / max(1, len(self.tasks))
+                self._job.phase = f"{done}/{len(self.tasks)} done"
+                self._job.percent = avg
+
+    def percent_callback(self, key: str):
+        return lambda p: self.update(key, percent=p)
+
+    def _enabled(self) -> bool:
+        return WIMLIB_PROGRESS_MODE != "off" and not _json_to_stdout() and self._job is None
+
+    def _snapshot(self) -> List[ProgressTask]:
+        with self._lock:
+            return [ProgressTask(t.key, t.label, t.phase, t.percent, t.state, t.started, t.rate) for t in self.tasks.values()]
+
+    def __enter__(self) -> "_ProgressBoard":
+        self._job = _current_job()
+        if self._enabled():
+            self._dash = _Dashboard(self._snapshot)
+            self._dash.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._dash:
+            self._dash.stop()
+
+
+# ====== Job in background (coda con pool di worker e lock per risorsa) ======
+_JOB_CTX = threading.local()
+
+
+def _current_job() -> Optional["Job"]:
+    """Job in esecuzione nel thread corrente (None nel thread del menu)."""
+    return getattr(_JOB_CTX, "job", None)
+
+
+def _job_cancelled() -> bool:
+    job = _current_job()
+    return bool(job and job.cancel_event.is_set())
+
+
+def _with_job_ctx(fn):
+    """Propaga il job corrente ai thread di un pool interno (annullamento e output)."""
+    job = _current_job()
+
+    def _wrapped(*a, **kw):
+        prev = _current_job()
+        _JOB_CTX.job = job
+        try:
+            return fn(*a, **kw)
+        finally:
+            _JOB_CTX.job = prev
+    return _wrapped
+
+
+def _resource_key(p: Path) -> str:
     try:
-        cp = _run_dism_with_spinner_capture(["/Image:" + str(image_dir), "/Get-Drivers", "/English"])
-        out = (getattr(cp, "stdout", "") or "") + "\n" + (getattr(cp, "stderr", "") or "")
-        cnt = 0
-        for line in out.splitlines():
-            if re.search(r"^\s*Published Name\s*:\s*", line, re.IGNORECASE):
-                cnt += 1
-        return max(0, cnt)
-    except Exception as e:
-        log_error(f"_count_third_party_drivers error: {e}")
-        return 0
+        return os.path.normcase(str(Path(p).resolve()))
+    except Exception:
+        return os.path.normcase(str(p))
 
-def _stream_dism_progress(args: List[str]) -> int:
-    """Esegue DISM in streaming e mostra progresso su una sola riga.
-    Analogo a _stream_wimlib_progress: legge stderr, estrae percentuali e riscrive la riga.
+
+class _ResourceLocks:
+    """Lock esclusivi per risorsa (file WIM, cartella di mount), acquisiti tutti insieme
+    per evitare deadlock tra job che condividono più risorse.
     """
-    def term_width(default: int = 80) -> int:
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._owners: Dict[str, str] = {}
+
+    def holder(self, keys: Iterable[str]) -> Optional[str]:
+        with self._cond:
+            for k in keys:
+                if k in self._owners:
+                    return self._owners[k]
+        return None
+
+    def try_acquire(self, keys: List[str], owner: str) -> Optional[str]:
+        """Acquisisce senza attendere; ritorna il proprietario in conflitto, None se acquisito."""
+        with self._cond:
+            for k in keys:
+                if self._owners.get(k, owner) != owner:
+                    return self._owners[k]
+            for k in keys:
+                self._owners[k] = owner
+            return None
+
+    def acquire(self, keys: List[str], owner: str, cancel: threading.Event) -> bool:
+        with self._cond:
+            while any(self._owners.get(k, owner) != owner for k in keys):
+                if cancel.is_set():
+                    return False
+                self._cond.wait(0.5)
+            for k in keys:
+                self._owners[k] = owner
+            return True
+
+    def release(self, keys: Iterable[str], owner: str) -> None:
+        with self._cond:
+            for k in keys:
+                if self._owners.get(k) == owner:
+                    del self._owners[k]
+            self._cond.notify_all()
+
+
+class Job:
+    """Operazione lunga eseguita in background: stato, progresso, output catturato e annullamento."""
+
+    def __init__(self, job_id: int, label: str, kind: str, resources: List[str], fn) -> None:
+        import collections
+        self.id = job_id
+        self.label = label
+        self.kind = kind
+        self.resources = resources
+        self.fn = fn
+        self.state = "queued"  # queued | waiting | running | done | failed | cancelled
+        self.phase = ""
+        self.percent = 0.0
+        self.phase_started = time.monotonic()
+        self.meter: Optional[_RateMeter] = None
+        self.rc: Optional[int] = None
+        self.result = ""
+        self.output: "collections.deque[str]" = collections.deque(maxlen=200)
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.ended: Optional[float] = None
+        self.cancel_event = threading.Event()
+        self.procs: "set[subprocess.Popen]" = set()
+        self.priority: Optional[ChildPriority] = None  # None => impostazioni globali
+        self._partial = ""
+
+    @property
+    def active(self) -> bool:
+        return self.state in {"queued", "waiting", "running"}
+
+    @property
+    def owner(self) -> str:
+        return f"job #{self.id}"
+
+    def set_progress(self, percent: Optional[float] = None, phase: Optional[str] = None) -> None:
+        if phase is not None:
+            # Ogni processo figlio riparte da 0%: anche la stessa fase ripetuta riazzera l'ETA
+            self.phase = phase
+            self.percent = 0.0
+            self.phase_started = time.monotonic()
+        if percent is not None:
+            self.percent = percent
+
+    def write(self, text: str) -> None:
+        """Riceve le print() del thread del job: conserva solo righe complete (niente barre \r)."""
+        buf = self._partial + text
+        lines = re.split(r"\r\n|\n", buf)
+        self._partial = lines.pop()
+        for ln in lines:
+            ln = re.sub(r"\x1b\[[0-9;]*m", "", ln.split("\r")[-1]).rstrip()
+            if ln:
+                self.output.append(ln)
+
+    def run(self, cmd: List[str], meter: Optional[_RateMeter] = None) -> int:
+        """Esegue un processo figlio senza console; il progresso aggiorna il job (e il meter MB/s)."""
+        if self.cancel_event.is_set():
+            return 130
+        # Fase leggibile dal comando: '/Export-Image' → 'export', 'wimlib-imagex export' → 'export'
+        op = cmd[1] if len(cmd) > 1 else cmd[0]
+        self.set_progress(0.0, phase=op.lstrip("/").split("-")[0].split(":")[0].lower())
+        self.meter = meter
+
+        def _on_line(raw: str, p: Optional[float]) -> None:
+            if p is not None:
+                self.set_progress(p)
+            if meter is not None:
+                meter.feed_line(raw, p)
+
+        rc, tail = _run_child(cmd, on_line=_on_line)
+        if rc != 0 and tail:
+            self.output.extend(tail.splitlines()[-10:])
+        return 130 if self.cancel_event.is_set() else rc
+
+    def set_priority(self, prio: ChildPriority) -> None:
+        """Cambia la priorità del job: vale per i figli futuri e per quelli già in esecuzione."""
+        self.priority = prio
+        for proc in list(self.procs):
+            if proc.poll() is None:
+                apply_child_priority(proc, prio, self.id)
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+        for proc in list(self.procs):
+            try:
+                proc.terminate()
+            except Exception:
+                pass
+
+
+class _JobStdout:
+    """Proxy di sys.stdout: le scritture dai thread dei job finiscono nell'output del job,
+    così il menu resta leggibile mentre i job sono in corso.
+    """
+
+    def __init__(self, real) -> None:
+        self._real = real
+
+    def write(self, text: str) -> int:
+        job = _current_job()
+        if job is not None:
+            job.write(text)
+            return len(text)
+        return self._real.write(text)
+
+    def flush(self) -> None:
+        if _current_job() is None:
+            self._real.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._real, name)
+
+
+class _JobQueue:
+    """Coda dei job in background. I worker sono limitati da PARALLEL_WORKERS; un job attende
+    (stato 'waiting') finché le sue risorse sono occupate da un altro job o dal menu.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: List[Job] = []
+        self.locks = _ResourceLocks()
+        self._pool = None
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def submit(self, label: str, kind: str, resources: Iterable[Path], fn, priority: Optional[ChildPriority] = None) -> Job:
+        import concurrent.futures as cf
+        with self._lock:
+            if not isinstance(sys.stdout, _JobStdout):
+                sys.stdout = _JobStdout(sys.stdout)
+            if self._pool is None:
+                self._pool = cf.ThreadPoolExecutor(max_workers=max(1, PARALLEL_WORKERS), thread_name_prefix="pydism-job")
+            job = Job(self._next_id, label, kind, sorted({_resource_key(p) for p in resources}), fn)
+            job.priority = priority  # prima dell'avvio: il primo figlio parte già con il profilo scelto
+            self._next_id += 1
+            self.jobs.append(job)
+        self._pool.submit(self._execute, job)
+        return job
+
+    def _execute(self, job: Job) -> None:
+        _JOB_CTX.job = job
         try:
-            import shutil as _sh
-            return int(_sh.get_terminal_size((default, 20)).columns)
+            if job.cancel_event.is_set():
+                job.state = "cancelled"
+                return
+            job.state = "waiting"
+            if not self.locks.acquire(job.resources, job.owner, job.cancel_event):
+                job.state = "cancelled"
+                return
+            try:
+                job.state = "running"
+                job.started = time.time()
+                job.phase_started = time.monotonic()
+                ret = job.fn()
+                job.rc = ret if isinstance(ret, int) and not isinstance(ret, bool) else (0 if ret is not False else 1)
+                if job.cancel_event.is_set():
+                    job.state = "cancelled"
+                else:
+                    job.state = "done" if job.rc == 0 else "failed"
+                    if job.rc == 0:
+                        job.percent = 100.0
+            except Exception as e:
+                job.state = "cancelled" if job.cancel_event.is_set() else "failed"
+                job.result = f"{type(e).__name__}: {e}"
+                log_error(f"JOB #{job.id} {job.label}: {e!r}")
+            finally:
+                self.locks.release(job.resources, job.owner)
+        finally:
+            job.ended = time.time()
+            if not job.result:
+                job.result = job.output[-1] if job.output else ""
+            _JOB_CTX.job = None
+
+    def get(self, job_id: int) -> Optional[Job]:
+        return next((j for j in self.jobs if j.id == job_id), None)
+
+    def active(self) -> List[Job]:
+        return [j for j in self.jobs if j.active]
+
+    def clear_finished(self) -> int:
+        with self._lock:
+            before = len(self.jobs)
+            self.jobs = [j for j in self.jobs if j.active]
+            return before - len(self.jobs)
+
+    def cancel_all(self) -> None:
+        for j in self.active():
+            j.cancel()
+
+
+_JOBS = _JobQueue()
+_FOREGROUND_MOUNTS: Dict[str, str] = {}
+
+
+def _claim_for_foreground(image: Path, mount_dir: Path) -> None:
+    """Il menu usa un'immagine: errore se un job la sta elaborando, altrimenti la riserva
+    finché la cartella di mount non viene smontata (i job in coda attendono).
+    """
+    key = _resource_key(image)
+    busy = _JOBS.locks.try_acquire([key], "menu")
+    if busy:
+        raise RuntimeError(f"{image} is in use by background {busy}: wait for it or cancel it from the jobs screen.")
+    _FOREGROUND_MOUNTS[_resource_key(mount_dir)] = key
+
+
+def _release_foreground(mount_dir: Path) -> None:
+    key = _FOREGROUND_MOUNTS.pop(_resource_key(mount_dir), None)
+    if key and key not in _FOREGROUND_MOUNTS.values() and key not in _FOREGROUND_CLAIMS:
+        _JOBS.locks.release([key], "menu")
+
+
+_FOREGROUND_CLAIMS: set = set()  # risorse riservate da _ForegroundClaim (non da un mount)
+
+
+class _ForegroundClaim:
+    """Riserva al menu le risorse di un'operazione in scrittura eseguita in primo piano
+    (sorgente, destinazione): RuntimeError se un job le sta elaborando, i job accodati attendono
+    l'uscita dal blocco. Dentro un job non fa nulla: le risorse sono già del job.
+    """
+
+    def __init__(self, *paths: Optional[Path]) -> None:
+        self.keys = sorted({_resource_key(p) for p in paths if p})
+        self._taken: List[str] = []
+
+    def __enter__(self) -> "_ForegroundClaim":
+        if _current_job() is not None:
+            return self
+        new = [k for k in self.keys if _JOBS.locks.holder([k]) != "menu"]
+        busy = _JOBS.locks.try_acquire(new, "menu")
+        if busy:
+            path = next((k for k in new if _JOBS.locks.holder([k]) == busy), "")
+            raise RuntimeError(f"{path} is in use by background {busy}: wait for it or cancel it from the jobs screen.")
+        self._taken = new
+        _FOREGROUND_CLAIMS.update(new)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        _FOREGROUND_CLAIMS.difference_update(self._taken)
+        # Una risorsa ancora montata dal menu resta riservata fino allo smontaggio
+        keep = set(_FOREGROUND_MOUNTS.values())
+        _JOBS.locks.release([k for k in self._taken if k not in keep], "menu")
+        self._taken = []
+
+
+@dataclass
+class BackgroundChoice:
+    """Risposta affermativa a 'Run in background?': profilo di priorità del job (None => impostazioni)."""
+    __slots__ = ("priority",)
+    priority: Optional[ChildPriority]
+
+
+def _ask_background() -> Optional[BackgroundChoice]:
+    """Chiede se eseguire l'operazione come job in background (mai in modalità JSON su stdout).
+    'y low', 'y background', 'y high' scelgono anche il profilo di priorità del job.
+    Ritorna None per l'esecuzione in primo piano; la scelta va passata a _submit_job.
+    """
+    if _json_to_stdout():
+        return None
+    try:
+        ans = input("Run in background? (y/N, 'y low|background|high' = priority): ").strip().lower()
+    except KeyboardInterrupt:
+        print()
+        return None
+    yes, _, profile = ans.partition(" ")
+    if yes not in {"s", "si", "sì", "y", "yes"}:
+        return None
+    prio = None
+    if profile.strip():
+        prio = ChildPriority.profile(profile.strip())
+        if prio is None:
+            print(f"[WARN] Unknown priority profile '{profile.strip()}', using settings.")
+    return BackgroundChoice(prio)
+
+
+def _submit_job(label: str, kind: str, resources: Iterable[Path], fn, bg: Optional[BackgroundChoice] = None) -> Job:
+    job = _JOBS.submit(label, kind, resources, fn, bg.priority if bg else None)
+    print(color(f"[JOB #{job.id}] Queued: {label}. Follow it from menu 31 (Background jobs).", fg="bright_cyan", bold=True))
+    return job
+
+
+def _fmt_elapsed(job: Job) -> str:
+    if job.started is None:
+        return "-"
+    return _fmt_duration((job.ended or time.time()) - job.started)
+
+
+def _job_rows() -> List[ProgressTask]:
+    """Job come righe del dashboard (attivi e conclusi della sessione)."""
+    return [ProgressTask(str(j.id), f"#{j.id} {j.label}", j.phase, j.percent, j.state, j.phase_started,
+                         j.meter.mbps() if j.state == "running" and j.meter else None) for j in _JOBS.jobs]
+
+
+def _key_pressed() -> bool:
+    """True se è stato premuto un tasto (Windows) o inviata una riga (altri sistemi), senza bloccare."""
+    try:
+        import msvcrt  # type: ignore
+        if msvcrt.kbhit():
+            msvcrt.getwch()
+            return True
+        return False
+    except ImportError:
+        import select
+        try:
+            ready, _, _ = select.select([sys.stdin], [], [], 0)
         except Exception:
-            return default
+            return False
+        if ready:
+            sys.stdin.readline()
+            return True
+        return False
 
-    cmd = ["dism", *args]
+
+def _jobs_live_view() -> None:
+    """Dashboard live dei job finché non si preme un tasto o tutti i job sono conclusi."""
+    if not _JOBS.jobs:
+        print("[INFO] No background jobs in this session.")
+        return
+    print(color("[LIVE] Press ENTER to return to the jobs list.", fg="bright_black"))
+    dash = _Dashboard(_job_rows)
+    dash.start()
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-        )
-    except FileNotFoundError:
-        log_error("DISM non trovato nel PATH")
-        return 1
+        while _JOBS.active() and not _key_pressed():
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dash.stop()
+
+
+def _print_jobs_table() -> None:
+    if not _JOBS.jobs:
+        print("[INFO] No background jobs in this session.")
+        return
+    print(f"{'#':>3}  {'State':<9} {'Phase':<10} {'%':>4}  {'MB/s':>7}  {'ETA':>7}  {'Time':>8}  Job")
+    for j in _JOBS.jobs:
+        running = j.state == "running"
+        pct = f"{int(j.percent):3d}" if running else "  -"
+        eta = _fmt_duration(_eta_seconds(j.percent, j.phase_started)) if running else "-"
+        rate = j.meter.mbps() if running and j.meter else None
+        rate_txt = f"{rate:.1f}" if rate is not None else "-"
+        line = f"{j.id:>3}  {j.state:<9} {j.phase[:10]:<10} {pct:>4}  {rate_txt:>7}  {eta:>7}  {_fmt_elapsed(j):>8}  {j.label}"
+        fg = {"done": "bright_green", "failed": "bright_red", "cancelled": "bright_yellow"}.get(j.state, "bright_white")
+        print(color(line, fg=fg))
+
+
+def menu_jobs() -> None:
+    """Menu 31: elenco job in background con progresso, annullamento e risultati."""
+    while True:
+        print_header("Background jobs")
+        _print_jobs_table()
+        print(color("  ENTER=refresh  L=live dashboard  C <n>=cancel  V <n>=view output  P <n> <low|background|normal|high> [MB/s]=priority  X=clear finished  0=back", fg="bright_black"))
+        try:
+            cmd = input("Jobs> ").strip()
+        except KeyboardInterrupt:
+            print()
+            return
+        if cmd == "0":
+            return
+        if not cmd:
+            continue
+        op, _, arg = cmd.partition(" ")
+        op = op.upper()
+        if op == "X":
+            print(f"[INFO] Removed {_JOBS.clear_finished()} finished job(s).")
+            continue
+        if op == "L":
+            _jobs_live_view()
+            continue
+        num, _, extra = arg.strip().partition(" ")
+        job = _JOBS.get(int(num)) if num.isdigit() else None
+        if op in {"C", "V", "P"} and job is None:
+            print("[ERROR] Unknown job number.")
+            continue
+        if op == "C":
+            if job.active:
+                job.cancel()
+                print(f"[INFO] Cancellation requested for job #{job.id}.")
+            else:
+                print(f"[INFO] Job #{job.id} already {job.state}.")
+        elif op == "P":
+            name, _, cap = extra.strip().partition(" ")
+            prio = ChildPriority.profile(name, int(cap) if cap.strip().isdigit() else None) if name else None
+            if prio is None:
+                print(f"[ERROR] Profiles: {', '.join(PRIORITY_PROFILES)}.")
+            elif not job.active:
+                print(f"[INFO] Job #{job.id} already {job.state}.")
+            else:
+                job.set_priority(prio)
+                print(f"[INFO] Job #{job.id} priority: {prio.describe()}.")
+        elif op == "V":
+            print(color(f"--- Job #{job.id}: {job.label} [{job.state}, rc={job.rc}] ---", fg="bright_cyan"))
+            if job.priority is not None:
+                print(f"Priority: {job.priority.describe()}")
+            for ln in job.output:
+                print(ln)
+            if job.result and job.state == "failed":
+                print(color(f"Result: {job.result}", fg="bright_red"))
+
+
+def _jobs_before_exit() -> bool:
+    """All'uscita con job attivi: attende, annulla o torna al menu. True = si può uscire."""
+    active = _JOBS.active()
+    if not active:
+        return True
+    print(color(f"[WARN] {len(active)} background job(s) still active.", fg="bright_yellow"))
+    try:
+        ans = input("W=wait for completion, C=cancel and exit, ENTER=back to menu: ").strip().upper()
+    except KeyboardInterrupt:
+        print()
+        ans = "C"
+    if ans not in {"W", "C"}:
+        return False
+    if ans == "C":
+        _JOBS.cancel_all()
+    try:
+        while _JOBS.active():
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        _JOBS.cancel_all()
+        while _JOBS.active():
+            time.sleep(0.5)
+    return True
+
+
+# ====== Estrazione file senza mount (wimlib extract) e lettura nativa del registro ======
+_SOFTWARE_HIVE = r"\Windows\System32\config\SOFTWARE"
+_CURRENT_VERSION_KEY = r"Microsoft\Windows NT\CurrentVersion"
+_REG_HBIN_START = 4096
+_REG_SZ, _REG_EXPAND_SZ, _REG_BINARY, _REG_DWORD, _REG_MULTI_SZ, _REG_QWORD = 1, 2, 3, 4, 7, 11
+
+
+class RegHive:
+    """Lettore minimo di hive di registro offline (formato regf): chiavi e valori in sola lettura.
+    Gli hive nelle immagini WIM sono chiusi in modo pulito, quindi i log di transazione non servono.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        if data[:4] != b"regf":
+            raise ValueError("not a registry hive (missing regf signature)")
+        self.data = data
+        self.root = self._cell(struct.unpack_from("<I", data, 0x24)[0])
+
+    def _cell(self, off: int) -> int:
+        # Gli offset sono relativi al primo hbin; i primi 4 byte della cella sono la dimensione
+        return _REG_HBIN_START + off + 4
+
+    def _u16(self, pos: int) -> int:
+        return struct.unpack_from("<H", self.data, pos)[0]
+
+    def _u32(self, pos: int) -> int:
+        return struct.unpack_from("<I", self.data, pos)[0]
+
+    def _name(self, pos: int, length: int, ascii_name: bool) -> str:
+        raw = self.data[pos:pos + length]
+        return raw.decode("latin-1") if ascii_name else raw.decode("utf-16-le", errors="replace")
+
+    def _list(self, off: int):
+        p = self._cell(off)
+        sig, n = self.data[p:p + 2], self._u16(p + 2)
+        if sig in (b"lf", b"lh"):
+            for i in range(n):
+                yield self._u32(p + 4 + i * 8)
+        elif sig == b"li":
+            for i in range(n):
+                yield self._u32(p + 4 + i * 4)
+        elif sig == b"ri":
+            for i in range(n):
+                yield from self._list(self._u32(p + 4 + i * 4))
+
+    def _subkeys(self, nk: int) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        if not self._u32(nk + 0x14) or self._u32(nk + 0x1C) == 0xFFFFFFFF:
+            return out
+        for off in self._list(self._u32(nk + 0x1C)):
+            p = self._cell(off)
+            if self.data[p:p + 2] == b"nk":
+                out[self._name(p + 0x4C, self._u16(p + 0x48), bool(self._u16(p + 2) & 0x20)).lower()] = p
+        return out
+
+    def find_key(self, path: str) -> Optional[int]:
+        nk = self.root
+        for part in [x for x in path.replace("/", "\\").split("\\") if x]:
+            nk = self._subkeys(nk).get(part.lower())
+            if nk is None:
+                return None
+        return nk
+
+    def _value_data(self, size: int, off: int) -> bytes:
+        if size & 0x80000000:
+            # Dati fino a 4 byte memorizzati direttamente nel campo offset
+            return struct.pack("<I", off)[:size & 0x7FFFFFFF]
+        p = self._cell(off)
+        if self.data[p:p + 2] == b"db" and size > 16344:
+            # Big data: lista di segmenti da 16344 byte
+            segs = self._cell(self._u32(p + 4))
+            chunks = [self.data[self._cell(self._u32(segs + i * 4)):][:16344] for i in range(self._u16(p + 2))]
+            return b"".join(chunks)[:size]
+        return self.data[p:p + size]
+
+    def values(self, nk: int) -> Dict[str, object]:
+        """Valori della chiave, con nome in minuscolo; REG_SZ/DWORD/QWORD/MULTI_SZ decodificati."""
+        out: Dict[str, object] = {}
+        count, lst = self._u32(nk + 0x24), self._u32(nk + 0x28)
+        if not count or lst == 0xFFFFFFFF:
+            return out
+        base = self._cell(lst)
+        for i in range(count):
+            p = self._cell(self._u32(base + i * 4))
+            if self.data[p:p + 2] != b"vk":
+                continue
+            name = self._name(p + 0x14, self._u16(p + 2), bool(self._u16(p + 0x10) & 1))
+            kind = self._u32(p + 0x0C)
+            raw = self._value_data(self._u32(p + 4), self._u32(p + 8))
+            if kind in (_REG_SZ, _REG_EXPAND_SZ):
+                val: object = raw.decode("utf-16-le", errors="replace").split("\x00", 1)[0]
+            elif kind == _REG_DWORD and len(raw) >= 4:
+                val = struct.unpack_from("<I", raw)[0]
+            elif kind == _REG_QWORD and len(raw) >= 8:
+                val = struct.unpack_from("<Q", raw)[0]
+            elif kind == _REG_MULTI_SZ:
+                val = [s for s in raw.decode("utf-16-le", errors="replace").split("\x00") if s]
+            else:
+                val = raw
+            out[name.lower()] = val
+        return out
+
+
+@dataclass
+class ImageVersionInfo:
+    """Build ed edizione di un indice, dall'hive SOFTWARE estratto (senza mount)."""
+    __slots__ = ("image", "index", "product_name", "edition_id", "build", "ubr", "display_version", "installation_type")
+    image: str
+    index: int
+    product_name: str
+    edition_id: str
+    build: str
+    ubr: Optional[int]
+    display_version: str
+    installation_type: str
+
+
+def extract_paths(wim: Path, index: int, paths: List[str], dest: Optional[Path] = None) -> tuple[int, Path]:
+    """Estrae i percorsi indicati (caratteri jolly ammessi) da un indice in 'dest' (default: cartella
+    temporanea), mantenendo la struttura delle cartelle. Usa wimlib-imagex extract; senza wimlib
+    ripiega su un mount in sola lettura con copia dei file. Ritorna (returncode, cartella).
+    """
+    dest = dest or Path(tempfile.mkdtemp(prefix="PyDism_extract_", dir=TEMP))
+    dest.mkdir(parents=True, exist_ok=True)
+    if has_wimlib():
+        cmd = [_find_wimlib_exe(), "extract", str(wim), str(index), *paths, f"--dest-dir={dest}",
+               "--preserve-dir-structure", "--no-acls", "--nullglob"]
+        if wim.suffix.lower() == ".swm":
+            cmd.append(f"--ref={wim.parent / (wim.stem + '*.swm')}")
+        rc, tail = _run_child(cmd)
+        if rc != 0:
+            log_error(f"EXTRACT: wimlib extract rc={rc} {wim} idx {index}\n{tail}")
+        return rc, dest
+    print(color("[INFO] wimlib-imagex not found: extracting through a read-only DISM mount.", fg="bright_yellow"))
+    mdir = mount_image(wim, index, ro=True)
+    try:
+        for pattern in paths:
+            rel = pattern.replace("\\", "/").lstrip("/")
+            for src in mdir.glob(rel):
+                target = dest / src.relative_to(mdir)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                if src.is_dir():
+                    shutil.copytree(src, target, dirs_exist_ok=True)
+                else:
+                    shutil.copy2(src, target)
+        return 0, dest
+    except OSError as e:
+        log_error(f"EXTRACT: copia da mount fallita {wim} idx {index}: {e}")
+        return 1, dest
+    finally:
+        unmount(mdir, commit=False)
+
+
+def image_version_info(wim: Path, index: int) -> Optional[ImageVersionInfo]:
+    """Build/edizione dall'hive SOFTWARE dell'indice: estrazione di un solo file e parsing nativo."""
+    rc, tmp = extract_paths(wim, index, [_SOFTWARE_HIVE])
+    try:
+        hive_path = tmp.joinpath(*[p for p in _SOFTWARE_HIVE.split("\\") if p])
+        if rc != 0 or not hive_path.is_file():
+            return None
+        hive = RegHive(hive_path.read_bytes())
+        nk = hive.find_key(_CURRENT_VERSION_KEY)
+        if nk is None:
+            return None
+        v = hive.values(nk)
+        ubr = v.get("ubr")
+        return ImageVersionInfo(str(wim), index, str(v.get("productname", "")), str(v.get("editionid", "")),
+                                str(v.get("currentbuild") or v.get("currentbuildnumber", "")),
+                                ubr if isinstance(ubr, int) else None,
+                                str(v.get("displayversion") or v.get("releaseid", "")), str(v.get("installationtype", "")))
+    except (OSError, ValueError, struct.error) as e:
+        log_error(f"REGHIVE: {wim} idx {index}: {e}")
+        return None
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def menu_extract_paths() -> None:
+    """Menu 34: estrae file/cartelle da un indice senza montare l'immagine."""
+    print_header("Extract files from image (no mount)")
+    wim = ask_image("WIM/ESD path: ")
+    if not wim:
+        return
+    idx = ask_index(wim)
+    if idx is None:
+        return
+    try:
+        raw = input("Paths in the image, ';' separated, wildcards allowed (e.g. \\Windows\\INF\\oem*.inf): ").strip()
+        out = input("Destination folder (ENTER=new temporary folder): ").strip().strip('"')
+    except KeyboardInterrupt:
+        print()
+        return
+    paths = [p.strip() for p in raw.split(";") if p.strip()]
+    if not paths:
+        return
+    rc, dest = extract_paths(wim, idx, paths, Path(out) if out else None)
+    files = [p for p in dest.rglob("*") if p.is_file()]
+    if rc != 0:
+        print(color(f"[ERROR] Extraction failed (rc={rc}), see log.", fg="bright_red"))
+    elif not files:
+        print(color("[INFO] No matching paths in the image.", fg="bright_yellow"))
+    else:
+        for p in files[:50]:
+            print(f"  {p.relative_to(dest)}  ({_format_bytes(p.stat().st_size)})")
+        if len(files) > 50:
+            print(f"  ... {len(files) - 50} more")
+        print(color(f"[OK] {len(files)} file(s) extracted to {dest}", fg="bright_green"))
+
+
+def menu_image_version() -> None:
+    """Menu 35: build ed edizione per indice dall'hive SOFTWARE, senza mount."""
+    print_header("Build / edition from registry (no mount)")
+    wim = ask_image("WIM/ESD path: ")
+    if not wim:
+        return
+    avail = _wim_indexes(wim)
+    indexes = _ask_indexes(wim) if len(avail) > 1 and not _json_to_stdout() else avail
+    if not indexes:
+        indexes = avail
+    infos: List[ImageVersionInfo] = []
+    for i in indexes:
+        info = image_version_info(wim, i)
+        if info is None:
+            if not _json_mode():
+                print(color(f"[WARN] idx {i}: SOFTWARE hive not readable (see log).", fg="bright_yellow"))
+            continue
+        infos.append(info)
+        if not _json_mode():
+            build = f"{info.build}.{info.ubr}" if info.ubr is not None else info.build
+            print(f"  {i:>3}  {info.product_name:<36} {info.edition_id:<20} build {build:<12} {info.display_version} {info.installation_type}")
+    emit_records("image_version", infos, source=str(wim))
+
+
+# ====== Scrittura supporti (USB) ======
+MEDIA_BUFFER = 8 * 1024 * 1024  # multiplo di 1 MiB: scritture allineate ai cluster dei supporti
+_FAT32_MAX_FILE = 4 * 1024**3 - 1
+
+
+@dataclass
+class MediaWriteResult:
+    """Esito per cartella di destinazione della scrittura supporti."""
+    __slots__ = ("target", "files", "bytes", "seconds", "verified", "error")
+    target: str
+    files: List[str]
+    bytes: int
+    seconds: float
+    verified: Optional[bool]
+    error: str
+
+
+def _fs_name(p: Path) -> str:
+    """File system del volume (solo Windows: 'FAT32', 'NTFS', 'exFAT'...); stringa vuota se ignoto."""
+    if os.name != "nt":
+        return ""
+    try:
+        buf = ctypes.create_unicode_buffer(32)
+        root = str(_existing_ancestor(p).anchor)
+        if ctypes.windll.kernel32.GetVolumeInformationW(root, None, 0, None, None, None, buf, len(buf)):
+            return buf.value
+    except Exception:
+        pass
+    return ""
+
+
+def _swm_parts(first: Path) -> List[Path]:
+    """Parti del set SWM di 'first': solo {stem}.swm e {stem}<n>.swm (non install_old.swm o altri set
+    con lo stesso prefisso), con lo stesso GUID dell'header e ordinate per numero di parte.
+    """
+    name_re = re.compile(re.escape(first.stem) + r"(\d*)\.swm", re.IGNORECASE)
+    named = []
+    for f in first.parent.iterdir():
+        m = name_re.fullmatch(f.name)
+        if m and f.is_file():
+            named.append((int(m.group(1) or 1), f))
+    ref = _read_wim_header(first)
+    if ref is None:
+        return [f for _, f in sorted(named)]
+    parts = []
+    for n, f in named:
+        hdr = ref if f == first else _read_wim_header(f)
+        if hdr is None or hdr.guid != ref.guid:
+            log_error(f"[SWM] {f} escluso: non appartiene al set di {first.name}")
+            continue
+        parts.append((hdr.part_number, f))
+    return [f for _, f in sorted(parts)]
+
+
+def _media_sources(p: Path) -> List[Path]:
+    """Un .swm porta con sé tutte le parti del suo set (install.swm, install2.swm, ...)."""
+    if p.suffix.lower() != ".swm":
+        return [p]
+    parts = _swm_parts(p)
+    hdr = _read_wim_header(p)
+    if hdr and len(parts) != hdr.total_parts:
+        print(color(f"[WARN] {p.name}: found {len(parts)} of {hdr.total_parts} parts of the set.", fg="bright_yellow"))
+    return parts
+
+
+def _sha256_file(p: Path, on_bytes=None) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb", buffering=0) as f:
+        while True:
+            chunk = f.read(MEDIA_BUFFER)
+            if not chunk:
+                break
+            if _job_cancelled():
+                raise InterruptedError("cancelled")
+            h.update(chunk)
+            if on_bytes:
+                on_bytes(len(chunk))
+    return h.hexdigest()
+
+
+def write_media(files: List[Path], targets: List[Path], verify: bool = True, fsync_mb: int = 256) -> List[MediaWriteResult]:
+    """Copia 'files' in tutte le 'targets' in un solo passaggio: ogni blocco viene letto una volta
+    (con SHA-256 calcolato al volo) e consegnato a un thread di scrittura per destinazione.
+    fsync ogni fsync_mb MB (0 = solo a fine file); poi verifica parallela rileggendo le copie.
+    I file vengono scritti come '.part' e rinominati solo a copia completata.
+    """
+    import queue
+    import concurrent.futures as cf
+    total = sum(f.stat().st_size for f in files)
+    results = [MediaWriteResult(str(t), [f.name for f in files], 0, 0.0, None, "") for t in targets]
+    board = _ProgressBoard()
+    for r in results:
+        board.add(r.target, r.target)
+    queues: List["queue.Queue"] = [queue.Queue(maxsize=4) for _ in targets]
+    src_hash: Dict[str, str] = {}
+
+    def _writer(r: MediaWriteResult, q: "queue.Queue") -> None:
+        out = None
+        part: Optional[Path] = None
+        since_sync = 0
+        t0 = time.monotonic()
+        while True:
+            kind, payload = q.get()
+            if kind == "end":
+                # "end" senza "close" (annullamento o errore a metà file): niente '.part' orfani
+                if out:
+                    out.close()
+                    out = None
+                if part is not None:
+                    try:
+                        part.unlink(missing_ok=True)
+                    except OSError as e:
+                        log_error(f"[MEDIA] rimozione di {part} fallita: {e}")
+                break
+            if r.error:
+                continue  # destinazione già fallita: scarta il resto
+            try:
+                if kind == "open":
+                    Path(r.target).mkdir(parents=True, exist_ok=True)
+                    part = Path(r.target) / (payload + ".part")
+                    out = open(part, "wb", buffering=0)
+                    since_sync = 0
+                elif kind == "data":
+                    out.write(payload)
+                    r.bytes += len(payload)
+                    since_sync += len(payload)
+                    if fsync_mb and since_sync >= fsync_mb * 1024 * 1024:
+                        os.fsync(out.fileno())
+                        since_sync = 0
+                    board.update(r.target, phase="write", percent=r.bytes * 100.0 / max(1, total), done_bytes=r.bytes)
+                elif kind == "close":
+                    os.fsync(out.fileno())
+                    out.close()
+                    out = None
+                    os.replace(part, part.with_name(payload))
+                    part = None
+            except OSError as e:
+                r.error = f"{type(e).__name__}: {e}"
+                log_error(f"[MEDIA] scrittura su {r.target} fallita: {e}")
+                if out:
+                    out.close()
+                    out = None
+        r.seconds = round(time.monotonic() - t0, 1)
+
+    def _verify(r: MediaWriteResult) -> MediaWriteResult:
+        if r.error:
+            board.update(r.target, state="failed")
+            return r
+        board.update(r.target, phase="verify")
+        done = [0]
+
+        def _on_bytes(n: int) -> None:
+            done[0] += n
+            board.update(r.target, percent=done[0] * 100.0 / max(1, total), done_bytes=done[0])
+
+        try:
+            r.verified = all(_sha256_file(Path(r.target) / f.name, _on_bytes) == src_hash[f.name] for f in files)
+        except OSError as e:
+            r.verified = False
+            r.error = f"verify: {e}"
+        if not r.verified and not r.error:
+            r.error = "SHA-256 mismatch"
+        board.update(r.target, state="ok" if r.verified else "failed")
+        return r
+
+    threads = [threading.Thread(target=_with_job_ctx(_writer), args=(r, q), daemon=True) for r, q in zip(results, queues)]
+    with board:
+        for t in threads:
+            t.start()
+        try:
+            for f in files:
+                h = hashlib.sha256()
+                for q in queues:
+                    q.put(("open", f.name))
+                with open(f, "rb", buffering=0) as fi:
+                    while not _job_cancelled():
+                        chunk = fi.read(MEDIA_BUFFER)
+                        if not chunk:
+                            break
+                        h.update(chunk)
+                        for q in queues:
+                            q.put(("data", chunk))
+                src_hash[f.name] = h.hexdigest()
+                if _job_cancelled():
+                    break
+                for q in queues:
+                    q.put(("close", f.name))
+        finally:
+            for q in queues:
+                q.put(("end", None))
+            for t in threads:
+                t.join()
+        if _job_cancelled():
+            for r in results:
+                r.error = r.error or "cancelled"
+        if verify:
+            with cf.ThreadPoolExecutor(max_workers=max(1, len(results))) as pool:
+                list(pool.map(_with_job_ctx(_verify), results))
+        else:
+            for r in results:
+                board.update(r.target, state="failed" if r.error else "ok")
+    return results
+
+
+def menu_write_media() -> None:
+    """Menu 32: copia un WIM/ESD o un set di parti SWM su una o più chiavette in un solo passaggio."""
+    print_header("Write image / split parts to USB targets")
+    src = ask_path("Image to write (.wim/.esd, or the first .swm for all parts): ", IMAGE_EXTS)
+    if not src:
+        return
+    _write_media_prompt(_media_sources(src))
+
+
+def _write_media_prompt(files: List[Path]) -> None:
+    """Chiede destinazioni e opzioni, verifica spazio e FAT32, poi scrive (anche come job)."""
+    try:
+        raw = input("Target folders, ';' separated (e.g. E:\\sources;F:\\sources): ").strip()
+    except KeyboardInterrupt:
+        print()
+        return
+    targets = [Path(t.strip().strip('"')) for t in raw.split(";") if t.strip()]
+    if not targets:
+        return
+    manifest = _manifest_path(files)
+    if manifest.is_file():
+        files = [*files, manifest]  # le chiavette restano verificabili con il menu 33
+    total = sum(f.stat().st_size for f in files)
+    print(f"[INFO] {len(files)} file(s), {total / _GB:.2f} GB -> {len(targets)} target(s)")
+    big = [f for f in files if f.stat().st_size > _FAT32_MAX_FILE]
+    fat = [t for t in targets if _fs_name(t).upper().startswith("FAT")]
+    if big and fat:
+        print(color(f"[ERROR] {big[0].name} is larger than 4 GB and cannot be written to FAT32 target(s): "
+                    + ", ".join(map(str, fat)) + ". Split it first (menu 25).", fg="bright_red"))
+        return
+    if not preflight_space([("media copy", t, total) for t in targets]):
+        return
+    try:
+        fs = input("fsync every N MB (ENTER=256, 0=only at end of each file): ").strip()
+        vf = input("Verify written copies with SHA-256? (Y/n): ").strip().lower()
+    except KeyboardInterrupt:
+        print()
+        return
+    fsync_mb = int(fs) if fs.isdigit() else 256
+    verify = vf not in {"n", "no"}
+
+    def _do_write() -> int:
+        results = write_media(files, targets, verify, fsync_mb)
+        print()
+        for r in results:
+            ok = not r.error
+            mbps = r.bytes / max(r.seconds, 0.001) / (1024 * 1024)
+            state = "verified" if r.verified else ("written" if ok else r.error)
+            print(color(f"[{'OK' if ok else 'FAILED'}] {r.target}: {r.bytes / _GB:.2f} GB in {r.seconds}s ({mbps:.1f} MB/s) - {state}",
+                        fg="bright_green" if ok else "bright_red"))
+        emit_records("media_write", results)
+        return 0 if all(not r.error for r in results) else 1
+
+    bg = _ask_background()
+    if bg:
+        _submit_job(f"Write {files[0].name}{' +' + str(len(files) - 1) if len(files) > 1 else ''} to {len(targets)} target(s)",
+                    "media", [*files, *targets], _do_write, bg)
+        return
+    _do_write()
+
+
+# ====== Manifest SHA-256 degli artefatti prodotti ======
+MANIFEST_SUFFIX = ".manifest.json"
+_MANIFEST_BLOCK = 16 * 1024 * 1024
+
+
+@dataclass
+class ManifestEntry:
+    """Riga del manifest: un file prodotto con hash, dimensione e identità WIM."""
+    __slots__ = ("name", "size", "sha256", "guid", "part", "total_parts", "images")
+    name: str
+    size: int
+    sha256: str
+    guid: Optional[str]
+    part: Optional[int]
+    total_parts: Optional[int]
+    images: List[Dict[str, object]]
+
+
+@dataclass
+class ManifestCheck:
+    """Esito della verifica di un file elencato nel manifest."""
+    __slots__ = ("name", "status", "detail")
+    name: str
+    status: str  # 'ok' | 'missing' | 'size' | 'sha256' | 'guid'
+    detail: str
+
+
+def _sha256_mmap(p: Path, on_bytes=None) -> str:
+    """SHA-256 tramite mmap a blocchi di 16 MB: niente copie in user space e hashlib rilascia il GIL,
+    quindi più file si calcolano in parallelo su core diversi."""
+    import mmap
+    with open(p, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            h = hashlib.sha256()
+            view = memoryview(mm)
+            try:
+                for off in range(0, size, _MANIFEST_BLOCK):
+                    if _job_cancelled():
+                        raise InterruptedError("cancelled")
+                    block = view[off:off + _MANIFEST_BLOCK]
+                    h.update(block)
+                    block.release()
+                    if on_bytes:
+                        on_bytes(min(_MANIFEST_BLOCK, size - off))
+            finally:
+                view.release()
+            return h.hexdigest()
+
+
+def hash_files(files: List[Path], workers: Optional[int] = None) -> Dict[Path, str]:
+    """Hash SHA-256 di più file in parallelo (un thread per file, fino a 'workers'), con progresso."""
+    import concurrent.futures as cf
+    board = _ProgressBoard()
+    for f in files:
+        board.add(str(f), f.name)
+
+    def _one(f: Path) -> tuple[Path, str]:
+        size = max(1, f.stat().st_size)
+        done = [0]
+
+        def _on_bytes(n: int) -> None:
+            done[0] += n
+            board.update(str(f), phase="sha256", percent=done[0] * 100.0 / size, done_bytes=done[0])
+
+        try:
+            digest = _sha256_mmap(f, _on_bytes)
+        except InterruptedError:
+            raise  # job annullato: nessun ripiego sulla lettura completa
+        except (ValueError, OSError):
+            digest = _sha256_file(f, _on_bytes)  # mmap non disponibile (es. alcune share di rete)
+        board.update(str(f), state="ok")
+        return f, digest
+
+    n = max(1, min(workers or max(PARALLEL_WORKERS, os.cpu_count() or 1), len(files)))
+    with board, cf.ThreadPoolExecutor(max_workers=n) as pool:
+        return dict(pool.map(_with_job_ctx(_one), files))
+
+
+def _manifest_path(files: List[Path]) -> Path:
+    """install.wim -> install.wim.manifest.json; set install*.swm -> install.swm.manifest.json."""
+    return files[0].with_name(files[0].name + MANIFEST_SUFFIX)
+
+
+def write_manifest(files: List[Path], operation: str) -> Optional[Path]:
+    """Crea il manifest accanto al primo file."""
+    digests = hash_files(files)
+    out = _manifest_path(files)
+    entries = []
+    for f in files:
+        hdr = _read_wim_header(f)
+        images = [{"index": int(im.get("INDEX") or 0), "name": im.get("NAME", "")} for im in _read_wim_xml(f, hdr)] if hdr else []
+        name = Path(os.path.relpath(f, out.parent)).as_posix()
+        entries.append(ManifestEntry(name, f.stat().st_size, digests[f], hdr.guid if hdr else None,
+                                     hdr.part_number if hdr else None, hdr.total_parts if hdr else None, images))
+    doc = {"version": 1, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "operation": operation,
+           "files": [_jsonable(e) for e in entries]}
+    try:
+        tmp = out.with_name(out.name + ".tmp")
+        tmp.write_text(json.dumps(doc, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, out)
+    except OSError as e:
+        log_error(f"[MANIFEST] scrittura {out} fallita: {e}")
+        print(color(f"[WARN] Could not write manifest {out}: {e}", fg="bright_yellow"))
+        return None
+    emit_records("manifest", entries, manifest=str(out), operation=operation)
+    return out
+
+
+def verify_manifest(manifest: Path) -> List[ManifestCheck]:
+    """Ricontrolla i file elencati: presenza e dimensione subito, poi SHA-256 in parallelo e GUID dall'header."""
+    doc = json.loads(manifest.read_text(encoding="utf-8"))
+    base = manifest.parent
+    checks: Dict[str, ManifestCheck] = {}
+    to_hash: List[Path] = []
+    for e in doc.get("files", []):
+        p = base / e["name"]
+        if not p.is_file():
+            checks[e["name"]] = ManifestCheck(e["name"], "missing", str(p))
+        elif p.stat().st_size != e["size"]:
+            checks[e["name"]] = ManifestCheck(e["name"], "size", f"{p.stat().st_size} != {e['size']}")
+        else:
+            to_hash.append(p)
+    digests = hash_files(to_hash) if to_hash else {}
+    for e in doc.get("files", []):
+        if e["name"] in checks:
+            continue
+        p = base / e["name"]
+        hdr = _read_wim_header(p) if e.get("guid") else None
+        if digests.get(p) != e["sha256"]:
+            checks[e["name"]] = ManifestCheck(e["name"], "sha256", digests.get(p, ""))
+        elif hdr and hdr.guid != e["guid"]:
+            checks[e["name"]] = ManifestCheck(e["name"], "guid", f"{hdr.guid} != {e['guid']}")
+        else:
+            checks[e["name"]] = ManifestCheck(e["name"], "ok", e["sha256"])
+    return [checks[e["name"]] for e in doc.get("files", [])]
+
 
-    percent_last = -1
-    last_print_len = 0
-    cols = max(40, term_width(80))
-    prefix_plain = "Progresso: "
-    bar_max = max(10, min(50, cols - (len(prefix_plain) + 12 + 2 + 2)))
+def _auto_manifest(files: List[Path], operation: str) -> None:
+    """Stadio finale di export/convert/split/join quando MANIFEST_AUTO è attivo."""
+    if not MANIFEST_AUTO or not files:
+        return
+    print(color(f"[MANIFEST] Hashing {len(files)} file(s)...", fg="bright_cyan"))
+    out = write_manifest(files, operation)
+    if out:
+        print(color(f"[MANIFEST] Written {out}", fg="bright_green"))
 
-    assert proc.stderr is not None
-    try:
-        for line in proc.stderr:
-            raw = line.rstrip("\r\n")
-            # Cerca percentuali stile "10%", "10.0%" etc.
-            m = re.search(r"(\d+(?:\.\d+)?)%", raw)
-            if m:
-                try:
-                    p = int(float(m.group(1)) + 0.5)
-                    p = max(0, min(100, p))
-                    if p != percent_last:
-                        percent_last = p
-                        # Riusa lo stesso schema della barra (rispettando eventuale preferenza)
-                        if WIMLIB_PROGRESS_MODE != "off":
-                            filled = int((p / 100.0) * bar_max)
-                            prog = (
-                                color("Progresso:", fg="bright_cyan", bold=True)
-                                + f" {p:3d}% ["
-                                + color(f"{'#'*filled:<{bar_max}}", fg="bright_green")
-                                + "]"
-                            )
-                            sys.stdout.write("\r" + prog)
-                            # Stima lunghezza visiva per pulizia residui
-                            vis_len_est = len(prefix_plain) + 5 + 2 + bar_max
-                            pad = max(0, last_print_len - vis_len_est)
-                            if pad:
-                                sys.stdout.write(" " * pad)
-                            sys.stdout.flush()
-                            last_print_len = vis_len_est
-                except Exception:
-                    pass
-            if VERBOSE:
-                try:
-                    with open(VERBOSE_FILE, "a", encoding="utf-8") as f:
-                        f.write(raw + "\n")
-                except Exception:
-                    pass
-    except KeyboardInterrupt:
+
+def menu_manifest() -> None:
+    """Menu 33: crea il manifest di un artefatto (o set SWM) oppure verifica un manifest esistente."""
+    print_header("SHA-256 manifest (create / verify)")
+    p = ask_path(f"Image (.wim/.esd/.swm) to hash, or a *{MANIFEST_SUFFIX} to verify: ", (*IMAGE_EXTS, ".json"))
+    if not p:
+        return
+    if p.name.endswith(MANIFEST_SUFFIX):
         try:
-            proc.terminate()
-        except Exception:
-            pass
-        proc.wait(timeout=5)
-        print("\n[INFO] Operazione annullata dall'utente.")
-        return 130
+            checks = verify_manifest(p)
+        except (OSError, ValueError, KeyError) as e:
+            print(color(f"[ERROR] Invalid manifest {p}: {e}", fg="bright_red"))
+            pause()
+            return
+        for c in checks:
+            ok = c.status == "ok"
+            print(color(f"[{'OK' if ok else 'FAILED'}] {c.name}" + ("" if ok else f" - {c.status}: {c.detail}"),
+                        fg="bright_green" if ok else "bright_red"))
+        emit_records("manifest_check", checks, manifest=str(p))
+        bad = sum(1 for c in checks if c.status != "ok")
+        print(f"\n[INFO] {len(checks) - bad}/{len(checks)} file(s) verified.")
+    else:
+        files = _media_sources(p)
+        out = write_manifest(files, "manual")
+        if out:
+            print(color(f"[SUCCESS] Manifest written: {out}", fg="bright_green"))
+    pause()
 
-    rc = proc.wait()
-    if percent_last >= 0 and WIMLIB_PROGRESS_MODE != "off":
-        filled = bar_max
-        prog = (
-            color("Progresso:", fg="bright_cyan", bold=True)
-            + " 100% ["
-            + color("#" * filled, fg="bright_green")
-            + "]"
-        )
-        sys.stdout.write("\r" + prog + "\n")
-        sys.stdout.flush()
-    return rc
 
 def menu_split_wim() -> None:
     """Split install.wim into install.swm parts for FAT32 compatibility.
@@ -1864,7 +6273,7 @@ def menu_split_wim() -> None:
     """
     print_header("Split install.wim for FAT32")
     try:
-        wim_path = input_path("Path to install.wim: ").strip().strip('"')
+        wim_path = input_path("Path to install.wim: ", (".wim",)).strip().strip('"')
     except KeyboardInterrupt:
         print()
         return
@@ -1927,6 +6336,10 @@ def menu_split_wim() -> None:
         pause()
         return
     
+    # Le parti sommano circa la dimensione del WIM e vanno nella stessa cartella
+    if not preflight_space([("install*.swm parts", output_folder, size_bytes)]):
+        return
+
     print(f"[INFO] Splitting with DISM, chunk size: {chunk_mb} MB...")
     
     cmd = [
@@ -1936,32 +6349,51 @@ def menu_split_wim() -> None:
         f"/FileSize:{chunk_mb}"
     ]
     
-    rc = _stream_dism_progress(cmd)
-    
-    if rc == 0:
-        # Count created .swm files
-        swm_files = sorted(output_folder.glob("install*.swm"))
-        print(f"\n[SUCCESS] Split completed. Created {len(swm_files)} file(s):")
-        for sf in swm_files:
-            sz = sf.stat().st_size / (1024**3)
-            print(f"  - {sf.name} ({sz:.2f} GB)")
-        print(f"\n[INFO] Copy all install*.swm files to sources\\ folder in ISO/USB.")
-        print(f"[INFO] Windows Setup will auto-read split images.")
-        print(f"[INFO] Do NOT split boot.wim (it stays as-is for boot).")
-        try:
-            clean = input("\nDelete original install.wim? (y/N): ").strip().lower()
+    def _do_split(clean: Optional[str]) -> int:
+        # clean=None: chiede dopo lo split; in background la risposta è raccolta prima di accodare
+        rc = _stream_dism_progress(cmd)
+        
+        if rc == 0:
+            # Count created .swm files
+            swm_files = _swm_parts(swm_base)
+            print(f"\n[SUCCESS] Split completed. Created {len(swm_files)} file(s):")
+            for sf in swm_files:
+                sz = sf.stat().st_size / (1024**3)
+                print(f"  - {sf.name} ({sz:.2f} GB)")
+            print(f"\n[INFO] Copy all install*.swm files to sources\\ folder in ISO/USB.")
+            print(f"[INFO] Windows Setup will auto-read split images.")
+            print(f"[INFO] Do NOT split boot.wim (it stays as-is for boot).")
+            _auto_manifest(swm_files, "split")
+            if clean is None:
+                try:
+                    if input("\nWrite the parts to USB target folders now? (y/N): ").strip().lower() in {"y", "yes", "s", "si", "sì"}:
+                        _write_media_prompt(swm_files)
+                    clean = input("\nDelete original install.wim? (y/N): ").strip().lower()
+                except KeyboardInterrupt:
+                    print()
+                    pause()
+                    return rc
+            if clean in {"y", "yes", "si", "sì"}:
+                try:
+                    wim.unlink()
+                    print(f"[INFO] Deleted: {wim}")
+                except Exception as e:
+                    print(f"[!] Failed to delete: {e}")
+        else:
+            print("\n[!] Split failed. Check error log.")
+        return rc
+
+    bg = _ask_background()
+    if bg:
+        try:
+            clean = input("Delete original install.wim after a successful split? (y/N): ").strip().lower()
         except KeyboardInterrupt:
             print()
-            pause()
             return
-        if clean in {"y", "yes", "si", "sì"}:
-            try:
-                wim.unlink()
-                print(f"[INFO] Deleted: {wim}")
-            except Exception as e:
-                print(f"[!] Failed to delete: {e}")
-    else:
-        print("\n[!] Split failed. Check error log.")
+        _submit_job(f"Split {wim.name} ({chunk_mb} MB parts)", "split", [wim, swm_base], lambda: _do_split(clean), bg)
+        return
+    with _ForegroundClaim(wim, swm_base):
+        _do_split(None)
 
 
 def menu_unsplit_swm() -> None:
@@ -1974,7 +6406,7 @@ def menu_unsplit_swm() -> None:
     print()
     
     try:
-        swm_path = input_path("Path al primo file .swm (es: install.swm): ").strip().strip('"')
+        swm_path = input_path("Path al primo file .swm (es: install.swm): ", (".swm",)).strip().strip('"')
     except KeyboardInterrupt:
         print()
         return
@@ -2017,29 +6449,20 @@ def menu_unsplit_swm() -> None:
     
     # Get image info per scegliere index
     print("[INFO] Reading image info from .swm...")
-    info_cmd = ["/Get-ImageInfo", f"/ImageFile:{swm}", f"/SWMFile:{swm_folder / (swm_base + '*.swm')}"]
-    info_result = _run_dism_with_spinner_capture(info_cmd)
+    info = get_images(swm, swm_pattern=swm_folder / (swm_base + '*.swm'))
+    indexes = [img.index for img in info.records]
     
-    if info_result.returncode != 0:
-        print(f"[!] Failed to read image info: {info_result.stderr}")
+    if not info.ok:
+        print(f"[!] Failed to read image info: {info.tail}")
         pause()
         return
     
-    # Parse indexes
-    indexes = []
-    for line in info_result.stdout.splitlines():
-        if line.strip().lower().startswith("index :"):
-            try:
-                idx = int(line.split(":")[1].strip())
-                indexes.append(idx)
-            except:
-                pass
-    
     if not indexes:
         print("[!] No indexes found in .swm files.")
         pause()
         return
     
+    emit_records("image", info.records, source=str(swm), returncode=info.returncode)
     print(f"[INFO] Available indexes: {indexes}")
     
     try:
@@ -2065,7 +6488,7 @@ def menu_unsplit_swm() -> None:
     # Output WIM path
     default_output = swm_folder / f"{swm_base}_ricombinato.wim"
     try:
-        output_path = input_path(f"Output WIM path (ENTER={default_output}): ").strip().strip('"')
+        output_path = input_path(f"Output WIM path (ENTER={default_output}): ", (".wim",)).strip().strip('"')
     except KeyboardInterrupt:
         print()
         return
@@ -2123,92 +6546,471 @@ def menu_unsplit_swm() -> None:
         "/CheckIntegrity"
     ]
     
-    rc = _stream_dism_progress(cmd)
-    
-    if rc == 0:
-        output_size = output_wim.stat().st_size / (1024**3)
-        print(f"\n[SUCCESS] Recombined WIM created: {output_wim}")
-        print(f"[INFO] Size: {output_size:.2f} GB")
-        print(f"\n[INFO] You can now:")
-        print(f"  1. Mount this WIM (Menu 2)")
-        print(f"  2. Add drivers/features (Menu 7, 10)")
-        print(f"  3. Unmount with commit")
-        print(f"  4. Re-export optimized (Menu 14)")
-        print(f"  5. Re-split if needed (Menu 25)")
-    else:
-        print("\n[!] Recombine failed. Check error log.")
+    total = next((img.size for img in info.records if img.index == selected_idx), None)
+    # Stima: byte non compressi dell'indice × rapporto del profilo, mai oltre la somma delle parti
+    est = sum(sf.stat().st_size for sf in swm_files)
+    if total:
+        est = min(est, int(total * _COMPRESS_RATIO.get(comp, 0.45)))
+    if not preflight_space([("recombined WIM", output_wim, est)]):
+        return
 
+    def _do_join() -> int:
+        rc = _stream_dism_progress(cmd, total, output_wim)
+        
+        if rc == 0:
+            output_size = output_wim.stat().st_size / (1024**3)
+            print(f"\n[SUCCESS] Recombined WIM created: {output_wim}")
+            print(f"[INFO] Size: {output_size:.2f} GB")
+            _auto_manifest([output_wim], "join")
+            print(f"\n[INFO] You can now:")
+            print(f"  1. Mount this WIM (Menu 2)")
+            print(f"  2. Add drivers/features (Menu 7, 10)")
+            print(f"  3. Unmount with commit")
+            print(f"  4. Re-export optimized (Menu 14)")
+            print(f"  5. Re-split if needed (Menu 25)")
+        else:
+            print("\n[!] Recombine failed. Check error log.")
+        return rc
 
-def _run_dism_with_spinner_capture(args: List[str]):
-    """Esegue DISM catturando stdout/stderr ma mostrando una singola riga di attività (spinner).
-    Utile per comandi informativi (es. /Get-Features) dove DISM non stampa percentuali.
-    Ritorna un oggetto semplice con attributi: returncode, stdout, stderr.
+    bg = _ask_background()
+    if bg:
+        _submit_job(f"Join {swm.name} idx {selected_idx} -> {output_wim.name}", "join", [*swm_files, output_wim], _do_join, bg)
+        return
+    with _ForegroundClaim(*swm_files, output_wim):
+        _do_join()
+
+
+# ====== Streaming output DISM (parser a generatore) ======
+_DISM_KV_RE = re.compile(r"^\s*([^:]+?)\s*:\s*(.*?)\s*$")
+_DISM_TAIL_LINES = 200
+
+
+class _DismLineStream:
+    """Esegue DISM e restituisce le righe di stdout man mano che arrivano (iteratore).
+    Mostra lo spinner informativo mentre il processo è attivo e conserva solo un ring buffer
+    delle ultime righe (stdout+stderr) per la diagnostica, senza accumulare l'intero output.
+    Dopo l'iterazione sono disponibili 'returncode' e 'tail_text()'.
     """
-    cmd = ["dism", *args]
-    try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-        )
-    except FileNotFoundError:
-        log_error("DISM non trovato nel PATH")
-        class _R:  # simple result
-            def __init__(self):
-                self.returncode = 1
-                self.stdout = ""
-                self.stderr = "DISM not found"
-        return _R()
 
-    out_lines: List[str] = []
-    err_lines: List[str] = []
+    def __init__(self, args: List[str], tail_lines: int = _DISM_TAIL_LINES, spinner: bool = True) -> None:
+        import collections
+        self.args = args
+        self.spinner = spinner
+        self.returncode: Optional[int] = None
+        self.tail: "collections.deque[str]" = collections.deque(maxlen=tail_lines)
+        self.err_tail: "collections.deque[str]" = collections.deque(maxlen=tail_lines)
 
-    import threading
+    def tail_text(self) -> str:
+        return "\n".join(self.tail)
 
-    def _reader(stream, acc: List[str]):
+    def __iter__(self):
+        import threading
+        cmd = ["dism", *self.args]
         try:
-            for line in stream:  # type: ignore
-                acc.append(line)
-        except Exception:
-            pass
+            proc = _popen_child(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+            )
+        except FileNotFoundError:
+            log_error("DISM non trovato nel PATH")
+            self.returncode = 1
+            self.err_tail.append("DISM not found")
+            return
+        job = _current_job()
+        if job is not None:
+            # Nei job lo spinner sporcherebbe il menu; il processo resta annullabile dal job
+            self.spinner = False
+            job.procs.add(proc)
+
+        def _err_reader() -> None:
+            try:
+                for line in proc.stderr:  # type: ignore[union-attr]
+                    raw = line.rstrip("\r\n")
+                    self.tail.append(raw)
+                    self.err_tail.append(raw)
+            except Exception:
+                pass
+
+        done = threading.Event()
+
+        def _spinner() -> None:
+            spinner = "|/-\\"
+            si = 0
+            while not done.wait(0.12):
+                if self.spinner and INFO_SPINNER and WIMLIB_PROGRESS_MODE != "off" and not _json_to_stdout():
+                    msg = color("DISM in corso (info)", fg="bright_cyan", bold=True)
+                    sys.stdout.write("\r" + f"{msg}  " + spinner[si % len(spinner)])
+                    sys.stdout.flush()
+                    si += 1
+
+        t_err = threading.Thread(target=_err_reader, daemon=True)
+        t_spin = threading.Thread(target=_spinner, daemon=True)
+        t_err.start(); t_spin.start()
+        verbose_f = None
+        if VERBOSE:
+            try:
+                verbose_f = open(VERBOSE_FILE, "a", encoding="utf-8")
+                verbose_f.write("\n== CMD ==\n" + " ".join(cmd) + "\n")
+            except Exception:
+                verbose_f = None
         try:
-            stream.close()  # type: ignore
-        except Exception:
-            pass
+            for line in proc.stdout:  # type: ignore[union-attr]
+                raw = line.rstrip("\r\n")
+                self.tail.append(raw)
+                if verbose_f:
+                    verbose_f.write(raw + "\n")
+                yield raw
+            self.returncode = proc.wait()
+        except KeyboardInterrupt:
+            try:
+                proc.terminate()
+            except Exception:
+                pass
+            proc.wait(timeout=5)
+            self.returncode = 130
+            print("\n[INFO] Operazione annullata dall'utente.")
+        finally:
+            if proc.poll() is None:
+                # Il consumatore ha smesso di leggere: non lasciare DISM orfano
+                try:
+                    proc.terminate()
+                    proc.wait(timeout=5)
+                except Exception:
+                    pass
+                if self.returncode is None:
+                    self.returncode = proc.returncode
+            done.set()
+            if job is not None:
+                job.procs.discard(proc)
+            t_spin.join(timeout=1)
+            t_err.join(timeout=2)
+            if verbose_f:
+                try:
+                    verbose_f.write(f"RC: {self.returncode}\n")
+                    verbose_f.close()
+                except Exception:
+                    pass
+            # pulisci la riga spinner
+            if self.spinner and not _json_to_stdout():
+                try:
+                    sys.stdout.write("\r" + " " * 80 + "\r")
+                    sys.stdout.flush()
+                except Exception:
+                    pass
+
 
-    t_out = threading.Thread(target=_reader, args=(proc.stdout, out_lines), daemon=True)  # type: ignore
-    t_err = threading.Thread(target=_reader, args=(proc.stderr, err_lines), daemon=True)  # type: ignore
-    t_out.start(); t_err.start()
+def _iter_dism_blocks(lines: Iterable[str]):
+    """Raggruppa le righe 'Chiave : Valore' consecutive in dict (un blocco per riga vuota).
+    Le righe indentate senza ':' continuano il valore precedente (es. 'Languages :');
+    le altre righe senza ':' (intestazioni, barre di avanzamento) chiudono il blocco.
+    """
+    block: Dict[str, str] = {}
+    last_key: Optional[str] = None
+    for line in lines:
+        if not line.strip():
+            if block:
+                yield block
+            block, last_key = {}, None
+            continue
+        m = _DISM_KV_RE.match(line)
+        if m:
+            last_key = m.group(1)
+            block[last_key] = m.group(2)
+        elif last_key is not None and line[:1] in (" ", "\t"):
+            prev = block[last_key]
+            block[last_key] = (prev + "\n" + line.strip()) if prev else line.strip()
+        elif block:
+            yield block
+            block, last_key = {}, None
+    if block:
+        yield block
+
+
+# ====== Modello tipizzato dei comandi informativi DISM ======
+_DISM_DIGITS_RE = re.compile(r"\D")
+
+
+def _dism_int(value: Optional[str]) -> Optional[int]:
+    """'15,012,345 bytes' -> 15012345; None se non numerico."""
+    if not value:
+        return None
+    digits = _DISM_DIGITS_RE.sub("", value)
+    return int(digits) if digits else None
+
+
+def _dism_yes(value: Optional[str]) -> bool:
+    return (value or "").strip().lower() in {"yes", "true"}
+
+
+@dataclass
+class ImageInfo:
+    """Immagine da /Get-WimInfo o /Get-ImageInfo (i dettagli sono presenti solo con /Index)."""
+    __slots__ = ("index", "name", "description", "size", "architecture", "version", "edition")
+    index: int
+    name: str
+    description: str
+    size: Optional[int]
+    architecture: Optional[str]
+    version: Optional[str]
+    edition: Optional[str]
+
+
+@dataclass
+class FeatureInfo:
+    """Feature da /Get-Features (nome/stato) o /Get-FeatureInfo (anche nome visualizzato e descrizione)."""
+    __slots__ = ("name", "state", "display_name", "description", "restart_required")
+    name: str
+    state: str
+    display_name: Optional[str]
+    description: Optional[str]
+    restart_required: Optional[str]
+
+
+@dataclass
+class DriverInfo:
+    """Driver da /Get-Drivers."""
+    __slots__ = ("published_name", "original_file_name", "inbox", "class_name", "provider", "date", "version")
+    published_name: str
+    original_file_name: str
+    inbox: bool
+    class_name: str
+    provider: str
+    date: str
+    version: str
+
+
+@dataclass
+class PackageInfo:
+    """Pacchetto da /Get-Packages."""
+    __slots__ = ("identity", "state", "release_type", "install_time")
+    identity: str
+    state: str
+    release_type: str
+    install_time: str
+
+
+@dataclass
+class MountedImageInfo:
+    """Mount da /Get-MountedWimInfo."""
+    __slots__ = ("mount_dir", "image_file", "image_index", "read_write", "status")
+    mount_dir: str
+    image_file: str
+    image_index: Optional[int]
+    read_write: bool
+    status: str
+
+
+@dataclass
+class DismQueryResult:
+    """Esito di un comando informativo: record tipizzati, codice di uscita e coda dell'output grezzo."""
+    __slots__ = ("records", "returncode", "tail")
+    records: list
+    returncode: int
+    tail: str
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+def parse_images(lines: Iterable[str]):
+    for b in _iter_dism_blocks(lines):
+        idx = _dism_int(b.get("Index"))
+        if idx is None:
+            continue
+        yield ImageInfo(idx, b.get("Name", ""), b.get("Description", ""), _dism_int(b.get("Size")),
+                        b.get("Architecture"), b.get("Version"), b.get("Edition"))
+
+
+def parse_features(lines: Iterable[str]):
+    for b in _iter_dism_blocks(lines):
+        name = b.get("Feature Name")
+        if name is not None:
+            yield FeatureInfo(name, b.get("State", ""), b.get("Display Name"), b.get("Description"), b.get("Restart Required"))
+
+
+def parse_drivers(lines: Iterable[str]):
+    for b in _iter_dism_blocks(lines):
+        pub = b.get("Published Name")
+        if pub:
+            yield DriverInfo(pub, b.get("Original File Name", ""), _dism_yes(b.get("Inbox")), b.get("Class Name", ""),
+                             b.get("Provider Name", ""), b.get("Date", ""), b.get("Version", ""))
+
+
+def parse_packages(lines: Iterable[str]):
+    for b in _iter_dism_blocks(lines):
+        ident = b.get("Package Identity")
+        if ident:
+            yield PackageInfo(ident, b.get("State", ""), b.get("Release Type", ""), b.get("Install Time", ""))
+
+
+def parse_mounted_images(lines: Iterable[str]):
+    for b in _iter_dism_blocks(lines):
+        mdir = b.get("Mount Dir")
+        if mdir:
+            yield MountedImageInfo(mdir, b.get("Image File", ""), _dism_int(b.get("Image Index")),
+                                   _dism_yes(b.get("Mounted Read/Write")), b.get("Status", ""))
+
+
+def _dism_query(args: List[str], parser, spinner: bool = True) -> DismQueryResult:
+    """Esegue un comando informativo (forzando /English) e lo analizza in un unico passaggio.
+    spinner=False per le chiamate da thread paralleli (nessuna scrittura su console).
+    """
+    if "/English" not in args:
+        args = [*args, "/English"]
+    stream = _DismLineStream(args, spinner=spinner)
+    records = list(parser(stream))
+    rc = stream.returncode if stream.returncode is not None else 1
+    if rc != 0:
+        log_error(f"DISM {' '.join(args)} rc={rc}\n{stream.tail_text()}")
+    return DismQueryResult(records, rc, stream.tail_text())
+
+
+def get_images(wim: Path, index: Optional[int] = None, swm_pattern: Optional[Path] = None) -> DismQueryResult:
+    """Indici di un WIM/ESD (/Get-WimInfo) o di un set SWM (/Get-ImageInfo con /SWMFile)."""
+    if swm_pattern is not None:
+        args = ["/Get-ImageInfo", f"/ImageFile:{wim}", f"/SWMFile:{swm_pattern}"]
+    else:
+        args = ["/Get-WimInfo", f"/WimFile:{wim}"]
+    if index is not None:
+        args.append(f"/Index:{index}")
+    return _dism_query(args, parse_images)
+
+
+def get_features(image_dir: Path) -> DismQueryResult:
+    return _dism_query(["/Image:" + str(image_dir), "/Get-Features"], parse_features)
+
+
+def get_feature_info(image_dir: Path, name: str) -> DismQueryResult:
+    return _dism_query(["/Image:" + str(image_dir), "/Get-FeatureInfo", f"/FeatureName:{name}"], parse_features)
+
+
+def get_drivers(image_dir: Path, spinner: bool = True) -> DismQueryResult:
+    return _dism_query(["/Image:" + str(image_dir), "/Get-Drivers"], parse_drivers, spinner)
+
+
+def get_packages(image_dir: Path) -> DismQueryResult:
+    return _dism_query(["/Image:" + str(image_dir), "/Get-Packages"], parse_packages)
+
+
+def get_mounted_images() -> DismQueryResult:
+    return _dism_query(["/Get-MountedWimInfo"], parse_mounted_images)
+
+
+_HEALTH_PATTERNS = (
+    (re.compile(r"No component store corruption detected", re.IGNORECASE), "healthy"),
+    (re.compile(r"component store is repairable", re.IGNORECASE), "repairable"),
+    (re.compile(r"cannot be repaired|is not repairable", re.IGNORECASE), "not_repairable"),
+)
 
-    spinner = "|/-\\"
-    si = 0
+
+def parse_health(lines: Iterable[str]) -> str:
+    """Stato del component store da /Cleanup-Image /CheckHealth|/ScanHealth /English.
+    Vale la prima riga riconosciuta, ma l'iterabile viene consumato fino in fondo: con un
+    _DismLineStream abbandonato a metà DISM verrebbe terminato e il returncode non sarebbe il suo.
+    """
+    found = "unknown"
+    for line in lines:
+        if found != "unknown":
+            continue
+        for pat, status in _HEALTH_PATTERNS:
+            if pat.search(line):
+                found = status
+                break
+    return found
+
+
+# ====== Output strutturato (JSON/JSONL) ======
+def _output_format() -> str:
+    """Formato effettivo: l'override di sessione (--output) prevale sull'impostazione salvata."""
+    return _CLI_OUTPUT_FORMAT or OUTPUT_FORMAT
+
+
+def _output_file() -> Optional[Path]:
+    return _CLI_OUTPUT_FILE or OUTPUT_FILE
+
+
+def _json_mode() -> bool:
+    return _output_format() in {"json", "jsonl"}
+
+
+def _json_to_stdout() -> bool:
+    """True se l'output JSON va su stdout (spinner e barre vanno soppressi per non sporcarlo)."""
+    return _json_mode() and _output_file() is None
+
+
+def _jsonable(obj):
+    if hasattr(obj, "__dataclass_fields__"):
+        import dataclasses
+        return dataclasses.asdict(obj)
+    if isinstance(obj, Path):
+        return str(obj)
+    raise TypeError(f"Not JSON serializable: {type(obj).__name__}")
+
+
+def emit_records(kind: str, records: Iterable, **context) -> None:
+    """Emette record strutturati secondo il formato effettivo (_output_format).
+    - json: un documento per comando {type, timestamp, ...context, records: [...]}
+    - jsonl: una riga per record {type, timestamp, ...context, ...record}
+    Nessun effetto in modalità 'text'.
+    """
+    if not _json_mode():
+        return
+    ts = time.strftime("%Y-%m-%dT%H:%M:%S")
+    ctx = {k: v for k, v in context.items() if v is not None}
+    if _output_format() == "json":
+        doc = {"type": kind, "timestamp": ts, **ctx, "records": [r for r in records]}
+        text = json.dumps(doc, ensure_ascii=False, indent=2, default=_jsonable) + "\n"
+    else:
+        rows = []
+        for r in records:
+            rec = _jsonable(r) if hasattr(r, "__dataclass_fields__") else r
+            rows.append(json.dumps({"type": kind, "timestamp": ts, **ctx, **rec}, ensure_ascii=False, default=_jsonable))
+        text = "".join(row + "\n" for row in rows)
+    out_file = _output_file()
+    if out_file is None:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return
     try:
-        while proc.poll() is None:
-            if INFO_SPINNER and WIMLIB_PROGRESS_MODE != "off":
-                msg = color("DISM in corso (info)", fg="bright_cyan", bold=True)
-                sys.stdout.write("\r" + f"{msg}  " + spinner[si % len(spinner)])
-                sys.stdout.flush()
-                si += 1
-            time.sleep(0.12)
-    except KeyboardInterrupt:
-        try:
-            proc.terminate()
-        except Exception:
-            pass
-        proc.wait(timeout=5)
-        print("\n[INFO] Operazione annullata dall'utente.")
-    finally:
-        t_out.join(timeout=2)
-        t_err.join(timeout=2)
-        # pulisci la riga spinner
-        try:
-            sys.stdout.write("\r" + " " * 80 + "\r")
-            sys.stdout.flush()
-        except Exception:
-            pass
+        out_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(out_file, "a", encoding="utf-8") as f:
+            f.write(text)
+        print(color(f"[INFO] {kind}: results written to {out_file}", fg="bright_cyan"))
+    except Exception as e:
+        print(f"[ERROR] Unable to write {out_file}: {e}")
+        log_error(f"emit_records {kind}: {e}")
+
+
+def _show_wim_info(src: Path) -> None:
+    """Mostra gli indici di un WIM/ESD (testo DISM o record JSON secondo il formato di output)."""
+    if _json_mode():
+        res = get_images(src)
+        emit_records("image", res.records, source=str(src), returncode=res.returncode)
+        return
+    # Metadati nativi (catalogo/prefetch): niente /Get-WimInfo completo solo per elencare gli indici
+    meta = image_meta(src)
+    if meta and meta.get("images"):
+        print(f"\n{src.name}  GUID {meta['guid']}  {meta['size'] / _GB:.2f} GB")
+        _print_image_indexes(meta)
+        return
+    cp_info = dism("/Get-WimInfo", f"/WimFile:{str(src)}", capture=True)
+    if cp_info.stdout:
+        print(cp_info.stdout, end="" if cp_info.stdout.endswith("\n") else "\n")
+
+
+def _run_dism_with_spinner_capture(args: List[str]):
+    """Esegue DISM catturando stdout/stderr ma mostrando una singola riga di attività (spinner).
+    Utile per comandi informativi (es. /Get-Features) dove DISM non stampa percentuali.
+    Ritorna un oggetto semplice con attributi: returncode, stdout, stderr.
+    Da preferire _DismLineStream + parser a generatore quando non serve il testo completo.
+    """
+    stream = _DismLineStream(args)
+    out_lines = [line + "\n" for line in stream]
 
     class _Result:
         def __init__(self, rc, so, se):
@@ -2216,7 +7018,197 @@ def _run_dism_with_spinner_capture(args: List[str]):
             self.stdout = so
             self.stderr = se
 
-    return _Result(proc.returncode, "".join(out_lines), "".join(err_lines))
+    return _Result(stream.returncode, "".join(out_lines), "\n".join(stream.err_tail))
+
+def menu_settings_perf() -> None:
+    """Menu 27: impostazioni di cache e prestazioni (persistite in settings.json)."""
+    global EXPORT_CACHE, EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_GB, OUTPUT_FORMAT, OUTPUT_FILE, _CLI_OUTPUT_FORMAT, _CLI_OUTPUT_FILE, PARALLEL_WORKERS, DRIVER_PREFILTER
+    global PLACEMENT_AUTO, PLACEMENT_CANDIDATES, SOURCE_STAGING, STAGING_DIR, STAGING_MAX_GB, MANIFEST_AUTO
+    global CHILD_CPU_PRIORITY, CHILD_IO_PRIORITY, CHILD_AFFINITY, CHILD_IO_MBPS, SPECULATIVE_MOUNT
+    print_header("Settings: cache / performance")
+    cache = _export_cache()
+    print(f"[INFO] Export cache: {'on' if EXPORT_CACHE else 'off'}  dir: {cache.root}  "
+          f"used: {_format_bytes(cache.total_bytes())} / {EXPORT_CACHE_MAX_GB} GB")
+    try:
+        ec = input("Export cache (on/off/clear, ENTER=keep): ").strip().lower()
+    except KeyboardInterrupt:
+        print()
+        return
+    if ec in {"on", "off"}:
+        EXPORT_CACHE = (ec == "on")
+    elif ec == "clear":
+        n = cache.clear()
+        print(color(f"[INFO] Export cache cleared ({n} entries).", fg="bright_cyan"))
+    try:
+        ecd = input("Export cache folder (ENTER=keep, '-'=use TEMP): ").strip().strip('"')
+        ecm = input(f"Export cache max size in GB [current {EXPORT_CACHE_MAX_GB}] (ENTER=keep): ").strip()
+    except KeyboardInterrupt:
+        print()
+        return
+    if ecd == "-":
+        EXPORT_CACHE_DIR = None
+    elif ecd:
+        EXPORT_CACHE_DIR = Path(ecd)
+    if ecm:
+        try:
+            val = int(ecm)
+            if 1 <= val <= 4096:
+                EXPORT_CACHE_MAX_GB = val
+            else:
+                print("[WARN] Value out of range (1-4096), ignored.")
+        except ValueError:
+            print("[WARN] Non-numeric value, ignored.")
+    try:
+        of = input(f"Output format for info commands (text/json/jsonl) [current {_output_format()}] (ENTER=keep): ").strip().lower()
+        ofile = input(f"JSON output file [current {_output_file() or 'stdout'}] (ENTER=keep, '-'=stdout): ").strip().strip('"')
+    except KeyboardInterrupt:
+        print()
+        return
+    # Una scelta esplicita qui sostituisce anche l'eventuale override da riga di comando
+    if of in {"text", "json", "jsonl"}:
+        OUTPUT_FORMAT, _CLI_OUTPUT_FORMAT = of, None
+    elif of:
+        print("[WARN] Invalid output format, ignored.")
+    if ofile == "-":
+        OUTPUT_FILE = _CLI_OUTPUT_FILE = None
+    elif ofile:
+        OUTPUT_FILE, _CLI_OUTPUT_FILE = Path(ofile), None
+    try:
+        pw = input(f"Parallel DISM workers for multi-index operations (1-16) [current {PARALLEL_WORKERS}] (ENTER=keep): ").strip()
+    except KeyboardInterrupt:
+        print()
+        pw = ""
+    if pw:
+        try:
+            val = int(pw)
+            if 1 <= val <= 16:
+                PARALLEL_WORKERS = val
+            else:
+                print("[WARN] Value out of range (1-16), ignored.")
+        except ValueError:
+            print("[WARN] Non-numeric value, ignored.")
+    try:
+        dp = input(f"Driver pre-filter (only applicable, not installed INFs) on/off/clear [current {'on' if DRIVER_PREFILTER else 'off'}] (ENTER=keep): ").strip().lower()
+    except KeyboardInterrupt:
+        print()
+        dp = ""
+    if dp in {"on", "off"}:
+        DRIVER_PREFILTER = (dp == "on")
+    elif dp == "clear":
+        try:
+            DRIVER_INDEX_FILE.unlink()
+            print(color("[INFO] Driver index cache cleared.", fg="bright_cyan"))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[WARN] Unable to clear driver index: {e}")
+    try:
+        pa = input(f"Storage placement planner on/off/bench [current {'on' if PLACEMENT_AUTO else 'off'}] (ENTER=keep): ").strip().lower()
+        pc = input(f"Placement candidate folders, ';' separated [current {';'.join(PLACEMENT_CANDIDATES) or 'auto'}] (ENTER=keep, '-'=auto): ").strip()
+    except KeyboardInterrupt:
+        print()
+        pa = pc = ""
+    if pc == "-":
+        PLACEMENT_CANDIDATES = []
+    elif pc:
+        PLACEMENT_CANDIDATES = [p.strip().strip('"') for p in pc.split(";") if p.strip()]
+    if pa in {"on", "off"}:
+        PLACEMENT_AUTO = (pa == "on")
+    if pa == "bench" or (pa == "on" or pc) and PLACEMENT_AUTO:
+        for b in volume_benchmarks(refresh=True):
+            print(f"  {b.folder:<32} seq {b.seq_mbps:8.1f} MB/s  small files {b.small_fps:8.1f}/s  free {b.free / _GB:7.1f} GB")
+    staging = _staging_cache()
+    print(f"[INFO] Source staging: {'on' if SOURCE_STAGING else 'off'}  dir: {staging.root}  "
+          f"used: {staging.total_bytes() / _GB:.2f} / {STAGING_MAX_GB} GB")
+    try:
+        ss = input("Local staging of network/slow sources (on/off/clear, ENTER=keep): ").strip().lower()
+        sd = input("Staging folder (ENTER=keep, '-'=use TEMP): ").strip().strip('"')
+        sm = input(f"Staging cache max size in GB [current {STAGING_MAX_GB}] (ENTER=keep): ").strip()
+    except KeyboardInterrupt:
+        print()
+        ss = sd = sm = ""
+    if ss in {"on", "off"}:
+        SOURCE_STAGING = (ss == "on")
+    elif ss == "clear":
+        print(f"[INFO] Removed {staging.clear()} staged file(s).")
+    if sd == "-":
+        STAGING_DIR = None
+    elif sd:
+        STAGING_DIR = Path(sd)
+    if sm:
+        if sm.isdigit() and 1 <= int(sm) <= 4096:
+            STAGING_MAX_GB = int(sm)
+        else:
+            print("[WARN] Invalid size (1-4096), ignored.")
+    try:
+        ma = input(f"SHA-256 manifest after export/convert/split/join on/off [current {'on' if MANIFEST_AUTO else 'off'}] (ENTER=keep): ").strip().lower()
+    except KeyboardInterrupt:
+        print()
+        ma = ""
+    if ma in {"on", "off"}:
+        MANIFEST_AUTO = (ma == "on")
+    try:
+        sp = input(f"Mount in background while answering prompts on/off [current {'on' if SPECULATIVE_MOUNT else 'off'}] (ENTER=keep): ").strip().lower()
+    except KeyboardInterrupt:
+        print()
+        sp = ""
+    if sp in {"on", "off"}:
+        SPECULATIVE_MOUNT = (sp == "on")
+    print(f"[INFO] DISM/wimlib child priority: {_effective_priority().describe()}")
+    try:
+        cp = input(f"CPU priority ({'/'.join(_CPU_CLASSES)}) (ENTER=keep): ").strip().lower()
+        ip = input(f"I/O priority ({'/'.join(_IO_CLASSES)}) (ENTER=keep): ").strip().lower()
+        ca = input("CPU affinity, e.g. 0,1,2 (ENTER=keep, '-'=all CPUs): ").strip()
+        cm = input("I/O bandwidth cap in MB/s (ENTER=keep, 0=none): ").strip()
+    except KeyboardInterrupt:
+        print()
+        cp = ip = ca = cm = ""
+    if cp in _CPU_CLASSES:
+        CHILD_CPU_PRIORITY = cp
+    elif cp:
+        print("[WARN] Invalid CPU priority, ignored.")
+    if ip in _IO_CLASSES:
+        CHILD_IO_PRIORITY = ip
+    elif ip:
+        print("[WARN] Invalid I/O priority, ignored.")
+    if ca == "-":
+        CHILD_AFFINITY = []
+    elif ca:
+        cpus = [int(c) for c in ca.replace(" ", "").split(",") if c.isdigit()]
+        if cpus and all(c < (os.cpu_count() or 64) for c in cpus):
+            CHILD_AFFINITY = sorted(set(cpus))
+        else:
+            print("[WARN] Invalid CPU list, ignored.")
+    if cm:
+        if cm.isdigit():
+            CHILD_IO_MBPS = int(cm)
+        else:
+            print("[WARN] Non-numeric value, ignored.")
+    save_config()
+    print(color(f"[INFO] Export cache {'enabled' if EXPORT_CACHE else 'disabled'}.", fg="bright_cyan"))
+    print(color(f"[INFO] Output format: {_output_format()} -> {_output_file() or 'stdout'}.", fg="bright_cyan"))
+
+def _apply_cli_args(argv: List[str]) -> None:
+    """Opzioni da riga di comando valide per la sola sessione (hanno precedenza su settings.json):
+    --output text|json|jsonl   formato dei comandi informativi
+    --output-file PATH         scrive JSON/JSONL su file invece che su stdout
+    Restano in variabili di sessione separate: save_config non le scrive in settings.json.
+    """
+    global _CLI_OUTPUT_FORMAT, _CLI_OUTPUT_FILE
+    it = iter(argv)
+    for a in it:
+        key, _, val = a.partition("=")
+        if key not in {"--output", "--output-file"}:
+            continue
+        if not val:
+            val = next(it, "")
+        if key == "--output":
+            if val.lower() in {"text", "json", "jsonl"}:
+                _CLI_OUTPUT_FORMAT = val.lower()
+            else:
+                print(f"[WARN] Invalid --output value '{val}' (text/json/jsonl), ignored.")
+        elif val:
+            _CLI_OUTPUT_FILE = Path(val.strip('"'))
 
 MENU_ITEMS = {
     "1": ("List image indexes", menu_getinfo),
@@ -2245,6 +7237,15 @@ MENU_ITEMS = {
     "24": ("Unmount an existing mount directory", menu_unmount_dir),
     "25": ("Split install.wim for FAT32 (install.swm)", menu_split_wim),
     "26": ("Recombine SWM files into WIM", menu_unsplit_swm),
+    "27": ("Settings: cache/performance", menu_settings_perf),
+    "28": ("Add driver to all indexes (parallel)", menu_adddrv_all),
+    "29": ("Enable/disable multiple features", menu_features_batch),
+    "30": ("Health scan of all indexes (parallel)", menu_checkhealth_all),
+    "31": ("Background jobs", menu_jobs),
+    "32": ("Write image/split parts to USB targets", menu_write_media),
+    "33": ("Create/verify SHA-256 manifest", menu_manifest),
+    "34": ("Extract files from image (no mount)", menu_extract_paths),
+    "35": ("Show build/edition from registry (no mount)", menu_image_version),
 }
 
 def main() -> None:
@@ -2265,6 +7266,7 @@ def main() -> None:
     # Carica configurazione persistente (se esiste) PRIMA di allocare/inizializzare la console,
     # così VT/QuickEdit/AlwaysOnTop vengono applicati subito in ensure_console().
     load_config()
+    _apply_cli_args(sys.argv[1:])
     # Siamo elevati: assicura una console visibile in scenari exe 'window based' e applica impostazioni
     ensure_console()
     # In alcuni ambienti la finestra può subire riattacchi iniziali: riafferma AlwaysOnTop
@@ -2303,6 +7305,9 @@ def main() -> None:
         except Exception:
             wlbl = "?"
         print(color(f"    [MountDirBase: {mb}]  [Verbose: {VERBOSE}]  [ExportBackend: {EXPORT_BACKEND}]  [wimlib {wlbl}]", fg="yellow"))
+        n_jobs = len(_JOBS.active())
+        if n_jobs:
+            print(color(f"    [Background jobs: {n_jobs} active - menu 31]", fg="bright_cyan"))
         print(color("    Shortcuts: S = save position now", fg="bright_black"))
         print(color("  0) Exit", fg="bright_cyan", bold=True))
         print(color("=============================================", fg="bright_green", bold=True))
@@ -2310,8 +7315,11 @@ def main() -> None:
             scelta = input("Choice: ").strip()
         except KeyboardInterrupt:
             print("\n[INFO] Exit requested by user.")
+            _JOBS.cancel_all()
             break
         if scelta == "0":
+            if not _jobs_before_exit():
+                continue
             break
         # Shortcuts: S = save position now
         if scelta.upper() == "S":
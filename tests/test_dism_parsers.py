@@ -0,0 +1,231 @@
+import sys
+
+import PyDism
+
+WIMINFO = """
+Deployment Image Servicing and Management tool
+Version: 10.0.19041.844
+
+Details for image : D:\\sources\\install.wim
+
+Index : 1
+Name : Windows 10 Home
+Description : Windows 10 Home
+Size : 14,935,142,315 bytes
+
+Index : 6
+Name : Windows 10 Pro
+Description : Windows 10 Pro
+Size : 15,012,345,678 bytes
+
+The operation completed successfully.
+"""
+
+WIMINFO_INDEX = """
+Details for image : D:\\sources\\install.wim
+
+Index : 6
+Name : Windows 10 Pro
+Description : Windows 10 Pro
+Size : 15,012,345,678 bytes
+WIM Bootable : No
+Architecture : x64
+Hal : <undefined>
+Version : 10.0.19045
+Edition : Professional
+Installation : Client
+Created : 12/7/2019 - 9:51:27 AM
+Languages :
+        en-US (Default)
+        it-IT
+The operation completed successfully.
+"""
+
+FEATURES = """
+Features listing for package : Microsoft-Windows-Foundation-Package~31bf3856ad364e35~amd64~~10.0.19041.1
+
+Feature Name : NetFx3
+State : Disabled with Payload Removed
+
+Feature Name : Microsoft-Hyper-V-All
+State : Enabled
+
+The operation completed successfully.
+"""
+
+FEATUREINFO = """
+Feature Information:
+
+Feature Name : NetFx3
+Display Name : .NET Framework 3.5 (includes .NET 2.0 and 3.0)
+Description : .NET Framework 3.5 (includes .NET 2.0 and 3.0)
+Restart Required : Possible
+State : Disabled
+
+Custom Properties:
+
+(No custom properties found)
+
+The operation completed successfully.
+"""
+
+DRIVERS = """
+Obtaining list of 3rd party drivers from the driver store...
+
+Driver packages listing:
+
+Published Name : oem0.inf
+Original File Name : e1d68x64.inf
+Inbox : No
+Class Name : Net
+Provider Name : Intel
+Date : 3/15/2021
+Version : 12.19.1.37
+
+Published Name : oem1.inf
+Original File Name : prnms001.inf
+Inbox : Yes
+Class Name : Printer
+Provider Name : Microsoft
+Date : 6/21/2006
+Version : 10.0.19041.1
+
+The operation completed successfully.
+"""
+
+PACKAGES = """
+Packages listing:
+
+Package Identity : Package_for_KB5031356~31bf3856ad364e35~amd64~~19041.3570.1.10
+State : Installed
+Release Type : Security Update
+Install Time : 10/11/2023 7:02 AM
+
+Package Identity : Package_for_ServicingStack_3565~31bf3856ad364e35~amd64~~19041.3565.1.0
+State : Installed
+Release Type : Update
+Install Time : 10/11/2023 6:55 AM
+
+The operation completed successfully.
+"""
+
+MOUNTED = """
+Mounted images:
+
+Mount Dir : C:\\Mount\\mnt_abc
+Image File : D:\\sources\\install.wim
+Image Index : 6
+Mounted Read/Write : Yes
+Status : Needs Remount
+
+The operation completed successfully.
+"""
+
+
+def _lines(text):
+    return text.splitlines()
+
+
+def test_parse_images_list():
+    images = list(PyDism.parse_images(_lines(WIMINFO)))
+    assert [(i.index, i.name, i.size) for i in images] == [
+        (1, "Windows 10 Home", 14935142315),
+        (6, "Windows 10 Pro", 15012345678),
+    ]
+    assert images[0].architecture is None
+
+
+def test_parse_images_details_and_continuation_lines():
+    [img] = PyDism.parse_images(_lines(WIMINFO_INDEX))
+    assert (img.architecture, img.version, img.edition) == ("x64", "10.0.19045", "Professional")
+    blocks = list(PyDism._iter_dism_blocks(_lines(WIMINFO_INDEX)))
+    assert blocks[-1]["Languages"] == "en-US (Default)\nit-IT"
+    assert blocks[-1]["Created"] == "12/7/2019 - 9:51:27 AM"
+
+
+def test_parse_features():
+    feats = list(PyDism.parse_features(_lines(FEATURES)))
+    assert [(f.name, f.state) for f in feats] == [
+        ("NetFx3", "Disabled with Payload Removed"),
+        ("Microsoft-Hyper-V-All", "Enabled"),
+    ]
+
+
+def test_parse_feature_info():
+    [f] = PyDism.parse_features(_lines(FEATUREINFO))
+    assert f.display_name == ".NET Framework 3.5 (includes .NET 2.0 and 3.0)"
+    assert (f.restart_required, f.state) == ("Possible", "Disabled")
+
+
+def test_parse_drivers():
+    drivers = list(PyDism.parse_drivers(_lines(DRIVERS)))
+    assert [(d.published_name, d.original_file_name, d.inbox) for d in drivers] == [
+        ("oem0.inf", "e1d68x64.inf", False),
+        ("oem1.inf", "prnms001.inf", True),
+    ]
+    assert drivers[0].version == "12.19.1.37"
+
+
+def test_parse_packages():
+    pkgs = list(PyDism.parse_packages(_lines(PACKAGES)))
+    assert [p.identity.split("~")[0] for p in pkgs] == ["Package_for_KB5031356", "Package_for_ServicingStack_3565"]
+    assert pkgs[0].release_type == "Security Update"
+
+
+def test_parse_mounted_images_value_with_colons():
+    [m] = PyDism.parse_mounted_images(_lines(MOUNTED))
+    assert m.mount_dir == "C:\\Mount\\mnt_abc"
+    assert m.image_file == "D:\\sources\\install.wim"
+    assert (m.image_index, m.read_write, m.status) == (6, True, "Needs Remount")
+
+
+def test_blank_line_edge_cases():
+    text = "\n\n   \nFeature Name : A\nState : Enabled\n \t\n\n\nFeature Name : B\r\nState : Disabled\r\n"
+    feats = list(PyDism.parse_features(text.splitlines(keepends=True)))
+    assert [(f.name, f.state) for f in feats] == [("A", "Enabled"), ("B", "Disabled")]
+
+
+def test_progress_bar_closes_block():
+    text = "Feature Name : A\nState : Enabled\n[==========================100.0%==========================]\nFeature Name : B\nState : Disabled\n"
+    assert [f.name for f in PyDism.parse_features(_lines(text))] == ["A", "B"]
+
+
+def test_localized_labels_are_not_parsed():
+    # Le etichette localizzate non sono riconosciute: per questo _dism_query forza /English
+    italian = "Indice : 1\nNome : Windows 10 Pro\nDimensioni : 15.012.345.678 byte\n"
+    assert list(PyDism.parse_images(_lines(italian))) == []
+    assert list(PyDism.parse_features(_lines("Nome funzionalità : NetFx3\nStato : Disabilitato\n"))) == []
+
+
+def test_dism_query_forces_english(monkeypatch):
+    seen = {}
+
+    class FakeStream:
+        returncode = 0
+
+        def __init__(self, args, spinner=True):
+            seen["args"] = args
+
+        def __iter__(self):
+            return iter(_lines(FEATURES))
+
+        def tail_text(self):
+            return ""
+
+    monkeypatch.setattr(PyDism, "_DismLineStream", FakeStream)
+    res = PyDism._dism_query(["/Image:C:\\mnt", "/Get-Features"], PyDism.parse_features)
+    assert seen["args"][-1] == "/English"
+    assert res.ok and len(res.records) == 2
+
+
+def test_parse_health_lets_dism_exit_on_its_own(monkeypatch):
+    # Il processo deve arrivare alla sua uscita: un returncode da terminate() segnerebbe come fallita un'immagine sana
+    script = (
+        "import time; print('No component store corruption detected.', flush=True); "
+        "time.sleep(0.5); print('The operation completed successfully.', flush=True)"
+    )
+    real_popen = PyDism._popen_child
+    monkeypatch.setattr(PyDism, "_popen_child", lambda cmd, **kw: real_popen([sys.executable, "-c", script], **kw))
+    stream = PyDism._DismLineStream(["/Cleanup-Image", "/CheckHealth", "/English"], spinner=False)
+    assert PyDism.parse_health(stream) == "healthy"
+    assert stream.returncode == 0
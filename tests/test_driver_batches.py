@@ -0,0 +1,50 @@
+from pathlib import Path
+
+import PyDism
+
+MNT = Path("mnt")
+
+
+def _recorder(rc_for):
+    calls = []
+
+    def runner(args):
+        calls.append(args)
+        return rc_for(args)
+
+    return runner, calls
+
+
+def test_multi_driver_batch_is_one_call():
+    runner, calls = _recorder(lambda args: 0)
+    batch = ["/Add-Driver", "/Driver:a.inf", "/Driver:b.inf", "/ForceUnsigned"]
+    assert PyDism._run_driver_batches(MNT, [batch], runner) == 0
+    assert calls == [["/Image:mnt", *batch]]
+
+
+def test_rejected_multi_driver_batch_falls_back_to_one_call_per_inf():
+    runner, calls = _recorder(lambda args: 87 if sum(a.startswith("/Driver:") for a in args) > 1 else 0)
+    batch = ["/Add-Driver", "/Driver:a.inf", "/Driver:b.inf", "/ForceUnsigned"]
+    assert PyDism._run_driver_batches(MNT, [batch], runner) == 0
+    assert calls[1:] == [
+        ["/Image:mnt", "/Add-Driver", "/Driver:a.inf", "/ForceUnsigned"],
+        ["/Image:mnt", "/Add-Driver", "/Driver:b.inf", "/ForceUnsigned"],
+    ]
+
+
+def test_fallback_reports_first_failing_inf():
+    def rc_for(args):
+        if sum(a.startswith("/Driver:") for a in args) > 1:
+            return 87
+        return 50 if "/Driver:b.inf" in args else 0
+
+    runner, calls = _recorder(rc_for)
+    batch = ["/Add-Driver", "/Driver:a.inf", "/Driver:b.inf", "/Driver:c.inf"]
+    assert PyDism._run_driver_batches(MNT, [batch], runner) == 50
+    assert len(calls) == 4  # il fallimento di b.inf non ferma c.inf
+
+
+def test_single_driver_rc87_is_not_retried():
+    runner, calls = _recorder(lambda args: 87)
+    assert PyDism._run_driver_batches(MNT, [["/Add-Driver", "/Driver:a.inf"]], runner) == 87
+    assert len(calls) == 1
@@ -0,0 +1,27 @@
+import struct
+
+import PyDism
+
+
+def _swm(path, guid, part, total):
+    hdr = bytearray(PyDism._WIM_HEADER_SIZE)
+    hdr[:8] = b"MSWIM\x00\x00\x00"
+    struct.pack_into("<IIII", hdr, 8, PyDism._WIM_HEADER_SIZE, 0x10D00, 0, 32768)
+    hdr[24:40] = bytes([guid]) * 16
+    struct.pack_into("<HHI", hdr, 40, part, total, 1)
+    path.write_bytes(bytes(hdr))
+    return path
+
+
+def test_swm_parts_skips_other_sets_with_the_same_prefix(tmp_path):
+    first = _swm(tmp_path / "install.swm", 1, 1, 3)
+    _swm(tmp_path / "install2.swm", 1, 2, 3)
+    _swm(tmp_path / "install10.swm", 1, 3, 3)  # numero di file non in ordine lessicale
+    _swm(tmp_path / "install_old.swm", 2, 1, 1)
+    _swm(tmp_path / "install3.swm", 2, 2, 2)  # nome valido ma GUID di un altro set
+    assert [p.name for p in PyDism._swm_parts(first)] == ["install.swm", "install2.swm", "install10.swm"]
+
+
+def test_media_sources_keeps_single_image(tmp_path):
+    wim = tmp_path / "install.wim"
+    assert PyDism._media_sources(wim) == [wim]
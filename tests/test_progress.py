@@ -0,0 +1,34 @@
+import time
+
+import PyDism
+
+
+def _task(rate):
+    return PyDism.ProgressTask("k", "install.wim:1", "export", 40.0, "running", time.monotonic() - 10, rate)
+
+
+def test_row_shows_rate():
+    row = PyDism._Dashboard.format_row(_task(123.45), 120)
+    assert " 123.5 MB/s" in row
+    assert "40%" in row and "ETA" in row
+
+
+def test_row_shows_placeholder_until_rate_is_known():
+    assert "    -- MB/s" in PyDism._Dashboard.format_row(_task(None), 120)
+
+
+def test_row_fits_a_80_column_terminal():
+    assert len(PyDism._Dashboard.format_row(_task(9999.9), 80)) <= 79
+
+
+def test_board_rate_from_byte_counter(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(PyDism.time, "monotonic", lambda: clock[0])
+    board = PyDism._ProgressBoard()
+    board.add("t", "target")
+    for i in range(5):
+        board.update("t", phase="write", done_bytes=i * 50 * 1024 * 1024)
+        clock[0] += 1.0
+    assert round(board._snapshot()[0].rate, 1) == 50.0
+    board.update("t", phase="verify")
+    assert board._snapshot()[0].rate is None